@@ -1,14 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from web3 import Web3
 import ipfsapi
 
 from config import Config
-from database import get_db, init_db
+from database import async_engine, engine, get_async_db, init_db
 from models import User, Book, Purchase, Royalty, UserRole
-from auth import get_current_user, authenticate_user, create_access_token
+from auth import (
+    get_current_user, authenticate_user, create_access_token, create_user_access_token,
+    get_password_hash_async, password_pool
+)
+from utils.blobstore import get_blob_cache
+from utils.cache import get_book_cache
+from utils.ipfs import close_ipfs_client
+from utils.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware, instrument_engine
+from utils.rpc import CircuitOpen
+from utils.sales import get_sales_counter
+from utils.thumbnails import thumbnail_pool
+from utils.transactions import get_tx_pipeline
+from utils.web3_utils import get_web3
 from schemas import (
     UserCreate, UserLogin, UserResponse,
     BookCreate, BookResponse,
@@ -27,34 +40,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, query counts and DB/Web3/IPFS time, served at /metrics
+if Config.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+    instrument_engine(async_engine)
+
 # Initialize Web3 and IPFS
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_PROVIDER_URI))
+web3 = get_web3()
 ipfs = ipfsapi.Client(Config.IPFS_HOST, Config.IPFS_PORT)
 
+@app.exception_handler(CircuitOpen)
+async def circuit_open_handler(request: Request, exc: CircuitOpen):
+    # Fail fast rather than queueing requests behind an unreachable node
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Blockchain node unavailable, please retry shortly"},
+        headers={"Retry-After": str(int(Config.WEB3_BREAKER_RESET))}
+    )
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
-    # Implementation for user registration
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.username == user_data.username))
+    if result.scalars().first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
+
+    # Hash before touching the session so a 429 leaves nothing half-written
+    hashed_password = await get_password_hash_async(user_data.password)
+    user = User(**user_data.dict(exclude={"password"}), hashed_password=hashed_password)
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    return user
 
 @app.post("/auth/login")
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
-    # Implementation for user login
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, user_data.username, user_data.password)
+    if not user or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return {"access_token": create_user_access_token(user), "token_type": "bearer"}
 
 # Book endpoints
 @app.get("/books", response_model=List[BookResponse])
-async def get_books(db: Session = Depends(get_db)):
+async def get_books(db: AsyncSession = Depends(get_async_db)):
     # Implementation for getting all books
 
 @app.post("/books", response_model=BookResponse)
 async def create_book(
     book_data: BookCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for creating a new book
 
 @app.get("/books/{book_id}", response_model=BookResponse)
-async def get_book(book_id: int, db: Session = Depends(get_db)):
+async def get_book(book_id: int, db: AsyncSession = Depends(get_async_db)):
     # Implementation for getting a specific book
 
 # Purchase endpoints
@@ -63,7 +111,7 @@ async def purchase_book(
     book_id: int,
     purchase_data: PurchaseCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for purchasing a book
 
@@ -71,7 +119,7 @@ async def purchase_book(
 @app.get("/user/books", response_model=List[BookResponse])
 async def get_user_books(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for getting user's purchased books
 
@@ -79,14 +127,14 @@ async def get_user_books(
 @app.get("/author/books", response_model=List[BookResponse])
 async def get_author_books(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for getting author's books
 
 @app.get("/author/royalties", response_model=List[RoyaltyResponse])
 async def get_author_royalties(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for getting author's royalties
 
@@ -94,7 +142,7 @@ async def get_author_royalties(
 @app.get("/seller/books", response_model=List[BookResponse])
 async def get_seller_books(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for getting seller's books
 
@@ -103,11 +151,39 @@ async def update_book(
     book_id: int,
     book_data: BookCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Implementation for updating a book
 
+# Cache statistics, for sizing CACHE_MAX_ENTRIES / CACHE_TTL
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return get_book_cache().stats()
+
+# RPC endpoint latency and circuit breaker state
+@app.get("/rpc/stats")
+async def get_rpc_stats():
+    return web3.provider.stats()
+
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 # Initialize database
 @app.on_event("startup")
 async def startup_event():
-    init_db()
\ No newline at end of file
+    init_db()
+    await get_tx_pipeline().start()
+    await get_blob_cache().start()
+    await get_sales_counter().start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await get_tx_pipeline().stop()
+    await get_blob_cache().stop()
+    await get_sales_counter().stop()
+    await close_ipfs_client()
+    password_pool.shutdown()
+    thumbnail_pool.shutdown()
+    web3.provider.close()
\ No newline at end of file
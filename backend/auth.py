@@ -1,23 +1,65 @@
-from datetime import datetime, timedelta
-from typing import Optional
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from models import User
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, UserRole
+from database import get_async_db
 from config import Config
+from utils.cache import get_principal_cache
+from utils.executor import BoundedExecutor, ExecutorSaturated
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Columns kept in the principal cache; the password hash never leaves the database
+PRINCIPAL_FIELDS = (
+    "id", "username", "email", "eth_address", "role", "is_active",
+    "tokens_valid_after", "created_at", "updated_at"
+)
+
+@dataclass
+class TokenPrincipal:
+    """Identity taken from the token claims alone"""
+    id: int
+    username: str
+    role: UserRole
+
+password_pool = BoundedExecutor(
+    workers=Config.PASSWORD_WORKERS,
+    max_pending=Config.PASSWORD_MAX_PENDING,
+    name="password"
+)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def _run_password_work(fn, *args):
+    try:
+        return await password_pool.run(fn, *args)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many authentication requests, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password off the event loop; 429 when the password pool is saturated"""
+    return await _run_password_work(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash off the event loop; 429 when the password pool is saturated"""
+    return await _run_password_work(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -28,30 +70,116 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, Config.JWT_SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def create_user_access_token(user: User, expires_delta: Optional[timedelta] = None) -> str:
+    """Access token carrying the user's id and role so role checks can skip the database"""
+    if expires_delta is None:
+        expires_delta = timedelta(seconds=Config.JWT_ACCESS_TOKEN_EXPIRES)
+    return create_access_token(
+        # Sub-second iat, so a token issued right after a revocation is still newer
+        {"sub": user.username, "uid": user.id, "role": user.role.value, "iat": time.time()},
+        expires_delta
+    )
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-        
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def _dump_principal(user: User) -> dict:
+    fields = {name: getattr(user, name) for name in PRINCIPAL_FIELDS}
+    fields["role"] = user.role.value if user.role else None
+    return fields
+
+def _load_principal(fields: dict) -> User:
+    fields = dict(fields)
+    fields["role"] = UserRole(fields["role"]) if fields["role"] else None
+    for name in ("tokens_valid_after", "created_at", "updated_at"):
+        if fields[name] is not None:
+            fields[name] = datetime.fromisoformat(fields[name])
+    return User(**fields)
+
+def _timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def _issued_before(payload: dict, cutoff: Optional[float]) -> bool:
+    return cutoff is not None and payload.get("iat", 0) <= cutoff
+
+def revoke_user_tokens(user: User):
+    """Reject the user's tokens issued before now; the caller commits"""
+    user.tokens_valid_after = datetime.utcnow()
+
+def invalidate_principal(user: User, *previous_usernames: str, revoke_tokens: bool = False):
+    """
+    Drop cached copies of the user after a profile change. Pass revoke_tokens
+    when the committed change called revoke_user_tokens() so the claims of older
+    tokens stop being trusted right away.
+    """
+    cache = get_principal_cache()
+    cache.invalidate(user.username, *previous_usernames)
+    if revoke_tokens and user.tokens_valid_after is not None:
+        cache.revoke(user.username, _timestamp(user.tokens_valid_after))
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """
+    Resolve the token's user, served from the principal cache for up to
+    AUTH_CACHE_TTL seconds. Cached users are not attached to db; load the
+    row from the session before modifying it.
+    """
+    payload = _decode_token(token)
+    username = payload["sub"]
+    cache = get_principal_cache()
+    fields = cache.get(username)
+    if fields is not None:
+        user = _load_principal(fields)
+    else:
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
+        if user is None or not user.is_active:
+            raise _credentials_exception()
+        cache.set(username, _dump_principal(user))
+    if user.tokens_valid_after is not None and _issued_before(payload, _timestamp(user.tokens_valid_after)):
+        raise _credentials_exception()
     return user
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def get_token_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Union[TokenPrincipal, User]:
+    """
+    Identity for endpoints that only need the user's id and role. Tokens from
+    create_user_access_token are answered from their claims (the session is
+    never used) when revocations reach every process, i.e. on the Redis
+    cache; otherwise, and for older tokens, this falls back to get_current_user.
+    """
+    payload = _decode_token(token)
+    cache = get_principal_cache()
+    if "uid" not in payload or "role" not in payload or not cache.shared:
+        return await get_current_user(token, db)
+    if _issued_before(payload, cache.revoked_at(payload["sub"])):
+        raise _credentials_exception()
+    try:
+        role = UserRole(payload["role"])
+    except ValueError:
+        raise _credentials_exception()
+    return TokenPrincipal(id=payload["uid"], username=payload["sub"], role=role)
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalars().first()
+    if not user or not await verify_password_async(password, user.hashed_password):
         return None
     return user
\ No newline at end of file
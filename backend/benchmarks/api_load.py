@@ -0,0 +1,495 @@
+"""
+Load benchmark for the bookstore API routes.
+
+Seeds a synthetic dataset (--scale multiplies the default counts of users,
+books, purchases and royalties), mounts the book, user, author and seller
+routers in an in-process app and drives each scenario with --concurrency
+clients for --requests requests. The transaction pipeline is replaced by
+a recorder and the IPFS client by an httpx.MockTransport, so no node or
+IPFS daemon is needed and only the API and its database are measured.
+
+The JSON report holds RPS, latency percentiles and SQL statements per
+request for every scenario, with the commit and settings it ran with.
+--compare checks it against an earlier report and exits with status 1
+when a scenario's p95 latency grew by more than --threshold percent.
+
+Scenarios run at --concurrency, except books_list_200_readers, which
+always has 200 clients. books_deep_page reads catalog page --deep-page
+by cursor; the report's deep_pages section times the query for that page
+with OFFSET and with the keyset the route uses. --books overrides the
+book count of --scale, for catalog and search runs at millions of books.
+
+    python benchmarks/api_load.py --scale 1 --concurrency 20 --output base.json
+    python benchmarks/api_load.py --scale 1 --concurrency 20 --compare base.json
+    python benchmarks/api_load.py --books 5000000 --scenario books_deep_page --scenario book_search
+
+Runs on a temporary SQLite file unless BENCH_DATABASE_URL is set; the
+tables of that database are dropped and recreated.
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), "bookstore_api_load.db")
+os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL", f"sqlite:///{DB_PATH}")
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from sqlalchemy import select, text  # noqa: E402
+
+import auth  # noqa: E402
+from database import AsyncSessionLocal, Base, async_engine, engine  # noqa: E402
+from models import Book, Purchase, TransactionStatus, User, UserRole  # noqa: E402
+from routes.migrations.init_db import INDEXES  # noqa: E402
+from utils import ipfs, rollups, royalties, sales  # noqa: E402
+from utils.pagination import apply_keyset, encode_cursor  # noqa: E402
+from utils.querycount import count_queries  # noqa: E402
+from utils.search import create_search_index  # noqa: E402
+from utils.transactions import get_available_tx_pipeline  # noqa: E402
+
+# Modules book_routes and seller_routes import relatively, as backend.*
+SHARED_MODULES = (
+    "config", "database", "models", "schemas", "auth", "utils", "utils.blobstore", "utils.cache",
+    "utils.catalog_import", "utils.export", "utils.ipfs", "utils.pagination", "utils.search",
+    "utils.thumbnails", "utils.transactions"
+)
+
+INSERT_BATCH_SIZE = 5000
+# Scenarios that run at a fixed concurrency whatever --concurrency says
+SCENARIO_CONCURRENCY = {"books_list_200_readers": 200}
+# Catalog order read by books_deep_page and deep_pages: the route's newest sort
+DEEP_PAGE_KEY = (Book.created_at, Book.id)
+DEEP_PAGE_LIMIT = 20
+WORDS = ("ledger", "chain", "harbor", "garden", "winter", "signal", "atlas", "ember", "quiet", "river")
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+@dataclass
+class Dataset:
+    buyers: int
+    authors: int
+    sellers: int
+    books: int
+    purchases_per_buyer: int
+    days: int = 90
+
+    @classmethod
+    def at_scale(cls, scale: float) -> "Dataset":
+        return cls(
+            buyers=max(10, int(2000 * scale)),
+            authors=max(2, int(50 * scale)),
+            sellers=max(2, int(20 * scale)),
+            books=max(50, int(2000 * scale)),
+            purchases_per_buyer=20
+        )
+
+    @property
+    def purchases(self) -> int:
+        return self.buyers * self.purchases_per_buyer
+
+    def bought(self, buyer: int, n: int) -> int:
+        """Index of the n-th book bought by a buyer; distinct for n < books"""
+        return (buyer * 7 + n) % self.books
+
+class RecordingPipeline:
+    """Stands in for the transaction pipeline: jobs are kept, never sent"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, job):
+        self.jobs.append(job)
+
+async def ipfs_add(request: httpx.Request) -> httpx.Response:
+    body = await request.aread()
+    return httpx.Response(200, json={"Hash": "Qm" + hashlib.sha256(body).hexdigest()[:44]})
+
+def load_routers() -> list:
+    package = sys.modules.setdefault("backend", types.ModuleType("backend"))
+    package.__path__ = [BACKEND_DIR]
+    for name in SHARED_MODULES:
+        sys.modules.setdefault(f"backend.{name}", importlib.import_module(name))
+    from backend.routes import book_routes, seller_routes
+    from routes import author_routes, user_routes
+
+    return [
+        (book_routes.router, ""),
+        (seller_routes.router, ""),
+        (user_routes.router, "/user"),
+        (author_routes.router, "/author"),
+    ]
+
+def build_app(pipeline: RecordingPipeline) -> FastAPI:
+    app = FastAPI()
+    for router, prefix in load_routers():
+        app.include_router(router, prefix=prefix)
+    app.dependency_overrides[get_available_tx_pipeline] = lambda: pipeline
+    return app
+
+def _insert(connection, table, rows: Iterable[dict]):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+        if not batch:
+            return
+        connection.execute(table.insert(), batch)
+
+def seed(dataset: Dataset, rng: random.Random) -> Dict[str, List[Tuple[int, str]]]:
+    """Create the dataset; returns (id, token) pairs per kind of user"""
+    if engine.dialect.name == "sqlite" and os.path.exists(DB_PATH):
+        engine.dispose()
+        os.remove(DB_PATH)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    now = datetime.utcnow()
+    kinds = (("buyer", UserRole.USER, dataset.buyers), ("author", UserRole.AUTHOR, dataset.authors),
+             ("seller", UserRole.SELLER, dataset.sellers))
+    users, next_id = [], 1
+    ids: Dict[str, List[int]] = {}
+    for kind, role, count in kinds:
+        ids[kind] = list(range(next_id, next_id + count))
+        users += [
+            {"id": user_id, "username": f"{kind}{user_id}", "email": f"{kind}{user_id}@bench.local",
+             "eth_address": "0x%040x" % user_id, "role": role, "is_active": True,
+             "created_at": now, "updated_at": now}
+            for user_id in ids[kind]
+        ]
+        next_id += count
+
+    # Generated while inserted, so millions of books fit in memory; purchases need their prices
+    prices = array("d")
+    book_rows = (
+        {"id": i + 1, "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+         "description": " ".join(rng.choice(WORDS) for _ in range(12)),
+         "price": round(rng.uniform(0.001, 0.1), 4), "pdf_hash": "Qm%044x" % i,
+         "cover_hash": "Qm%044x" % (i + dataset.books), "royalty_percentage": rng.choice((5, 10, 15)),
+         "is_active": True, "total_sales": 0, "contract_id": i + 1, "tx_status": TransactionStatus.CONFIRMED,
+         "author_id": ids["author"][i % dataset.authors], "seller_id": ids["seller"][i % dataset.sellers],
+         "created_at": now - timedelta(days=dataset.days, seconds=-i), "updated_at": now}
+        for i in range(dataset.books)
+    )
+
+    def books():
+        for row in book_rows:
+            prices.append(row["price"])
+            yield row
+
+    with engine.begin() as connection:
+        _insert(connection, User.__table__, users)
+        _insert(connection, Book.__table__, books())
+        purchases = []
+        for buyer_index, buyer_id in enumerate(ids["buyer"]):
+            for n in range(dataset.purchases_per_buyer):
+                index = dataset.bought(buyer_index, n)
+                purchases.append({
+                    "id": len(purchases) + 1, "user_id": buyer_id, "book_id": index + 1,
+                    "price_paid": prices[index], "transaction_hash": "0x%064x" % (len(purchases) + 1),
+                    "purchase_date": now - timedelta(seconds=rng.randrange(dataset.days * 86400)),
+                    "is_verified": True, "block_number": len(purchases) + 1,
+                    "tx_status": TransactionStatus.CONFIRMED
+                })
+        _insert(connection, Purchase.__table__, purchases)
+        # The indexes a deployment gets from the migration script, built after the bulk insert
+        for statement in INDEXES:
+            connection.execute(text(statement))
+        royalties.settle(connection)
+        royalties.reconcile(connection)
+        rollups.backfill(connection)
+        sales.rebuild(connection)
+        create_search_index(connection, rebuild=True)
+
+    tokens = {}
+    for kind, role, _ in kinds:
+        tokens[kind] = [
+            (user_id, auth.create_user_access_token(User(id=user_id, username=f"{kind}{user_id}", role=role)))
+            for user_id in ids[kind]
+        ]
+    return tokens
+
+Request = Tuple[str, str, dict]
+
+def scenarios(
+    dataset: Dataset,
+    tokens: Dict[str, List[Tuple[int, str]]],
+    deep_cursor: Optional[str] = None
+) -> Dict[str, Callable[[random.Random, int], Request]]:
+    def bearer(kind: str, rng: random.Random) -> dict:
+        return {"Authorization": f"Bearer {rng.choice(tokens[kind])[1]}"}
+
+    def purchase(rng: random.Random, i: int) -> Request:
+        # Each request buys a book its buyer does not own yet
+        buyer = i % dataset.buyers
+        book_id = dataset.bought(buyer, dataset.purchases_per_buyer + i // dataset.buyers) + 1
+        user_id, token = tokens["buyer"][buyer]
+        return "POST", f"/books/{book_id}/purchase", {
+            "json": {"book_id": book_id}, "headers": {"Authorization": f"Bearer {token}"}
+        }
+
+    def wallet_purchase(rng: random.Random, i: int) -> Request:
+        buyer = (i + dataset.buyers // 2) % dataset.buyers
+        book_id = dataset.bought(buyer, dataset.books // 2 + i // dataset.buyers) + 1
+        user_id, token = tokens["buyer"][buyer]
+        return "POST", f"/user/books/{book_id}/purchase", {
+            "params": {"transaction_hash": "0x%064x" % (10 ** 12 + i)},
+            "headers": {"Authorization": f"Bearer {token}"}
+        }
+
+    def purchase_hot_title(rng: random.Random, i: int) -> Request:
+        # Every buyer after the same book, as on a launch day
+        user_id, token = tokens["buyer"][i % dataset.buyers]
+        return "POST", f"/books/{dataset.books}/purchase", {
+            "json": {"book_id": dataset.books}, "headers": {"Authorization": f"Bearer {token}"}
+        }
+
+    def create_book(rng: random.Random, i: int) -> Request:
+        return "POST", "/seller/books/upload", {
+            "data": {"title": f"Bench upload {i}", "price": "0.01", "royalty_percentage": "10"},
+            "files": {"pdf_file": (f"{i}.pdf", os.urandom(4096), "application/pdf")},
+            "headers": bearer("seller", rng)
+        }
+
+    def books_list(rng: random.Random, i: int) -> Request:
+        # Varied filters, so most pages miss the catalog cache
+        return "GET", "/books/", {"params": {
+            "limit": 20, "sort": rng.choice(("newest", "price_asc")), "min_price": round(rng.uniform(0, 0.05), 3)
+        }}
+
+    return {
+        "books_list": books_list,
+        "books_list_200_readers": books_list,
+        "books_list_cached": lambda rng, i: ("GET", "/books/", {"params": {"limit": 20}}),
+        "books_deep_page": lambda rng, i: ("GET", "/books/", {"params": {
+            "limit": DEEP_PAGE_LIMIT, "sort": "newest", "cursor": deep_cursor,
+            # A different filter per request keeps the page out of the catalog cache
+            "min_price": round(rng.uniform(0, 0.001), 7)
+        }}),
+        "book_detail": lambda rng, i: ("GET", f"/books/{rng.randrange(dataset.books) + 1}", {}),
+        "book_search": lambda rng, i: ("GET", "/books/search", {"params": {"q": rng.choice(WORDS)}}),
+        # Every WORDS entry is in most books; a book's number is in one or a few
+        "book_search_selective": lambda rng, i: ("GET", "/books/search", {"params": {
+            "q": str(rng.randrange(dataset.books))
+        }}),
+        "bestsellers": lambda rng, i: ("GET", "/books/bestsellers", {"params": {"limit": rng.choice((10, 50))}}),
+        "purchase": purchase,
+        "wallet_purchase": wallet_purchase,
+        "user_library": lambda rng, i: ("GET", "/user/books", {"params": {"limit": 20}, "headers": bearer("buyer", rng)}),
+        "user_purchases": lambda rng, i: ("GET", "/user/purchases", {"headers": bearer("buyer", rng)}),
+        "author_stats": lambda rng, i: ("GET", "/author/stats", {"headers": bearer("author", rng)}),
+        "author_sales_report": lambda rng, i: ("GET", "/author/sales-report", {"headers": bearer("author", rng)}),
+        "author_royalties": lambda rng, i: ("GET", "/author/royalties", {"headers": bearer("author", rng)}),
+        "seller_books": lambda rng, i: ("GET", "/seller/books", {"headers": bearer("seller", rng)}),
+        "seller_sales": lambda rng, i: ("GET", "/seller/sales", {"params": {"limit": 50}, "headers": bearer("seller", rng)}),
+        "seller_create_book": create_book,
+        # Last: buyers who own the hot title already make later purchase scenarios conflict
+        "purchase_hot_title": purchase_hot_title,
+    }
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    make_request: Callable[[random.Random, int], Request],
+    requests: int,
+    concurrency: int,
+    seed_value: int,
+    first: int = 0
+) -> dict:
+    rng = random.Random(seed_value)
+    # Request numbers continue across runs so purchases never repeat a (buyer, book) pair
+    planned = [make_request(rng, first + i) for i in range(requests)]
+    remaining = iter(planned)
+    samples: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def worker():
+        for method, url, kwargs in remaining:
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            samples.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    with count_queries(async_engine) as counter:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    errors = sum(count for code, count in statuses.items() if code >= 400)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "rps": round(requests / elapsed, 1),
+        **percentiles(samples),
+        "queries_per_request": round(counter.count / requests, 2),
+    }
+
+def deep_page_cursor(page: int) -> Optional[str]:
+    """Cursor that makes the newest-first catalog return this page, or None for page 1"""
+    if page <= 1:
+        return None
+    query = select(*DEEP_PAGE_KEY).order_by(*[c.desc() for c in DEEP_PAGE_KEY])
+    with engine.connect() as connection:
+        row = connection.execute(query.offset((page - 1) * DEEP_PAGE_LIMIT - 1).limit(1)).first()
+    return encode_cursor(row) if row else None
+
+async def time_deep_page(page: int, cursor: Optional[str], repeats: int) -> dict:
+    """Latency of one catalog page read with OFFSET and with the keyset cursor"""
+    ordered = select(Book).order_by(*[c.desc() for c in DEEP_PAGE_KEY])
+    queries = {
+        "offset": ordered.offset((page - 1) * DEEP_PAGE_LIMIT).limit(DEEP_PAGE_LIMIT),
+        "keyset": apply_keyset(select(Book), DEEP_PAGE_KEY, True, cursor).limit(DEEP_PAGE_LIMIT),
+    }
+    result = {"page": page, "limit": DEEP_PAGE_LIMIT}
+    async with AsyncSessionLocal() as db:
+        pages = {}
+        for name, query in queries.items():
+            samples = []
+            for _ in range(repeats + 1):
+                started = time.perf_counter()
+                pages[name] = [book.id for book in (await db.execute(query)).scalars()]
+                samples.append(time.perf_counter() - started)
+                db.expunge_all()
+            # The first read also warms the page cache; leave it out
+            result[name] = percentiles(samples[1:])
+    result["same_rows"] = pages["offset"] == pages["keyset"]
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    dataset = Dataset.at_scale(args.scale)
+    if args.books:
+        dataset.books = args.books
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    tokens = seed(dataset, rng)
+    seed_seconds = time.perf_counter() - started
+
+    ipfs._client = httpx.AsyncClient(base_url="http://ipfs.bench/api/v0", transport=httpx.MockTransport(ipfs_add))
+    pipeline = RecordingPipeline()
+    app = build_app(pipeline)
+    deep_page = min(args.deep_page, -(-dataset.books // DEEP_PAGE_LIMIT))
+    deep_cursor = deep_page_cursor(deep_page)
+    # Before the write scenarios add books ahead of the page
+    deep_pages = await time_deep_page(deep_page, deep_cursor, args.deep_repeats)
+    selected = scenarios(dataset, tokens, deep_cursor)
+    names = args.scenarios or list(selected)
+    unknown = set(names) - set(selected)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {}
+    # A failing request is a 500 in the report's errors, as it would be behind a server
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for index, name in enumerate(names):
+            concurrency = SCENARIO_CONCURRENCY.get(name, args.concurrency)
+            # Warm up connections and caches the same way for every commit
+            await run_scenario(client, selected[name], args.warmup, concurrency, args.seed + 1000 + index)
+            results[name] = await run_scenario(
+                client, selected[name], args.requests, concurrency, args.seed + index, first=args.warmup
+            )
+            results[name]["concurrency"] = concurrency
+    await ipfs.close_ipfs_client()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "settings": {
+            "scale": args.scale, "books": args.books, "requests": args.requests, "warmup": args.warmup,
+            "concurrency": args.concurrency, "seed": args.seed, "deep_page": deep_page
+        },
+        "dataset": {
+            "users": dataset.buyers + dataset.authors + dataset.sellers, "books": dataset.books,
+            "purchases": dataset.purchases, "seed_s": round(seed_seconds, 2)
+        },
+        "transactions_queued": len(pipeline.jobs),
+        "scenarios": results,
+        "deep_pages": deep_pages,
+    }
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Print the change from baseline per scenario; False if any p95 regressed past threshold percent"""
+    ok = True
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            print(f"{name:22} new")
+            continue
+        change = lambda key: (result[key] - before[key]) / before[key] * 100 if before.get(key) else 0.0
+        regressed = change("p95_ms") > threshold
+        ok = ok and not regressed
+        print(
+            f"{name:22} rps {before['rps']:>9} -> {result['rps']:<9} ({change('rps'):+.1f}%)  "
+            f"p95 {before['p95_ms']:>8} -> {result['p95_ms']:<8} ms ({change('p95_ms'):+.1f}%)  "
+            f"queries {before['queries_per_request']} -> {result['queries_per_request']}"
+            + ("  REGRESSED" if regressed else "")
+        )
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scale", type=float, default=1.0, help="dataset size; 1 is 2000 buyers and books")
+    parser.add_argument("--books", type=int, help="number of books, instead of the one --scale gives")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--deep-page", type=int, default=10000, help="catalog page read by books_deep_page")
+    parser.add_argument("--deep-repeats", type=int, default=20, help="timed reads per query in deep_pages")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the dataset and request mix")
+    parser.add_argument("--scenario", dest="scenarios", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed p95 growth in percent")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    auth.password_pool.shutdown()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
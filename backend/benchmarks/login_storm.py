@@ -0,0 +1,147 @@
+"""
+Login-storm benchmark: latency of a cheap endpoint while logins flood in.
+
+Runs an in-process ASGI app with a /login route backed by
+auth.authenticate_user and a /ping route that does one indexed query, and
+measures /ping before and during a burst of concurrent logins. With
+--inline the password check runs on the event loop as it used to, which
+shows the stall the password pool removes.
+
+    python benchmarks/login_storm.py --logins 200 --concurrency 50
+    python benchmarks/login_storm.py --logins 200 --concurrency 50 --inline
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+DB_PATH = os.path.join(tempfile.gettempdir(), "bookstore_login_storm.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import httpx  # noqa: E402
+from fastapi import FastAPI, HTTPException  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+import auth  # noqa: E402
+from database import AsyncSessionLocal, init_db  # noqa: E402
+from models import User  # noqa: E402
+
+USERNAME = "storm"
+PASSWORD = "correct horse battery staple"
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def build_app(inline: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/login")
+    async def login(payload: dict):
+        async with AsyncSessionLocal() as db:
+            if inline:
+                result = await db.execute(select(User).where(User.username == payload["username"]))
+                user = result.scalars().first()
+                ok = user is not None and auth.verify_password(payload["password"], user.hashed_password)
+            else:
+                ok = await auth.authenticate_user(db, payload["username"], payload["password"]) is not None
+        if not ok:
+            raise HTTPException(status_code=401)
+        return {"ok": True}
+
+    @app.get("/ping")
+    async def ping():
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User.id).where(User.username == USERNAME))
+            return {"id": result.scalar()}
+
+    return app
+
+async def seed():
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    init_db()
+    async with AsyncSessionLocal() as db:
+        db.add(User(username=USERNAME, hashed_password=auth.get_password_hash(PASSWORD)))
+        await db.commit()
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list:
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/ping")
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return samples
+
+async def storm(client: httpx.AsyncClient, logins: int, concurrency: int) -> dict:
+    statuses = {}
+    remaining = iter(range(logins))
+
+    async def worker():
+        for _ in remaining:
+            response = await client.post("/login", json={"username": USERNAME, "password": PASSWORD})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "logins_per_s": round(logins / elapsed, 1),
+        "status_codes": statuses,
+    }
+
+async def run(args) -> dict:
+    await seed()
+    app = build_app(args.inline)
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        stop = asyncio.Event()
+        idle = asyncio.create_task(probe(client, stop, args.probe_interval))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        baseline = await idle
+
+        stop = asyncio.Event()
+        busy = asyncio.create_task(probe(client, stop, args.probe_interval))
+        logins = await storm(client, args.logins, args.concurrency)
+        stop.set()
+        during = await busy
+
+    return {
+        "mode": "inline" if args.inline else "pool",
+        "password_pool": auth.password_pool.stats(),
+        "logins": logins,
+        "ping_baseline": percentiles(baseline),
+        "ping_during_storm": percentiles(during),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--inline", action="store_true", help="verify passwords on the event loop")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="seconds between /ping calls")
+    parser.add_argument("--baseline-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    auth.password_pool.shutdown()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
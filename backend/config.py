@@ -1,5 +1,5 @@
 import os
-from dotenv import load_load_dotenv
+from dotenv import load_dotenv
 
 load_dotenv()
 
@@ -10,18 +10,107 @@ class Config:
     
     # Database configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bookstore.db')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds; keep below server and proxy idle timeouts
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))  # milliseconds, PostgreSQL only; 0 disables
+    # Comma-separated read replicas of DATABASE_URL, used by the read-only routes
+    DATABASE_REPLICA_URLS = [url for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url]
     
     # JWT configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-jwt-secret-key')
     JWT_ACCESS_TOKEN_EXPIRES = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))  # 1 hour
+    AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 30))  # seconds
+
+    # Password hashing pool; bcrypt releases the GIL, so threads scale with cores
+    PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', os.cpu_count() or 4))
+    PASSWORD_MAX_PENDING = int(os.getenv('PASSWORD_MAX_PENDING', 64))
     
     # Web3 configuration
     WEB3_PROVIDER_URI = os.getenv('WEB3_PROVIDER_URI', 'http://localhost:8545')
+    # Comma-separated endpoints, tried lowest latency first
+    WEB3_PROVIDER_URIS = os.getenv('WEB3_PROVIDER_URIS', WEB3_PROVIDER_URI).split(',')
+    WEB3_POOL_SIZE = int(os.getenv('WEB3_POOL_SIZE', 20))  # keep-alive connections per endpoint
+    WEB3_TIMEOUT = float(os.getenv('WEB3_TIMEOUT', 10.0))  # seconds
+    WEB3_RETRIES = int(os.getenv('WEB3_RETRIES', 2))
+    WEB3_SLOW_THRESHOLD = float(os.getenv('WEB3_SLOW_THRESHOLD', 2.0))  # seconds; slower responses count as failures
+    WEB3_BREAKER_FAILURES = int(os.getenv('WEB3_BREAKER_FAILURES', 5))
+    WEB3_BREAKER_RESET = float(os.getenv('WEB3_BREAKER_RESET', 30.0))  # seconds before retrying an open endpoint
     CONTRACT_ADDRESS = os.getenv('CONTRACT_ADDRESS')
+    CONTRACT_ABI_PATH = os.getenv(
+        'CONTRACT_ABI_PATH',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'build', 'contracts', 'BookStore.json')
+    )
+    CONTRACT_READ_CACHE_TTL = float(os.getenv('CONTRACT_READ_CACHE_TTL', 5.0))  # seconds
+    CONTRACT_READ_BATCH_SIZE = int(os.getenv('CONTRACT_READ_BATCH_SIZE', 500))  # eth_calls per JSON-RPC batch
+
+    # Transaction pipeline configuration
+    TX_WORKERS = int(os.getenv('TX_WORKERS', 4))
+    TX_QUEUE_SIZE = int(os.getenv('TX_QUEUE_SIZE', 1000))
+    TX_RECEIPT_POLL_INTERVAL = float(os.getenv('TX_RECEIPT_POLL_INTERVAL', 2.0))  # seconds
+    TX_RECEIPT_BATCH_SIZE = int(os.getenv('TX_RECEIPT_BATCH_SIZE', 100))
+    TX_RECOVERY_INTERVAL = float(os.getenv('TX_RECOVERY_INTERVAL', 15.0))  # seconds between sweeps of stored jobs
+    TX_CLAIM_TIMEOUT = float(os.getenv('TX_CLAIM_TIMEOUT', 120.0))  # seconds before another process takes over a job
+    TX_DB_RETRIES = int(os.getenv('TX_DB_RETRIES', 5))  # attempts to record a sent transaction
+    TX_SUBMIT_RETRIES = int(os.getenv('TX_SUBMIT_RETRIES', 5))  # attempts to send a transaction through node errors
+
+    # Event indexer configuration
+    INDEXER_START_BLOCK = int(os.getenv('INDEXER_START_BLOCK', 0))
+    INDEXER_CHUNK_SIZE = int(os.getenv('INDEXER_CHUNK_SIZE', 2000))  # blocks per eth_getLogs
+    INDEXER_CONFIRMATIONS = int(os.getenv('INDEXER_CONFIRMATIONS', 12))  # reorg safety depth
+    INDEXER_REORG_WINDOW = int(os.getenv('INDEXER_REORG_WINDOW', 128))  # checkpoint hashes kept to find a reorg's common ancestor
+    INDEXER_POLL_INTERVAL = float(os.getenv('INDEXER_POLL_INTERVAL', 5.0))  # seconds
+
+    # Purchase verification worker
+    VERIFIER_BATCH_SIZE = int(os.getenv('VERIFIER_BATCH_SIZE', 500))  # receipts per JSON-RPC batch
+    VERIFIER_CONFIRMATIONS = int(os.getenv('VERIFIER_CONFIRMATIONS', 0))
+    VERIFIER_TIMEOUT = float(os.getenv('VERIFIER_TIMEOUT', 3600))  # seconds before an unknown transaction fails
+    VERIFIER_POLL_INTERVAL = float(os.getenv('VERIFIER_POLL_INTERVAL', 5.0))  # seconds
+    ROYALTY_SETTLE_BATCH_SIZE = int(os.getenv('ROYALTY_SETTLE_BATCH_SIZE', 50000))  # purchase ids per INSERT ... SELECT
     
     # IPFS configuration
     IPFS_HOST = os.getenv('IPFS_HOST', 'localhost')
     IPFS_PORT = int(os.getenv('IPFS_PORT', 5001))
+    IPFS_TIMEOUT = float(os.getenv('IPFS_TIMEOUT', 300))  # seconds per upload
+
+    # Local cache of IPFS content served by the API
+    BLOB_CACHE_DIR = os.getenv(
+        'BLOB_CACHE_DIR',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blob_cache')
+    )
+    BLOB_CACHE_MAX_BYTES = int(os.getenv('BLOB_CACHE_MAX_BYTES', 10 * 1024 ** 3))  # 10 GB
+    BLOB_STATS_FLUSH_INTERVAL = float(os.getenv('BLOB_STATS_FLUSH_INTERVAL', 5.0))  # seconds
+
+    # Cover thumbnails, rendered in a process pool on first request
+    THUMBNAIL_WIDTHS = [int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '160,320,640').split(',')]
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_MAX_PENDING = int(os.getenv('THUMBNAIL_MAX_PENDING', 16))
+
+    # Book search
+    SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 1100))  # newest matches ranked; covers /books/search's offset + limit
+    SEARCH_MIN_PREFIX = int(os.getenv('SEARCH_MIN_PREFIX', 3))  # shorter last words are matched whole
+
+    # Bulk catalog imports
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 200))  # manifest rows per insert
+    IMPORT_UPLOAD_CONCURRENCY = int(os.getenv('IMPORT_UPLOAD_CONCURRENCY', 8))  # books uploading at once
+
+    # Sales and royalty exports
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 5000))  # rows per CSV chunk / Parquet row group
+
+    # Book sales counters, added up in memory and written in batches
+    SALES_FLUSH_INTERVAL = float(os.getenv('SALES_FLUSH_INTERVAL', 0.5))  # seconds
+    
+    # Cache configuration
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # 'memory' or 'redis'
+    CACHE_TTL = float(os.getenv('CACHE_TTL', 60))  # seconds
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_REDIS_TIMEOUT = float(os.getenv('CACHE_REDIS_TIMEOUT', 0.5))  # seconds
+
+    # Request metrics, served at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
     
     # CORS configuration
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
\ No newline at end of file
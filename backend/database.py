@@ -1,14 +1,98 @@
+import random
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 from config import Config
 
+# Async drivers used for each sync dialect
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def get_async_url(url: str) -> str:
+    """Translate a sync database URL into its async driver equivalent"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return str(url.set(drivername=ASYNC_DRIVERS[backend]))
+
+def get_connect_args(url: str) -> dict:
+    """Driver-specific connection settings: the PostgreSQL statement timeout"""
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql" or not Config.DB_STATEMENT_TIMEOUT:
+        return {}
+    timeout = str(Config.DB_STATEMENT_TIMEOUT)
+    if url.get_driver_name() == "asyncpg":
+        return {"server_settings": {"statement_timeout": timeout}}
+    return {"options": f"-c statement_timeout={timeout}"}
+
+def get_pool_options(url: str) -> dict:
+    """Connection pool settings from Config (SQLite uses its own pool classes)"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_pre_ping": Config.DB_POOL_PRE_PING,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+        "connect_args": get_connect_args(url),
+    }
+
+def create_api_engine(url: str):
+    """Async engine for a sync database URL, with the pool settings from Config"""
+    async_url = get_async_url(url)
+    return create_async_engine(async_url, **get_pool_options(async_url))
+
 # Create database engine
-engine = create_engine(Config.DATABASE_URL)
+engine = create_engine(Config.DATABASE_URL, **get_pool_options(Config.DATABASE_URL))
+
+# Create async database engine used by the API routes
+async_engine = create_api_engine(Config.DATABASE_URL)
+
+# Async engines for the read replicas; reads go to the primary when there are none
+replica_engines = [create_api_engine(url) for url in Config.DATABASE_REPLICA_URLS]
+
+class ReplicaSession(Session):
+    """
+    Session that reads from a read replica, one picked per session so a
+    request sees a single snapshot. Flushes and INSERT/UPDATE/DELETE
+    statements still go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not replica_engines or self._flushing or isinstance(clause, UpdateBase):
+            return async_engine.sync_engine
+        if "replica" not in self.info:
+            self.info["replica"] = random.choice(replica_engines).sync_engine
+        return self.info["replica"]
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create AsyncSessionLocal class
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# Sessions for read-only work that tolerates replication lag
+ReadSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    sync_session_class=ReplicaSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Create Base class
 Base = declarative_base()
 
@@ -20,6 +104,25 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency to get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    """
+    Dependency to get an async session reading from a replica. Replicas
+    trail the primary, so routes that must see the caller's own recent
+    writes (e.g. access checks right after a purchase) use get_async_db.
+    """
+    async with ReadSessionLocal() as db:
+        yield db
+
 def init_db():
     """Initialize database"""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    import models  # noqa: F401 - registers the tables on Base
+    from utils.search import create_search_index
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        create_search_index(connection)
@@ -0,0 +1,500 @@
+"""
+Incremental indexer for BookStore contract events.
+
+Streams BookAdded, BookUpdated, BookRemoved, BookPurchased and RoyaltyPaid
+logs in block-range chunks, upserts the matching Book/Purchase/Royalty rows
+in bulk (one commit per chunk) and checkpoints progress in BlockchainSync.
+Only blocks at least INDEXER_CONFIRMATIONS deep are indexed. The hashes of
+the last INDEXER_REORG_WINDOW checkpoints are kept (IndexedBlock); if a
+deeper reorg replaces the last indexed block, the checkpoint is rewound to
+the newest of them still on the canonical chain and the range is indexed
+again. Purchases from orphaned blocks go back to SUBMITTED, where the
+verifier takes them off total_sales and the rollups unless they are mined
+again; a purchase marked failed that the chain does include is counted
+again when its event is indexed.
+
+Usage:
+    python indexer.py           # follow the chain
+    python indexer.py --once    # catch up to the confirmed head and exit
+"""
+import argparse
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from eth_utils import event_abi_to_log_topic
+from sqlalchemy import or_
+from web3 import Web3
+
+from config import Config
+from database import SessionLocal
+from models import Book, BlockchainSync, IndexedBlock, Purchase, Royalty, TransactionStatus, User
+from utils.cache import get_book_cache
+from utils.rollups import record_purchases, record_royalties
+from utils.sales import add_sales
+from utils.search import index_books
+from utils.web3_utils import ContractReader, get_contract, get_web3, make_batch_request
+
+logger = logging.getLogger(__name__)
+
+SYNC_TYPE = "events"
+EVENT_NAMES = ("BookAdded", "BookUpdated", "BookRemoved", "BookPurchased", "RoyaltyPaid")
+
+@dataclass
+class IndexerStats:
+    blocks: int = 0
+    events: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def blocks_per_sec(self) -> float:
+        return self.blocks / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def events_per_sec(self) -> float:
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.blocks} blocks, {self.events} events in {self.elapsed:.2f}s "
+            f"({self.blocks_per_sec:.1f} blocks/s, {self.events_per_sec:.1f} events/s)"
+        )
+
+def _to_int(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+def _from_wei(value: int) -> float:
+    return float(Web3.from_wei(value, "ether"))
+
+def _to_hex(value) -> str:
+    return value if isinstance(value, str) else Web3.to_hex(value)
+
+class EventIndexer:
+    def __init__(
+        self,
+        web3: Optional[Web3] = None,
+        contract=None,
+        session_factory=SessionLocal,
+        chunk_size: int = Config.INDEXER_CHUNK_SIZE,
+        confirmations: int = Config.INDEXER_CONFIRMATIONS,
+        start_block: int = Config.INDEXER_START_BLOCK,
+        reorg_window: int = Config.INDEXER_REORG_WINDOW
+    ):
+        self.web3 = web3 or get_web3()
+        self.contract = contract or get_contract(self.web3)
+        self.reader = ContractReader(contract=self.contract)
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.confirmations = confirmations
+        self.start_block = start_block
+        self.reorg_window = reorg_window
+        self.events_by_topic = {}
+        for name in EVENT_NAMES:
+            event = self.contract.events[name]()
+            self.events_by_topic[Web3.to_hex(event_abi_to_log_topic(event.abi))] = event
+
+    def _get_checkpoint(self, db) -> BlockchainSync:
+        sync = db.query(BlockchainSync).filter(BlockchainSync.sync_type == SYNC_TYPE).first()
+        if sync is None:
+            sync = BlockchainSync(
+                sync_type=SYNC_TYPE,
+                last_synced_block=self.start_block - 1,
+                status="success"
+            )
+            db.add(sync)
+            db.flush()
+        return sync
+
+    def _handle_reorg(self, db, sync: BlockchainSync):
+        """Rewind the checkpoint to the newest indexed block still on the canonical chain"""
+        if not sync.last_block_hash or sync.last_synced_block < self.start_block:
+            return
+        block = self.web3.eth.get_block(sync.last_synced_block)
+        if Web3.to_hex(block["hash"]) == sync.last_block_hash:
+            return
+
+        checkpoints = db.query(IndexedBlock.block_number, IndexedBlock.block_hash).filter(
+            IndexedBlock.block_number < sync.last_synced_block
+        ).order_by(IndexedBlock.block_number.desc()).all()
+        blocks = make_batch_request(
+            self.web3,
+            [("eth_getBlockByNumber", [hex(number), False]) for number, _ in checkpoints]
+        )
+        # A block still on the canonical chain vouches for all of its ancestors
+        rewind_to, rewind_hash = self.start_block - 1, None
+        for (number, block_hash), block in zip(checkpoints, blocks):
+            if block is not None and _to_hex(block["hash"]) == block_hash:
+                rewind_to, rewind_hash = number, block_hash
+                break
+        logger.warning(
+            "Reorg detected at block %s, rewinding to %s", sync.last_synced_block, rewind_to
+        )
+        # Rows from orphaned blocks are re-confirmed when the range is indexed again,
+        # or failed by the verifier if their transaction is not mined again
+        db.query(Purchase).filter(Purchase.block_number > rewind_to).update(
+            {"is_verified": False, "block_number": None, "tx_status": TransactionStatus.SUBMITTED},
+            synchronize_session=False
+        )
+        db.query(Royalty).filter(Royalty.block_number > rewind_to).update(
+            {"is_paid": False, "block_number": None}, synchronize_session=False
+        )
+        db.query(IndexedBlock).filter(IndexedBlock.block_number > rewind_to).delete(synchronize_session=False)
+        sync.last_synced_block = rewind_to
+        sync.last_block_hash = rewind_hash
+
+    def _checkpoint(self, db, sync: BlockchainSync, block_number: int):
+        """Move the checkpoint to a block and keep its hash in the reorg window"""
+        block_hash = Web3.to_hex(self.web3.eth.get_block(block_number)["hash"])
+        sync.last_synced_block = block_number
+        sync.last_block_hash = block_hash
+        db.add(IndexedBlock(block_number=block_number, block_hash=block_hash))
+        db.flush()
+        oldest = db.query(IndexedBlock.block_number).order_by(
+            IndexedBlock.block_number.desc()
+        ).offset(self.reorg_window).limit(1).scalar()
+        if oldest is not None:
+            db.query(IndexedBlock).filter(IndexedBlock.block_number <= oldest).delete(synchronize_session=False)
+
+    def fetch_events(self, from_block: int, to_block: int) -> List:
+        """Fetch and decode the contract's events in a block range, in chain order"""
+        logs = self.web3.eth.get_logs({
+            "address": self.contract.address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [list(self.events_by_topic)]
+        })
+        events = []
+        for log in logs:
+            event = self.events_by_topic.get(Web3.to_hex(log["topics"][0]))
+            if event is not None:
+                events.append(event.process_log(log))
+        events.sort(key=lambda e: (e["blockNumber"], e["logIndex"]))
+        return events
+
+    def _block_timestamps(self, block_numbers: Iterable[int]) -> Dict[int, datetime]:
+        block_numbers = sorted(set(block_numbers))
+        blocks = make_batch_request(
+            self.web3,
+            [("eth_getBlockByNumber", [hex(n), False]) for n in block_numbers]
+        )
+        return {
+            n: datetime.utcfromtimestamp(_to_int(block["timestamp"]))
+            for n, block in zip(block_numbers, blocks)
+        }
+
+    def _user_ids(self, db, addresses: Iterable[str]) -> Dict[str, int]:
+        """Map lower-cased eth addresses to user ids in one query"""
+        addresses = {a.lower() for a in addresses}
+        if not addresses:
+            return {}
+        candidates = addresses | {Web3.to_checksum_address(a) for a in addresses}
+        rows = db.query(User.id, User.eth_address).filter(User.eth_address.in_(candidates))
+        return {address.lower(): user_id for user_id, address in rows}
+
+    def _book_ids(self, db, contract_ids: Iterable[int]) -> Dict[int, int]:
+        contract_ids = set(contract_ids)
+        if not contract_ids:
+            return {}
+        rows = db.query(Book.id, Book.contract_id).filter(Book.contract_id.in_(contract_ids))
+        return {contract_id: book_id for book_id, contract_id in rows}
+
+    def apply_events(self, db, events: List) -> List[int]:
+        """Fold a chunk of events into bulk inserts/updates (caller commits); returns changed book ids"""
+        books: Dict[int, dict] = {}
+        purchases: Dict[str, dict] = {}
+        royalties: Dict[str, dict] = {}
+        addresses = set()
+
+        for event in events:
+            args = event["args"]
+            tx_hash = Web3.to_hex(event["transactionHash"])
+            if event["event"] == "BookAdded":
+                books.setdefault(args["bookId"], {}).update(
+                    title=args["title"],
+                    author=args["author"],
+                    seller=args["seller"],
+                    transaction_hash=tx_hash,
+                    is_active=True
+                )
+                addresses.update((args["author"], args["seller"]))
+            elif event["event"] == "BookUpdated":
+                books.setdefault(args["bookId"], {}).update(
+                    title=args["title"],
+                    price=_from_wei(args["price"])
+                )
+            elif event["event"] == "BookRemoved":
+                books.setdefault(args["bookId"], {})["is_active"] = False
+            elif event["event"] == "BookPurchased":
+                purchases[tx_hash] = {
+                    "book": args["bookId"],
+                    "buyer": args["buyer"],
+                    "price_paid": _from_wei(args["price"]),
+                    "block_number": event["blockNumber"]
+                }
+                addresses.add(args["buyer"])
+            elif event["event"] == "RoyaltyPaid":
+                royalties[tx_hash] = {
+                    "book": args["bookId"],
+                    "author": args["author"],
+                    "amount": _from_wei(args["amount"]),
+                    "block_number": event["blockNumber"]
+                }
+                addresses.add(args["author"])
+
+        user_ids = self._user_ids(db, addresses)
+        timestamps = self._block_timestamps(
+            [p["block_number"] for p in purchases.values()] +
+            [r["block_number"] for r in royalties.values()]
+        )
+
+        changed_book_ids = []
+        if books:
+            self._upsert_books(db, books, user_ids)
+            changed_book_ids = list(self._book_ids(db, books).values())
+            index_books(db, changed_book_ids)
+        book_ids = self._book_ids(
+            db,
+            [p["book"] for p in purchases.values()] + [r["book"] for r in royalties.values()]
+        )
+        if purchases:
+            self._upsert_purchases(db, purchases, user_ids, book_ids, timestamps)
+        if royalties:
+            self._upsert_royalties(db, royalties, user_ids, book_ids, timestamps)
+        return changed_book_ids
+
+    def _upsert_books(self, db, books: Dict[int, dict], user_ids: Dict[str, int]):
+        tx_hashes = [b["transaction_hash"] for b in books.values() if "transaction_hash" in b]
+        existing = {}
+        # Books created through the API are matched by their addBook transaction
+        for book_id, contract_id, tx_hash in db.query(Book.id, Book.contract_id, Book.transaction_hash).filter(
+            or_(Book.contract_id.in_(books), Book.transaction_hash.in_(tx_hashes))
+        ):
+            if contract_id is not None:
+                existing[contract_id] = book_id
+            if tx_hash is not None:
+                existing[tx_hash] = book_id
+
+        inserts, updates = [], []
+        for contract_id, fields in books.items():
+            row = {key: value for key, value in fields.items() if key not in ("author", "seller")}
+            row["contract_id"] = contract_id
+            if "author" in fields:
+                row["author_id"] = user_ids.get(fields["author"].lower())
+                row["seller_id"] = user_ids.get(fields["seller"].lower())
+                row["tx_status"] = TransactionStatus.CONFIRMED
+
+            book_id = existing.get(contract_id) or existing.get(fields.get("transaction_hash"))
+            if book_id is not None:
+                # Keep the API's author/seller attribution for rows it created
+                row.pop("author_id", None)
+                row.pop("seller_id", None)
+                updates.append(dict(row, id=book_id))
+            else:
+                inserts.append(row)
+
+        # BookAdded carries no price; books not created through the API read theirs from the contract
+        unpriced = [row["contract_id"] for row in inserts if "price" not in row]
+        if unpriced:
+            details = self.reader.book_details(unpriced)
+            for row in inserts:
+                if "price" not in row:
+                    book = details[row["contract_id"]]
+                    row.update(
+                        price=_from_wei(book["price"]),
+                        pdf_hash=book["pdfHash"],
+                        royalty_percentage=book["royaltyPercentage"]
+                    )
+
+        db.bulk_update_mappings(Book, updates)
+        db.bulk_insert_mappings(Book, inserts)
+        db.flush()
+
+    def _upsert_purchases(self, db, purchases, user_ids, book_ids, timestamps):
+        columns = (
+            Purchase.id, Purchase.transaction_hash, Purchase.user_id, Purchase.book_id,
+            Purchase.purchase_date, Purchase.price_paid, Purchase.tx_status
+        )
+        existing = {
+            row.transaction_hash: row
+            for row in db.query(*columns).filter(Purchase.transaction_hash.in_(purchases))
+        }
+        # Purchases are unique per (user, book): a row recorded before its hash was known takes the event
+        pairs = {
+            (user_ids.get(fields["buyer"].lower()), book_ids.get(fields["book"])): tx_hash
+            for tx_hash, fields in purchases.items()
+            if tx_hash not in existing
+        }
+        by_pair = {}
+        if pairs:
+            by_pair = {
+                (row.user_id, row.book_id): row
+                for row in db.query(*columns).filter(
+                    Purchase.user_id.in_({user_id for user_id, _ in pairs if user_id is not None}),
+                    Purchase.book_id.in_({book_id for _, book_id in pairs if book_id is not None})
+                )
+                if (row.user_id, row.book_id) in pairs
+            }
+        inserts, updates = [], []
+        sold = []  # (book_id, purchase_date, price_paid) of purchases not counted yet
+        for tx_hash, fields in purchases.items():
+            row = {
+                "block_number": fields["block_number"],
+                "is_verified": True,
+                "tx_status": TransactionStatus.CONFIRMED
+            }
+            pair = (user_ids.get(fields["buyer"].lower()), book_ids.get(fields["book"]))
+            current = existing.get(tx_hash) or by_pair.get(pair)
+            if current is not None:
+                updates.append(dict(row, id=current.id, transaction_hash=tx_hash))
+                # Failed purchases were taken off the counts; the chain says otherwise
+                if current.tx_status == TransactionStatus.FAILED:
+                    sold.append((current.book_id, current.purchase_date, current.price_paid))
+            else:
+                inserts.append(dict(
+                    row,
+                    transaction_hash=tx_hash,
+                    user_id=pair[0],
+                    book_id=pair[1],
+                    price_paid=fields["price_paid"],
+                    purchase_date=timestamps[fields["block_number"]]
+                ))
+                sold.append((pair[1], inserts[-1]["purchase_date"], fields["price_paid"]))
+        db.bulk_update_mappings(Purchase, updates)
+        db.bulk_insert_mappings(Purchase, inserts)
+        db.flush()
+        # Bulk mappings skip the flush hook that maintains the rollups
+        record_purchases(db.connection(), sold)
+        # One counter UPDATE per book for the whole chunk
+        add_sales(db.connection(), Counter(book_id for book_id, _, _ in sold if book_id is not None))
+
+    def _upsert_royalties(self, db, royalties, user_ids, book_ids, timestamps):
+        purchase_ids = dict(
+            db.query(Purchase.transaction_hash, Purchase.id)
+            .filter(Purchase.transaction_hash.in_(royalties))
+        )
+        existing = {
+            row.transaction_hash: row
+            for row in db.query(
+                Royalty.transaction_hash, Royalty.id, Royalty.author_id,
+                Royalty.book_id, Royalty.payment_date, Royalty.amount
+            ).filter(Royalty.transaction_hash.in_(royalties))
+        }
+        inserts, updates = [], []
+        corrected = []
+        for tx_hash, fields in royalties.items():
+            row = {
+                "amount": fields["amount"],
+                "block_number": fields["block_number"],
+                "is_paid": True
+            }
+            if tx_hash in existing:
+                current = existing[tx_hash]
+                updates.append(dict(row, id=current.id))
+                if current.amount != fields["amount"]:
+                    corrected.append(current)
+            else:
+                inserts.append(dict(
+                    row,
+                    transaction_hash=tx_hash,
+                    author_id=user_ids.get(fields["author"].lower()),
+                    book_id=book_ids.get(fields["book"]),
+                    purchase_id=purchase_ids.get(tx_hash),
+                    payment_date=timestamps[fields["block_number"]]
+                ))
+        db.bulk_update_mappings(Royalty, updates)
+        db.bulk_insert_mappings(Royalty, inserts)
+        db.flush()
+        connection = db.connection()
+        record_royalties(connection, [
+            (row["author_id"], row["book_id"], row["payment_date"], row["amount"]) for row in inserts
+        ])
+        # Royalties recorded with an estimated amount are corrected to the paid one
+        record_royalties(connection, [
+            (r.author_id, r.book_id, r.payment_date, r.amount) for r in corrected
+        ], sign=-1)
+        record_royalties(connection, [
+            (r.author_id, r.book_id, r.payment_date, royalties[r.transaction_hash]["amount"])
+            for r in corrected
+        ])
+
+    def run_once(self) -> IndexerStats:
+        """Index every confirmed block past the checkpoint"""
+        stats = IndexerStats()
+        started = time.monotonic()
+        head = self.web3.eth.block_number - self.confirmations
+
+        with self.session_factory() as db:
+            sync = self._get_checkpoint(db)
+            self._handle_reorg(db, sync)
+            sync.status = "in_progress"
+            sync.error_message = None
+            sync.started_at = datetime.utcnow()
+            db.commit()
+
+            try:
+                from_block = sync.last_synced_block + 1
+                chunk_size = self.chunk_size
+                while from_block <= head:
+                    to_block = min(from_block + chunk_size - 1, head)
+                    try:
+                        events = self.fetch_events(from_block, to_block)
+                    except ValueError:
+                        # Node refused the range (too many results); retry with a smaller one
+                        if chunk_size == 1:
+                            raise
+                        chunk_size = max(1, chunk_size // 2)
+                        continue
+
+                    changed_book_ids = self.apply_events(db, events)
+                    self._checkpoint(db, sync, to_block)
+                    db.commit()
+                    if changed_book_ids:
+                        get_book_cache().invalidate_books(changed_book_ids)
+
+                    stats.blocks += to_block - from_block + 1
+                    stats.events += len(events)
+                    stats.elapsed = time.monotonic() - started
+                    logger.info("Indexed blocks %s-%s: %s", from_block, to_block, stats)
+                    from_block = to_block + 1
+
+                sync.status = "success"
+                sync.completed_at = datetime.utcnow()
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                sync.status = "failed"
+                sync.error_message = str(e)
+                sync.completed_at = datetime.utcnow()
+                db.commit()
+                raise
+
+        stats.elapsed = time.monotonic() - started
+        return stats
+
+    def run_forever(self, poll_interval: float = Config.INDEXER_POLL_INTERVAL):
+        while True:
+            try:
+                stats = self.run_once()
+                if stats.blocks:
+                    logger.info("Caught up: %s", stats)
+            except Exception:
+                logger.exception("Indexer run failed")
+            time.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Index BookStore contract events")
+    parser.add_argument("--once", action="store_true", help="catch up and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    indexer = EventIndexer()
+    if args.once:
+        print(f"✅ Indexed {indexer.run_once()}")
+    else:
+        indexer.run_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,8 @@
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, JSON, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
-
-Base = declarative_base()
+from database import Base
 
 class UserRole(str, Enum):
     USER = "user"
@@ -12,6 +10,12 @@ class UserRole(str, Enum):
     SELLER = "seller"
     ADMIN = "admin"
 
+class TransactionStatus(str, Enum):
+    PENDING = "pending"  # queued, not yet sent to the node
+    SUBMITTED = "submitted"  # sent, waiting for a receipt
+    CONFIRMED = "confirmed"
+    FAILED = "failed"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -22,6 +26,7 @@ class User(Base):
     eth_address = Column(String, unique=True, index=True)
     role = Column(SQLEnum(UserRole), default=UserRole.USER)
     is_active = Column(Boolean, default=True)
+    tokens_valid_after = Column(DateTime, nullable=True)  # tokens issued earlier are rejected
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -37,7 +42,7 @@ class Book(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     description = Column(String)
-    price = Column(Float)
+    price = Column(Float, nullable=False)  # a keyset pagination key, so never NULL
     pdf_hash = Column(String)  # IPFS hash of the PDF file
     cover_hash = Column(String)  # IPFS hash of the cover image
     royalty_percentage = Column(Float)
@@ -47,13 +52,14 @@ class Book(Base):
     # Blockchain related fields
     contract_id = Column(Integer, index=True)  # ID in the smart contract
     transaction_hash = Column(String)  # Transaction hash when book was added
+    tx_status = Column(SQLEnum(TransactionStatus), default=TransactionStatus.PENDING)
     
     # Foreign keys
     author_id = Column(Integer, ForeignKey("users.id"))
     seller_id = Column(Integer, ForeignKey("users.id"))
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
@@ -64,17 +70,24 @@ class Book(Base):
 
 class Purchase(Base):
     __tablename__ = "purchases"
+    # A book is bought once per user; idempotency keys are scoped to their user
+    __table_args__ = (
+        UniqueConstraint("user_id", "book_id", name="uq_purchases_user_book"),
+        UniqueConstraint("user_id", "idempotency_key", name="uq_purchases_user_idempotency_key"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     book_id = Column(Integer, ForeignKey("books.id"))
     price_paid = Column(Float)
     transaction_hash = Column(String, unique=True, index=True)
-    purchase_date = Column(DateTime, default=datetime.utcnow)
+    purchase_date = Column(DateTime, default=datetime.utcnow, nullable=False)  # library keyset key
+    idempotency_key = Column(String)  # Idempotency-Key header of the request that created it
     
     # Blockchain verification
     is_verified = Column(Boolean, default=False)
     block_number = Column(Integer)
+    tx_status = Column(SQLEnum(TransactionStatus), default=TransactionStatus.PENDING)
     
     # Relationships
     user = relationship("User", back_populates="purchases")
@@ -100,11 +113,30 @@ class Royalty(Base):
     book = relationship("Book", back_populates="royalties")
     purchase = relationship("Purchase")
 
+# Daily rollups maintained by utils.rollups; derived data, so no foreign keys
+class BookSalesDaily(Base):
+    __tablename__ = "book_sales_daily"
+
+    book_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day of purchase_date
+    sales_count = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0, nullable=False)
+
+class AuthorRoyaltiesDaily(Base):
+    __tablename__ = "author_royalties_daily"
+
+    author_id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day of payment_date
+    royalty_count = Column(Integer, default=0, nullable=False)
+    amount = Column(Float, default=0, nullable=False)
+
 class IPFSCache(Base):
     __tablename__ = "ipfs_cache"
 
     id = Column(Integer, primary_key=True, index=True)
     file_hash = Column(String, unique=True, index=True)
+    content_hash = Column(String, unique=True, index=True)  # sha256 of the file, dedupes uploads
     file_type = Column(String)  # 'pdf' or 'cover'
     original_filename = Column(String)
     file_size = Column(Integer)
@@ -112,18 +144,62 @@ class IPFSCache(Base):
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     last_accessed = Column(DateTime, default=datetime.utcnow)
     access_count = Column(Integer, default=0)
+    cached_at = Column(DateTime, nullable=True)  # set while the content is in the local blob cache
+
+class ImageVariant(Base):
+    """Resized/re-encoded copy of a cover, stored on IPFS like any other file"""
+    __tablename__ = "image_variants"
+    __table_args__ = (UniqueConstraint("source_hash", "width", "format"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    source_hash = Column(String, index=True)  # IPFS hash of the original image
+    width = Column(Integer)
+    format = Column(String)  # 'webp' or 'jpeg'
+    file_hash = Column(String, index=True)  # IPFS hash of the variant
+    file_size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class BlockchainSync(Base):
     __tablename__ = "blockchain_sync"
 
     id = Column(Integer, primary_key=True, index=True)
     last_synced_block = Column(Integer)
-    sync_type = Column(String)  # 'books', 'purchases', 'royalties'
+    last_block_hash = Column(String, nullable=True)  # used to detect reorgs
+    sync_type = Column(String, index=True)  # 'events', 'books', 'purchases', 'royalties'
     status = Column(String)  # 'success', 'failed', 'in_progress'
     error_message = Column(String, nullable=True)
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
 
+class IndexedBlock(Base):
+    """Hash of a block the event indexer checkpointed at, kept for INDEXER_REORG_WINDOW checkpoints"""
+    __tablename__ = "indexed_blocks"
+
+    block_number = Column(Integer, primary_key=True)
+    block_hash = Column(String)
+
+class PendingTransaction(Base):
+    """A contract call queued by the transaction pipeline, kept until its receipt is handled"""
+    __tablename__ = "pending_transactions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String)  # 'add_book', 'purchase', 'update_book', 'remove_book'
+    entity_id = Column(Integer)
+    from_address = Column(String)
+    function = Column(String)
+    args = Column(JSON)
+    value = Column(String, default="0")  # wei, may not fit a 64-bit integer
+    meta = Column(JSON)
+    tx_hash = Column(String, nullable=True)
+    status = Column(SQLEnum(TransactionStatus), default=TransactionStatus.PENDING)
+    # Pipeline that owns the job; claims lapse when it stops renewing them
+    claimed_by = Column(String, nullable=True, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Registers the flush hook that keeps the rollups in step with ORM writes
+import utils.rollups  # noqa: E402,F401
+
 def init_db(engine):
     """Initialize the database by creating all tables"""
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
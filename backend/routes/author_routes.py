@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import date, datetime, timedelta
 
-from database import get_db
-from models import User, Book, Purchase, Royalty, UserRole
+from database import get_async_read_db
+from models import AuthorRoyaltiesDaily, BookSalesDaily, User, Book, Royalty, UserRole
 from auth import get_current_user
+from utils.export import ExportFormat, ROYALTY_COLUMNS, date_filters, export_response, royalty_ledger
 from schemas import (
     BookResponse,
     RoyaltyResponse,
@@ -18,31 +20,52 @@ router = APIRouter()
 @router.get("/books", response_model=List[BookResponse])
 async def get_author_books(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     if current_user.role != UserRole.AUTHOR:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not an author"
         )
-    return db.query(Book).filter(Book.author_id == current_user.id).all()
+    result = await db.execute(select(Book).where(Book.author_id == current_user.id))
+    return result.scalars().all()
 
 @router.get("/royalties", response_model=List[RoyaltyResponse])
 async def get_royalties(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     if current_user.role != UserRole.AUTHOR:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not an author"
         )
-    return db.query(Royalty).filter(Royalty.author_id == current_user.id).all()
+    result = await db.execute(select(Royalty).where(Royalty.author_id == current_user.id))
+    return result.scalars().all()
+
+@router.get("/royalties/export")
+async def export_royalties(
+    format: ExportFormat = ExportFormat.CSV,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Download royalties paid in [start_date, end_date) as CSV or Parquet"""
+    if current_user.role != UserRole.AUTHOR:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not an author"
+        )
+    statement = royalty_ledger(
+        Royalty.author_id == current_user.id,
+        *date_filters(Royalty.payment_date, start_date, end_date)
+    )
+    return export_response(statement, ROYALTY_COLUMNS, format, "royalties")
 
 @router.get("/stats", response_model=AuthorStats)
 async def get_author_stats(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     if current_user.role != UserRole.AUTHOR:
         raise HTTPException(
@@ -50,11 +73,16 @@ async def get_author_stats(
             detail="Not an author"
         )
 
-    total_books = db.query(Book).filter(Book.author_id == current_user.id).count()
-    total_sales = db.query(Purchase).join(Book).filter(Book.author_id == current_user.id).count()
-    total_revenue = db.query(func.sum(Royalty.amount)).filter(
-        Royalty.author_id == current_user.id
-    ).scalar() or 0
+    # Sales and royalties come from the daily rollups, all in one round trip
+    authored = select(Book.id).where(Book.author_id == current_user.id)
+    result = await db.execute(select(
+        select(func.count(Book.id)).where(Book.author_id == current_user.id).scalar_subquery(),
+        select(func.coalesce(func.sum(BookSalesDaily.sales_count), 0))
+        .where(BookSalesDaily.book_id.in_(authored)).scalar_subquery(),
+        select(func.coalesce(func.sum(AuthorRoyaltiesDaily.amount), 0))
+        .where(AuthorRoyaltiesDaily.author_id == current_user.id).scalar_subquery()
+    ))
+    total_books, total_sales, total_revenue = result.one()
 
     return {
         "total_books": total_books,
@@ -67,7 +95,7 @@ async def get_sales_report(
     start_date: datetime = None,
     end_date: datetime = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     if current_user.role != UserRole.AUTHOR:
         raise HTTPException(
@@ -80,14 +108,15 @@ async def get_sales_report(
     if not end_date:
         end_date = datetime.utcnow()
 
-    sales = db.query(
+    # Rollups are per UTC day, so the window covers whole days
+    result = await db.execute(select(
         Book.id,
         Book.title,
-        func.count(Purchase.id).label('total_sales'),
-        func.sum(Purchase.price_paid).label('total_revenue')
-    ).join(Purchase).filter(
+        func.sum(BookSalesDaily.sales_count).label('total_sales'),
+        func.sum(BookSalesDaily.revenue).label('total_revenue')
+    ).join(BookSalesDaily, BookSalesDaily.book_id == Book.id).where(
         Book.author_id == current_user.id,
-        Purchase.purchase_date.between(start_date, end_date)
-    ).group_by(Book.id).all()
+        BookSalesDaily.day.between(start_date.date(), end_date.date())
+    ).group_by(Book.id, Book.title).having(func.sum(BookSalesDaily.sales_count) > 0))
 
-    return sales
\ No newline at end of file
+    return result.all()
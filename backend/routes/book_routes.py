@@ -1,46 +1,183 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from enum import Enum
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from web3 import Web3
 
-from ..database import get_db
-from ..models import Book, Purchase, User, UserRole
+from ..database import get_async_db, get_async_read_db
+from ..models import Book, IPFSCache, Purchase, TransactionStatus, User, UserRole
 from ..schemas import BookCreate, BookResponse, PurchaseCreate, PurchaseResponse
 from ..auth import get_current_user
 from ..config import Config
-from ..utils.ipfs import upload_to_ipfs
-from ..utils.web3_utils import get_contract
+from ..utils.blobstore import RangeFileResponse, get_blob_cache
+from ..utils.cache import get_book_cache
+from ..utils.ipfs import upload_book_files
+from ..utils.pagination import apply_keyset, next_cursor
+from ..utils.purchases import PurchaseConflict, record_purchase
+from ..utils.search import index_books, search
+from ..utils.thumbnails import MEDIA_TYPES, get_variant, pick_width
+from ..utils.transactions import TransactionJob, TransactionPipeline, get_available_tx_pipeline, stage_job
 
 router = APIRouter(prefix="/books", tags=["books"])
 
+class BookSort(str, Enum):
+    NEWEST = "newest"
+    OLDEST = "oldest"
+    PRICE_ASC = "price_asc"
+    PRICE_DESC = "price_desc"
+
+# Keyset columns and direction per sort; id breaks ties so the order is total
+BOOK_SORT_KEYS = {
+    BookSort.NEWEST: ((Book.created_at, Book.id), True),
+    BookSort.OLDEST: ((Book.created_at, Book.id), False),
+    BookSort.PRICE_ASC: ((Book.price, Book.id), False),
+    BookSort.PRICE_DESC: ((Book.price, Book.id), True),
+}
+
+def serialize_book(book: Book) -> str:
+    """BookResponse JSON for a book, as cached by the catalog and detail routes"""
+    return BookResponse.model_validate(book, from_attributes=True).model_dump_json()
+
 @router.get("/", response_model=List[BookResponse])
 async def get_books(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    sort: BookSort = BookSort.NEWEST,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    author_id: Optional[int] = None,
+    seller_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all books with pagination"""
-    books = db.query(Book).offset(skip).limit(limit).all()
-    return books
+    """
+    Get books with keyset pagination. The X-Next-Cursor response header
+    holds the cursor for the next page and is absent on the last page.
+    Pages are served from the book cache when possible; misses read the
+    primary, since a lagging replica would re-cache pages from before the
+    last invalidation.
+    """
+    params = {
+        "cursor": cursor,
+        "limit": limit,
+        "sort": sort.value,
+        "min_price": min_price,
+        "max_price": max_price,
+        "author_id": author_id,
+        "seller_id": seller_id,
+        "is_active": is_active
+    }
+    book_cache = get_book_cache()
+    generation = book_cache.catalog_generation()
+    page = book_cache.get_catalog(params, generation)
+    if page is None:
+        page = await _load_catalog_page(db, **params)
+        book_cache.set_catalog(params, generation, page["body"], page["cursor"])
 
-@router.get("/{book_id}", response_model=BookResponse)
-async def get_book(book_id: int, db: Session = Depends(get_db)):
-    """Get a specific book by ID"""
-    book = db.query(Book).filter(Book.id == book_id).first()
-    if not book:
+    headers = {"X-Next-Cursor": page["cursor"]} if page["cursor"] else None
+    return Response(content=page["body"], media_type="application/json", headers=headers)
+
+async def _load_catalog_page(
+    db: AsyncSession,
+    cursor: Optional[str],
+    limit: int,
+    sort: str,
+    min_price: Optional[float],
+    max_price: Optional[float],
+    author_id: Optional[int],
+    seller_id: Optional[int],
+    is_active: Optional[bool]
+) -> dict:
+    sort = BookSort(sort)
+    query = select(Book)
+    if min_price is not None:
+        query = query.where(Book.price >= min_price)
+    if max_price is not None:
+        query = query.where(Book.price <= max_price)
+    if author_id is not None:
+        query = query.where(Book.author_id == author_id)
+    if seller_id is not None:
+        query = query.where(Book.seller_id == seller_id)
+    if is_active is not None:
+        query = query.where(Book.is_active == is_active)
+
+    columns, descending = BOOK_SORT_KEYS[sort]
+    try:
+        query = apply_keyset(query, columns, descending, cursor)
+    except ValueError as e:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Book not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
-    return book
+
+    result = await db.execute(query.limit(limit))
+    books = result.scalars().all()
+    return {
+        "body": "[" + ",".join(serialize_book(book) for book in books) + "]",
+        "cursor": next_cursor(books, columns, limit)
+    }
+
+@router.get("/search", response_model=List[BookResponse])
+async def search_books(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Full-text search over active books' titles and descriptions, best matches first"""
+    return await search(db, q, limit, offset)
+
+@router.get("/bestsellers", response_model=List[BookResponse])
+async def get_bestsellers(
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Active books with the most sales, best selling first. Ranked by the
+    total_sales counters, which trail purchases by up to
+    SALES_FLUSH_INTERVAL, and cached like catalog pages.
+    """
+    params = {"bestsellers": limit}
+    book_cache = get_book_cache()
+    generation = book_cache.catalog_generation()
+    page = book_cache.get_catalog(params, generation)
+    if page is None:
+        result = await db.execute(
+            select(Book)
+            .where(Book.is_active == True, Book.total_sales > 0)
+            .order_by(Book.total_sales.desc(), Book.id.desc())
+            .limit(limit)
+        )
+        page = {"body": "[" + ",".join(serialize_book(book) for book in result.scalars()) + "]", "cursor": None}
+        book_cache.set_catalog(params, generation, page["body"], page["cursor"])
+    return Response(content=page["body"], media_type="application/json")
+
+@router.get("/{book_id}", response_model=BookResponse)
+async def get_book(book_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get a specific book by ID, cached like catalog pages"""
+    book_cache = get_book_cache()
+    version = book_cache.book_version(book_id)
+    payload = book_cache.get_book(book_id, version)
+    if payload is None:
+        book = await db.get(Book, book_id)
+        if not book:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Book not found"
+            )
+        payload = serialize_book(book).encode()
+        book_cache.set_book(book_id, version, payload)
+    return Response(content=payload, media_type="application/json")
 
 @router.post("/", response_model=BookResponse)
 async def create_book(
     book_data: BookCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
 ):
-    """Create a new book (only authors and sellers)"""
+    """Create a new book (only authors and sellers); it is registered on chain in the background"""
     if current_user.role not in [UserRole.AUTHOR, UserRole.SELLER]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -49,17 +186,7 @@ async def create_book(
 
     try:
         # Upload files to IPFS
-        pdf_hash = await upload_to_ipfs(book_data.pdf_file)
-        cover_hash = await upload_to_ipfs(book_data.cover_image)
-
-        # Create book in smart contract
-        contract = get_contract()
-        tx_hash = await contract.functions.addBook(
-            book_data.title,
-            Web3.toWei(book_data.price, 'ether'),
-            pdf_hash,
-            book_data.royalty_percentage
-        ).transact({'from': current_user.eth_address})
+        pdf_hash, cover_hash = await upload_book_files(book_data.pdf_file, book_data.cover_image)
 
         # Create book in database
         db_book = Book(
@@ -70,100 +197,231 @@ async def create_book(
             cover_hash=cover_hash,
             royalty_percentage=book_data.royalty_percentage,
             author_id=current_user.id if current_user.role == UserRole.AUTHOR else None,
-            seller_id=current_user.id if current_user.role == UserRole.SELLER else None
+            seller_id=current_user.id if current_user.role == UserRole.SELLER else None,
+            tx_status=TransactionStatus.PENDING
         )
         
         db.add(db_book)
-        db.commit()
-        db.refresh(db_book)
-        return db_book
+        await db.flush()
+        await db.run_sync(index_books, [db_book.id])
+
+        # Create book in smart contract, stored with the book so a restart cannot lose it
+        job = TransactionJob(
+            kind="add_book",
+            entity_id=db_book.id,
+            from_address=current_user.eth_address,
+            function="addBook",
+            args=[
+                book_data.title,
+                Web3.to_wei(book_data.price, 'ether'),
+                pdf_hash,
+                int(book_data.royalty_percentage)
+            ]
+        )
+        await stage_job(db, job)
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+    await db.refresh(db_book)
+    get_book_cache().invalidate_books([db_book.id])
+    tx_pipeline.enqueue(job)
+    return db_book
+
 @router.post("/{book_id}/purchase", response_model=PurchaseResponse)
 async def purchase_book(
     book_id: int,
     purchase_data: PurchaseCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
 ):
-    """Purchase a book"""
-    book = db.query(Book).filter(Book.id == book_id).first()
+    """
+    Purchase a book; the returned purchase stays pending until its receipt
+    is mined. Repeating the request (with the same Idempotency-Key, if one
+    was sent) returns the original purchase with Idempotent-Replayed: true
+    and submits nothing.
+    """
+    book = await db.get(Book, book_id)
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found"
         )
-
-    # Check if user already purchased the book
-    existing_purchase = db.query(Purchase).filter(
-        Purchase.user_id == current_user.id,
-        Purchase.book_id == book_id
-    ).first()
-    
-    if existing_purchase:
+    if book.contract_id is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You have already purchased this book"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Book is not yet registered on chain"
         )
 
+    # Staged with the purchase; entity_id is set once the purchase is recorded
+    job = TransactionJob(
+        kind="purchase",
+        entity_id=None,
+        from_address=current_user.eth_address,
+        function="purchaseBook",
+        args=[book.contract_id],
+        value=Web3.to_wei(book.price, 'ether')
+    )
     try:
-        # Process purchase through smart contract
-        contract = get_contract()
-        tx_hash = await contract.functions.purchaseBook(book_id).transact({
-            'from': current_user.eth_address,
-            'value': Web3.toWei(book.price, 'ether')
-        })
-
-        # Create purchase record
-        purchase = Purchase(
-            user_id=current_user.id,
-            book_id=book_id,
-            transaction_hash=tx_hash.hex(),
-            price_paid=book.price
+        purchase, created = await record_purchase(
+            db,
+            current_user.id,
+            book,
+            TransactionStatus.PENDING,
+            idempotency_key=idempotency_key,
+            tx_job=job
         )
-        
-        db.add(purchase)
-        db.commit()
-        db.refresh(purchase)
+    except PurchaseConflict as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if not created:
+        response.headers["Idempotent-Replayed"] = "true"
         return purchase
 
-    except Exception as e:
-        db.rollback()
+    # Only the request that recorded the purchase submits it to the contract
+    tx_pipeline.enqueue(job)
+    return purchase
+
+async def _verify_purchase(db: AsyncSession, user: User, book_id: int) -> Book:
+    result = await db.execute(select(Purchase).where(
+        Purchase.user_id == user.id,
+        Purchase.book_id == book_id
+    ))
+    purchase = result.scalars().first()
+    
+    if not purchase or purchase.tx_status == TransactionStatus.FAILED:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You have not purchased this book"
+        )
+    # Content is released once the purchase is proven on chain
+    if not purchase.is_verified:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Purchase is not confirmed yet"
+        )
+
+    book = await db.get(Book, book_id)
+    if not book:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
         )
+    return book
 
 @router.get("/{book_id}/download")
 async def download_book(
     book_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Download a purchased book"""
-    # Verify purchase
-    purchase = db.query(Purchase).filter(
-        Purchase.user_id == current_user.id,
-        Purchase.book_id == book_id
-    ).first()
-    
-    if not purchase:
+    await _verify_purchase(db, current_user, book_id)
+    return {"download_url": f"/books/{book_id}/content"}
+
+@router.get("/{book_id}/content")
+async def get_book_content(
+    book_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream a purchased book's PDF from the local blob cache; supports Range requests"""
+    book = await _verify_purchase(db, current_user, book_id)
+    if not book.pdf_hash:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You have not purchased this book"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book has no PDF"
         )
+    path = await get_blob_cache().open(book.pdf_hash)
+    return RangeFileResponse(
+        path,
+        request.headers,
+        media_type="application/pdf",
+        etag=book.pdf_hash,
+        headers={"cache-control": "private, max-age=31536000, immutable"}
+    )
 
-    book = db.query(Book).filter(Book.id == book_id).first()
-    if not book:
+@router.get("/{book_id}/cover")
+async def get_book_cover(
+    book_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Serve a book's cover image from the local blob cache"""
+    book = await db.get(Book, book_id)
+    if not book or not book.cover_hash:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Book not found"
+            detail="Cover not found"
+        )
+    path = await get_blob_cache().open(book.cover_hash)
+    mime_type = await db.scalar(
+        select(IPFSCache.mime_type).where(IPFSCache.file_hash == book.cover_hash)
+    )
+    return RangeFileResponse(
+        path,
+        request.headers,
+        media_type=mime_type or "application/octet-stream",
+        etag=book.cover_hash,
+        # The book's cover can be replaced; content-addressed URLs are under /covers
+        headers={"cache-control": "public, no-cache"}
+    )
+
+@router.get("/covers/{cover_hash}")
+async def get_cover_variant(
+    cover_hash: str,
+    request: Request,
+    width: Optional[int] = Query(None, ge=1, le=4096),
+    format: Optional[str] = Query(None, pattern="^(webp|jpeg)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Serve a cover by its IPFS hash, optionally as a thumbnail no smaller than
+    width. Without an explicit format, WebP is sent to clients that accept
+    it and JPEG to the rest. URLs are content-addressed, so responses are
+    cacheable forever.
+    """
+    # Only covers are public; PDFs are served to purchasers by /{book_id}/content
+    is_cover = await db.scalar(select(Book.id).where(Book.cover_hash == cover_hash).limit(1))
+    if is_cover is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cover not found"
+        )
+
+    headers = {"cache-control": "public, max-age=31536000, immutable"}
+    if width is None:
+        path = await get_blob_cache().open(cover_hash)
+        mime_type = await db.scalar(
+            select(IPFSCache.mime_type).where(IPFSCache.file_hash == cover_hash)
+        )
+        return RangeFileResponse(
+            path,
+            request.headers,
+            media_type=mime_type or "application/octet-stream",
+            etag=cover_hash,
+            headers=headers
         )
 
-    return {"download_url": f"https://ipfs.io/ipfs/{book.pdf_hash}"}
\ No newline at end of file
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        headers["vary"] = "Accept"
+    path = await get_variant(cover_hash, width, format)
+    return RangeFileResponse(
+        path,
+        request.headers,
+        media_type=MEDIA_TYPES[format],
+        etag=f"{cover_hash}-{pick_width(width)}-{format}",
+        headers=headers
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, text
 from sqlalchemy.schema import CreateTable
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import ClauseElement
@@ -12,6 +12,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from models import Base, User, Book, Purchase, Royalty, UserRole
 from config import Config
 from database import engine
+from utils.rollups import backfill as backfill_rollups
+from utils.royalties import reconcile, settle
+from utils.sales import rebuild as rebuild_sales
+from utils.search import create_search_index as create_search_index_for
+
+VIEWS = ("vw_book_sales", "vw_author_royalties")
 
 def create_tables():
     """Create all database tables"""
@@ -25,113 +31,146 @@ def create_tables():
 def drop_tables():
     """Drop all database tables"""
     try:
+        # PostgreSQL refuses to drop tables that views still depend on
+        with engine.begin() as connection:
+            for view in VIEWS:
+                connection.execute(text(f"DROP VIEW IF EXISTS {view}"))
         Base.metadata.drop_all(bind=engine)
         print("✅ Successfully dropped all database tables")
     except Exception as e:
         print(f"❌ Error dropping database tables: {str(e)}")
         sys.exit(1)
 
+# One statement each: SQLite runs a single statement per execute
+INDEXES = (
+    # Users
+    "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)",
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+    "CREATE INDEX IF NOT EXISTS idx_users_eth_address ON users(eth_address)",
+
+    # Books
+    "CREATE INDEX IF NOT EXISTS idx_books_title ON books(title)",
+    "CREATE INDEX IF NOT EXISTS idx_books_author_id ON books(author_id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_seller_id ON books(seller_id)",
+    # Public cover URLs are looked up by content hash
+    "CREATE INDEX IF NOT EXISTS idx_books_cover_hash ON books(cover_hash)",
+    # Composite indexes backing keyset pagination and filters on GET /books
+    "CREATE INDEX IF NOT EXISTS idx_books_created_at_id ON books(created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_price_id ON books(price, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_active_created_at_id ON books(is_active, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_active_price_id ON books(is_active, price, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_author_created_at_id ON books(author_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_seller_created_at_id ON books(seller_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_active_total_sales_id ON books(is_active, total_sales, id)",
+
+    # Purchases
+    "CREATE INDEX IF NOT EXISTS idx_purchases_user_id ON purchases(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_purchases_book_id ON purchases(book_id)",
+    "CREATE INDEX IF NOT EXISTS idx_purchases_transaction_hash ON purchases(transaction_hash)",
+    # Covers the per-book sales aggregation, including date-range filters
+    "CREATE INDEX IF NOT EXISTS idx_purchases_book_date_price ON purchases(book_id, purchase_date, price_paid)",
+    # Keyset order of a user's library
+    "CREATE INDEX IF NOT EXISTS idx_purchases_user_date_id ON purchases(user_id, purchase_date, id)",
+
+    # Royalties
+    "CREATE INDEX IF NOT EXISTS idx_royalties_author_id ON royalties(author_id)",
+    "CREATE INDEX IF NOT EXISTS idx_royalties_book_id ON royalties(book_id)",
+    "CREATE INDEX IF NOT EXISTS idx_royalties_transaction_hash ON royalties(transaction_hash)",
+    # Settlement looks up each purchase's royalty
+    "CREATE INDEX IF NOT EXISTS idx_royalties_purchase_id ON royalties(purchase_id)",
+)
+
 def create_indexes():
     """Create database indexes"""
     try:
-        # Create indexes for User table
-        engine.execute("""
-            CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
-            CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
-            CREATE INDEX IF NOT EXISTS idx_users_eth_address ON users(eth_address);
-        """)
-
-        # Create indexes for Book table
-        engine.execute("""
-            CREATE INDEX IF NOT EXISTS idx_books_title ON books(title);
-            CREATE INDEX IF NOT EXISTS idx_books_author_id ON books(author_id);
-            CREATE INDEX IF NOT EXISTS idx_books_seller_id ON books(seller_id);
-        """)
-
-        # Create indexes for Purchase table
-        engine.execute("""
-            CREATE INDEX IF NOT EXISTS idx_purchases_user_id ON purchases(user_id);
-            CREATE INDEX IF NOT EXISTS idx_purchases_book_id ON purchases(book_id);
-            CREATE INDEX IF NOT EXISTS idx_purchases_transaction_hash ON purchases(transaction_hash);
-        """)
-
-        # Create indexes for Royalty table
-        engine.execute("""
-            CREATE INDEX IF NOT EXISTS idx_royalties_author_id ON royalties(author_id);
-            CREATE INDEX IF NOT EXISTS idx_royalties_book_id ON royalties(book_id);
-            CREATE INDEX IF NOT EXISTS idx_royalties_transaction_hash ON royalties(transaction_hash);
-        """)
-
+        with engine.begin() as connection:
+            for statement in INDEXES:
+                connection.execute(text(statement))
         print("✅ Successfully created all database indexes")
     except Exception as e:
         print(f"❌ Error creating database indexes: {str(e)}")
         sys.exit(1)
 
-def create_triggers():
-    """Create database triggers"""
+def create_search_index():
+    """Create the full-text search index over books"""
     try:
-        # Trigger to automatically create royalty records after purchase
-        engine.execute("""
-            CREATE TRIGGER IF NOT EXISTS trg_create_royalty_after_purchase
-            AFTER INSERT ON purchases
-            BEGIN
-                INSERT INTO royalties (
-                    author_id,
-                    book_id,
-                    purchase_id,
-                    amount,
-                    transaction_hash
-                )
-                SELECT 
-                    b.author_id,
-                    NEW.book_id,
-                    NEW.id,
-                    (NEW.price_paid * b.royalty_percentage / 100.0),
-                    NEW.transaction_hash
-                FROM books b
-                WHERE b.id = NEW.book_id
-                AND b.author_id IS NOT NULL;
-            END;
-        """)
+        with engine.begin() as connection:
+            create_search_index_for(connection, rebuild=True)
+        print("✅ Successfully created the book search index")
+    except Exception as e:
+        print(f"❌ Error creating book search index: {str(e)}")
+        sys.exit(1)
+
+def create_rollups():
+    """Rebuild the daily sales and royalty rollups from history"""
+    try:
+        with engine.begin() as connection:
+            counts = backfill_rollups(connection)
+        print(f"✅ Successfully rebuilt rollups: {counts}")
+    except Exception as e:
+        print(f"❌ Error rebuilding rollups: {str(e)}")
+        sys.exit(1)
 
-        print("✅ Successfully created all database triggers")
+def count_sales():
+    """Recount each book's total_sales from its purchases"""
+    try:
+        with engine.begin() as connection:
+            books = rebuild_sales(connection)
+        print(f"✅ Successfully recounted sales of {books} books")
+    except Exception as e:
+        print(f"❌ Error recounting sales: {str(e)}")
+        sys.exit(1)
+
+def settle_royalties():
+    """Settle royalties for existing purchases (replaces the old per-row trigger)"""
+    try:
+        with engine.begin() as connection:
+            if connection.dialect.name == "sqlite":
+                # Databases created before set-based settlement still carry the trigger
+                connection.execute(text("DROP TRIGGER IF EXISTS trg_create_royalty_after_purchase"))
+            settled = settle(connection)
+            counts = reconcile(connection)
+        print(f"✅ Successfully settled {settled} royalties: {counts}")
     except Exception as e:
-        print(f"❌ Error creating database triggers: {str(e)}")
+        print(f"❌ Error settling royalties: {str(e)}")
         sys.exit(1)
 
 def create_views():
     """Create database views"""
     try:
-        # View for book sales statistics
-        engine.execute("""
-            CREATE VIEW IF NOT EXISTS vw_book_sales AS
-            SELECT 
-                b.id as book_id,
-                b.title,
-                b.author_id,
-                b.seller_id,
-                COUNT(p.id) as total_sales,
-                SUM(p.price_paid) as total_revenue,
-                AVG(p.price_paid) as avg_price
-            FROM books b
-            LEFT JOIN purchases p ON b.id = p.book_id
-            GROUP BY b.id, b.title, b.author_id, b.seller_id;
-        """)
-
-        # View for author royalties summary
-        engine.execute("""
-            CREATE VIEW IF NOT EXISTS vw_author_royalties AS
-            SELECT 
-                u.id as author_id,
-                u.username as author_name,
-                COUNT(DISTINCT r.book_id) as books_with_royalties,
-                SUM(r.amount) as total_royalties,
-                COUNT(r.id) as total_royalty_payments
-            FROM users u
-            LEFT JOIN royalties r ON u.id = r.author_id
-            WHERE u.role = 'author'
-            GROUP BY u.id, u.username;
-        """)
+        with engine.begin() as connection:
+            # Views read the daily rollups rather than every purchase and royalty
+            connection.execute(text("DROP VIEW IF EXISTS vw_book_sales"))
+            connection.execute(text("""
+                CREATE VIEW vw_book_sales AS
+                SELECT 
+                    b.id as book_id,
+                    b.title,
+                    b.author_id,
+                    b.seller_id,
+                    COALESCE(SUM(s.sales_count), 0) as total_sales,
+                    SUM(s.revenue) as total_revenue,
+                    SUM(s.revenue) / NULLIF(SUM(s.sales_count), 0) as avg_price
+                FROM books b
+                LEFT JOIN book_sales_daily s ON b.id = s.book_id
+                GROUP BY b.id, b.title, b.author_id, b.seller_id
+            """))
+
+            # View for author royalties summary; enum columns store member names
+            connection.execute(text("DROP VIEW IF EXISTS vw_author_royalties"))
+            connection.execute(text(f"""
+                CREATE VIEW vw_author_royalties AS
+                SELECT 
+                    u.id as author_id,
+                    u.username as author_name,
+                    COUNT(DISTINCT r.book_id) as books_with_royalties,
+                    SUM(r.amount) as total_royalties,
+                    COALESCE(SUM(r.royalty_count), 0) as total_royalty_payments
+                FROM users u
+                LEFT JOIN author_royalties_daily r ON u.id = r.author_id
+                WHERE u.role = '{UserRole.AUTHOR.name}'
+                GROUP BY u.id, u.username
+            """))
 
         print("✅ Successfully created all database views")
     except Exception as e:
@@ -142,14 +181,19 @@ def seed_initial_data():
     """Seed initial data for testing"""
     try:
         # Create test users with different roles
-        engine.execute("""
-            INSERT INTO users (username, email, hashed_password, role, eth_address)
-            VALUES 
-                ('test_user', 'user@test.com', 'hashed_password', 'user', '0x1234...'),
-                ('test_author', 'author@test.com', 'hashed_password', 'author', '0x5678...'),
-                ('test_seller', 'seller@test.com', 'hashed_password', 'seller', '0x9abc...')
-            ON CONFLICT DO NOTHING;
-        """)
+        with engine.begin() as connection:
+            connection.execute(
+                text("""
+                    INSERT INTO users (username, email, hashed_password, role, eth_address)
+                    VALUES (:username, :email, 'hashed_password', :role, :eth_address)
+                    ON CONFLICT DO NOTHING
+                """),
+                [
+                    {"username": "test_user", "email": "user@test.com", "role": UserRole.USER.name, "eth_address": "0x1234..."},
+                    {"username": "test_author", "email": "author@test.com", "role": UserRole.AUTHOR.name, "eth_address": "0x5678..."},
+                    {"username": "test_seller", "email": "seller@test.com", "role": UserRole.SELLER.name, "eth_address": "0x9abc..."},
+                ]
+            )
 
         print("✅ Successfully seeded initial data")
     except Exception as e:
@@ -172,9 +216,21 @@ def init_database():
     print("\n📇 Creating indexes...")
     create_indexes()
     
-    # Create triggers
-    print("\n⚡ Creating triggers...")
-    create_triggers()
+    # Create search index
+    print("\n🔎 Creating search index...")
+    create_search_index()
+    
+    # Rebuild rollups
+    print("\n📊 Rebuilding rollups...")
+    create_rollups()
+    
+    # Recount sales
+    print("\n🔢 Recounting sales...")
+    count_sales()
+    
+    # Settle royalties
+    print("\n💸 Settling royalties...")
+    settle_royalties()
     
     # Create views
     print("\n👁️ Creating views...")
@@ -1,17 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+import asyncio
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Response, UploadFile, status
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
+from web3 import Web3
 
-from ..database import get_db
-from ..models import Book, User, UserRole
+from ..database import get_async_db, get_async_read_db
+from ..models import Book, BookSalesDaily, PendingTransaction, Purchase, TransactionStatus, User, UserRole
 from ..schemas import BookCreate, BookResponse, BookUpdate
-from ..auth import get_current_user
-from ..utils.ipfs import upload_to_ipfs
-from ..utils.web3_utils import get_contract
+from ..auth import TokenPrincipal, get_current_user, get_token_principal
+from ..utils.cache import get_book_cache
+from ..utils.catalog_import import get_import, start_import
+from ..utils.export import ExportFormat, PURCHASE_COLUMNS, date_filters, export_response, purchase_ledger
+from ..utils.ipfs import upload_book_files
+from ..utils.pagination import apply_keyset, next_cursor
+from ..utils.search import index_books
+from ..utils.transactions import TransactionJob, TransactionPipeline, get_available_tx_pipeline, stage_job
 
 router = APIRouter(prefix="/seller", tags=["seller"])
 
-def verify_seller(user: User):
+def verify_seller(user: Union[User, TokenPrincipal]):
     """Verify that the user is a seller"""
     if user.role != UserRole.SELLER:
         raise HTTPException(
@@ -21,126 +34,227 @@ def verify_seller(user: User):
 
 @router.get("/books", response_model=List[BookResponse])
 async def get_seller_books(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: TokenPrincipal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all books listed by the seller"""
     verify_seller(current_user)
     
-    books = db.query(Book).filter(Book.seller_id == current_user.id).all()
-    return books
-
-@router.post("/books", response_model=BookResponse)
-async def create_seller_book(
-    book_data: BookCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Create a new book listing"""
-    verify_seller(current_user)
+    result = await db.execute(select(Book).where(Book.seller_id == current_user.id))
+    return result.scalars().all()
 
+async def _create_listing(
+    db: AsyncSession,
+    tx_pipeline: TransactionPipeline,
+    seller: User,
+    title: str,
+    description: Optional[str],
+    price: float,
+    royalty_percentage: float,
+    pdf_file,
+    cover_image
+) -> Book:
     try:
         # Upload files to IPFS
-        pdf_hash = await upload_to_ipfs(book_data.pdf_file)
-        cover_hash = await upload_to_ipfs(book_data.cover_image)
-
-        # Add book to smart contract
-        contract = get_contract()
-        tx_hash = await contract.functions.addBook(
-            book_data.title,
-            Web3.toWei(book_data.price, 'ether'),
-            pdf_hash,
-            book_data.royalty_percentage
-        ).transact({'from': current_user.eth_address})
+        pdf_hash, cover_hash = await upload_book_files(pdf_file, cover_image)
 
         # Create book in database
         db_book = Book(
-            title=book_data.title,
-            description=book_data.description,
-            price=book_data.price,
+            title=title,
+            description=description,
+            price=price,
             pdf_hash=pdf_hash,
             cover_hash=cover_hash,
-            royalty_percentage=book_data.royalty_percentage,
-            seller_id=current_user.id
+            royalty_percentage=royalty_percentage,
+            seller_id=seller.id,
+            tx_status=TransactionStatus.PENDING
         )
         
         db.add(db_book)
-        db.commit()
-        db.refresh(db_book)
-        return db_book
+        await db.flush()
+        await db.run_sync(index_books, [db_book.id])
+
+        # Add book to smart contract, stored with the book so a restart cannot lose it
+        job = TransactionJob(
+            kind="add_book",
+            entity_id=db_book.id,
+            from_address=seller.eth_address,
+            function="addBook",
+            args=[
+                title,
+                Web3.to_wei(price, 'ether'),
+                pdf_hash,
+                int(royalty_percentage)
+            ]
+        )
+        await stage_job(db, job)
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+    await db.refresh(db_book)
+    get_book_cache().invalidate_books([db_book.id])
+    tx_pipeline.enqueue(job)
+    return db_book
+
+@router.post("/books", response_model=BookResponse)
+async def create_seller_book(
+    book_data: BookCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
+):
+    """Create a new book listing"""
+    verify_seller(current_user)
+    return await _create_listing(
+        db,
+        tx_pipeline,
+        current_user,
+        title=book_data.title,
+        description=book_data.description,
+        price=book_data.price,
+        royalty_percentage=book_data.royalty_percentage,
+        pdf_file=book_data.pdf_file,
+        cover_image=book_data.cover_image
+    )
+
+@router.post("/books/upload", response_model=BookResponse)
+async def upload_seller_book(
+    title: str = Form(...),
+    price: float = Form(...),
+    royalty_percentage: float = Form(...),
+    description: Optional[str] = Form(None),
+    pdf_file: UploadFile = File(...),
+    cover_image: Optional[UploadFile] = File(None),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
+):
+    """
+    Create a new book listing from a multipart form. Files are spooled to
+    disk as they arrive and streamed on to IPFS, so large PDFs are never
+    held in memory.
+    """
+    verify_seller(current_user)
+    return await _create_listing(
+        db,
+        tx_pipeline,
+        current_user,
+        title=title,
+        description=description,
+        price=price,
+        royalty_percentage=royalty_percentage,
+        pdf_file=pdf_file,
+        cover_image=cover_image
+    )
+
 @router.put("/books/{book_id}", response_model=BookResponse)
 async def update_seller_book(
     book_id: int,
     book_update: BookUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
 ):
     """Update a book listing"""
     verify_seller(current_user)
 
-    book = db.query(Book).filter(
+    result = await db.execute(select(Book).where(
         Book.id == book_id,
         Book.seller_id == current_user.id
-    ).first()
+    ))
+    book = result.scalars().first()
     
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found or you don't have permission to update it"
         )
+    if book.contract_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Book is not yet registered on chain"
+        )
 
     try:
+        # Fields mirrored on chain, kept so a failed transaction can be rolled back
+        previous = {
+            "title": book.title,
+            "price": book.price,
+            "pdf_hash": book.pdf_hash,
+            "royalty_percentage": book.royalty_percentage
+        }
+
         # Handle file updates if provided
-        if book_update.pdf_file:
-            book.pdf_hash = await upload_to_ipfs(book_update.pdf_file)
-        if book_update.cover_image:
-            book.cover_hash = await upload_to_ipfs(book_update.cover_image)
-
-        # Update smart contract if price changed
-        if book_update.price and book_update.price != book.price:
-            contract = get_contract()
-            await contract.functions.updateBookPrice(
-                book_id,
-                Web3.toWei(book_update.price, 'ether')
-            ).transact({'from': current_user.eth_address})
+        pdf_hash, cover_hash = await upload_book_files(book_update.pdf_file, book_update.cover_image)
+        if pdf_hash:
+            book.pdf_hash = pdf_hash
+        if cover_hash:
+            book.cover_hash = cover_hash
 
         # Update database fields
         for key, value in book_update.dict(exclude_unset=True).items():
             if hasattr(book, key):
                 setattr(book, key, value)
 
-        db.commit()
-        db.refresh(book)
-        return book
+        changed_on_chain = any(getattr(book, key) != value for key, value in previous.items())
+        job = None
+        if changed_on_chain:
+            book.tx_status = TransactionStatus.PENDING
+            # Update smart contract, stored with the change so a restart cannot lose it
+            job = TransactionJob(
+                kind="update_book",
+                entity_id=book.id,
+                from_address=current_user.eth_address,
+                function="updateBook",
+                args=[
+                    book.contract_id,
+                    book.title,
+                    Web3.to_wei(book.price, 'ether'),
+                    book.pdf_hash,
+                    int(book.royalty_percentage)
+                ],
+                meta={"previous": previous}
+            )
+            await stage_job(db, job)
+
+        await db.flush()
+        await db.run_sync(index_books, [book.id])
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+    await db.refresh(book)
+    get_book_cache().invalidate_books([book.id])
+    if job is not None:
+        tx_pipeline.enqueue(job)
+    return book
+
 @router.delete("/books/{book_id}")
 async def delete_seller_book(
     book_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    tx_pipeline: TransactionPipeline = Depends(get_available_tx_pipeline)
 ):
-    """Remove a book listing"""
+    """Remove a book listing; the row is deleted once removeBook is mined"""
     verify_seller(current_user)
 
-    book = db.query(Book).filter(
+    result = await db.execute(select(Book).where(
         Book.id == book_id,
         Book.seller_id == current_user.id
-    ).first()
+    ))
+    book = result.scalars().first()
     
     if not book:
         raise HTTPException(
@@ -148,51 +262,202 @@ async def delete_seller_book(
             detail="Book not found or you don't have permission to delete it"
         )
 
+    if book.contract_id is None:
+        # Deleting now would leave the book the queued addBook registers on chain unlisted
+        adding = await db.scalar(select(PendingTransaction.id).where(
+            PendingTransaction.kind == "add_book",
+            PendingTransaction.entity_id == book.id
+        ).limit(1))
+        if adding is not None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Book is still being registered on chain; delete it once that is confirmed"
+            )
+
     try:
-        # Remove from smart contract
-        contract = get_contract()
-        await contract.functions.removeBook(book_id).transact({
-            'from': current_user.eth_address
-        })
+        # Books never registered on chain can be removed straight away
+        if book.contract_id is None:
+            await db.delete(book)
+            await db.flush()
+            await db.run_sync(index_books, [book_id])
+            await db.commit()
+            get_book_cache().invalidate_books([book_id])
+            return {"message": "Book successfully deleted"}
 
-        # Remove from database
-        db.delete(book)
-        db.commit()
-        return {"message": "Book successfully deleted"}
+        # Hide the listing until the removal is mined
+        book.is_active = False
+        book.tx_status = TransactionStatus.PENDING
+
+        # Remove from smart contract, stored with the change so a restart cannot lose it
+        job = TransactionJob(
+            kind="remove_book",
+            entity_id=book.id,
+            from_address=current_user.eth_address,
+            function="removeBook",
+            args=[book.contract_id]
+        )
+        await stage_job(db, job)
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
+    get_book_cache().invalidate_books([book.id])
+    tx_pipeline.enqueue(job)
+    return {"message": "Book deletion submitted"}
+
 @router.get("/sales")
 async def get_seller_sales(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: TokenPrincipal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get sales statistics for seller's books"""
+    """
+    Get sales statistics for seller's books from the daily sales rollup,
+    optionally limited to the UTC days in [start_date, end_date). Totals
+    cover all books; sales_by_book is paged by book id, with the next
+    page's cursor in the X-Next-Cursor header.
+    """
     verify_seller(current_user)
 
-    # Query all sales for seller's books
-    sales = db.query(Purchase).join(Book).filter(
-        Book.seller_id == current_user.id
-    ).all()
+    day_filter = []
+    if start_date is not None:
+        day_filter.append(BookSalesDaily.day >= start_date)
+    if end_date is not None:
+        day_filter.append(BookSalesDaily.day < end_date)
+
+    result = await db.execute(
+        select(
+            func.coalesce(func.sum(BookSalesDaily.sales_count), 0),
+            func.coalesce(func.sum(BookSalesDaily.revenue), 0)
+        )
+        .join(Book, Book.id == BookSalesDaily.book_id)
+        .where(Book.seller_id == current_user.id, *day_filter)
+    )
+    total_sales, total_revenue = result.one()
+
+    # Outer join so books without sales in the range still get a row
+    query = (
+        select(
+            Book.id,
+            Book.title,
+            func.coalesce(func.sum(BookSalesDaily.sales_count), 0).label("sales_count"),
+            func.coalesce(func.sum(BookSalesDaily.revenue), 0).label("revenue")
+        )
+        .outerjoin(BookSalesDaily, and_(BookSalesDaily.book_id == Book.id, *day_filter))
+        .where(Book.seller_id == current_user.id)
+        .group_by(Book.id, Book.title)
+    )
+    try:
+        query = apply_keyset(query, (Book.id,), cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    result = await db.execute(query.limit(limit))
+    rows = result.all()
 
-    total_sales = len(sales)
-    total_revenue = sum(sale.price_paid for sale in sales)
+    cursor = next_cursor(rows, (Book.id,), limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
 
     return {
         "total_sales": total_sales,
         "total_revenue": total_revenue,
         "sales_by_book": [
             {
-                "book_id": book.id,
-                "title": book.title,
-                "sales_count": len(book.purchases),
-                "revenue": sum(p.price_paid for p in book.purchases)
+                "book_id": row.id,
+                "title": row.title,
+                "sales_count": row.sales_count,
+                "revenue": row.revenue
             }
-            for book in current_user.books
+            for row in rows
         ]
-    }
\ No newline at end of file
+    }
+
+@router.get("/sales/export")
+async def export_seller_sales(
+    format: ExportFormat = ExportFormat.CSV,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Download every sale of the seller's books made in [start_date, end_date)
+    as CSV or Parquet. Rows are streamed as they are read, so the download
+    starts at once however long the history is.
+    """
+    verify_seller(current_user)
+    statement = purchase_ledger(
+        Book.seller_id == current_user.id,
+        *date_filters(Purchase.purchase_date, start_date, end_date)
+    )
+    return export_response(statement, PURCHASE_COLUMNS, format, "sales")
+
+def _spool(upload: UploadFile, suffix: str) -> str:
+    """Copy an upload to a temporary file that outlives the request"""
+    fd, path = tempfile.mkstemp(prefix="catalog-import-", suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        upload.file.seek(0)
+        shutil.copyfileobj(upload.file, out, 1024 * 1024)
+    return path
+
+@router.post("/imports", status_code=status.HTTP_202_ACCEPTED)
+async def create_catalog_import(
+    manifest: UploadFile = File(...),
+    archive: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Import a catalog: a CSV or JSON Lines manifest (title, price,
+    royalty_percentage, description, pdf, cover) plus a zip archive of the
+    files it names. The import runs in the background; poll
+    GET /seller/imports/{id} for progress and per-row errors.
+    """
+    verify_seller(current_user)
+    filename = manifest.filename or ""
+    if not filename.lower().endswith((".csv", ".jsonl", ".ndjson")):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Manifest must be a .csv or .jsonl file"
+        )
+
+    manifest_path = await asyncio.to_thread(_spool, manifest, "-manifest")
+    archive_path = await asyncio.to_thread(_spool, archive, ".zip")
+
+    def cleanup():
+        for path in (manifest_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if not await asyncio.to_thread(zipfile.is_zipfile, archive_path):
+        cleanup()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Archive must be a zip file"
+        )
+    return start_import(current_user, manifest_path, filename, archive_path, cleanup).to_dict()
+
+@router.get("/imports/{import_id}")
+async def get_catalog_import(
+    import_id: str,
+    current_user: TokenPrincipal = Depends(get_token_principal)
+):
+    """Progress and per-row errors of a catalog import"""
+    verify_seller(current_user)
+    progress = get_import(import_id)
+    if progress is None or progress.seller_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import not found"
+        )
+    return progress.to_dict()
@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+import hashlib
+import json
+from enum import Enum
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import date
 
-from database import get_db
-from models import User, Book, Purchase, UserRole
-from auth import get_current_user
+from database import get_async_db, get_async_read_db
+from models import User, Book, Purchase, TransactionStatus, UserRole
+from auth import get_current_user, invalidate_principal, revoke_user_tokens
+from utils.export import ExportFormat, PURCHASE_COLUMNS, date_filters, export_response, purchase_ledger
+from utils.pagination import apply_keyset, next_cursor
+from utils.purchases import PurchaseConflict, record_purchase
 from schemas import (
     UserProfile,
     UserProfileUpdate,
@@ -25,65 +32,150 @@ async def get_user_profile(
 async def update_user_profile(
     profile_data: UserProfileUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # current_user may come from the principal cache, so update the stored row
+    user = await db.get(User, current_user.id)
+    previous = (user.username, user.role, user.is_active)
     for key, value in profile_data.dict(exclude_unset=True).items():
-        setattr(current_user, key, value)
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+        setattr(user, key, value)
+    # Tokens issued before a role or is_active change stop working
+    role_changed = (user.role, user.is_active) != previous[1:]
+    if role_changed:
+        revoke_user_tokens(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_principal(user, previous[0], revoke_tokens=role_changed)
+    return user
+
+class LibrarySort(str, Enum):
+    RECENT = "recent"
+    OLDEST = "oldest"
+
+# Keyset columns of the library; purchase id breaks ties between same-time purchases
+LIBRARY_KEY = (Purchase.purchase_date, Purchase.id)
+
+# Failed purchases are kept so they can be retried, but do not own the book
+OWNED = or_(Purchase.tx_status.is_(None), Purchase.tx_status != TransactionStatus.FAILED)
 
 @router.get("/books", response_model=List[BookResponse])
 async def get_purchased_books(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    sort: LibrarySort = LibrarySort.RECENT,
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    purchases = db.query(Purchase).filter(Purchase.user_id == current_user.id).all()
-    return [purchase.book for purchase in purchases]
+    """
+    Get the user's purchased books in one join, ordered by purchase date;
+    failed purchases are left out. The X-Next-Cursor header holds the next
+    page's cursor. Each page carries an ETag derived from the library's
+    purchases (including when a failed one is retried) and their books'
+    last update, so a matching If-None-Match is answered with 304 before
+    any book is loaded.
+    """
+    result = await db.execute(
+        select(
+            func.count(Purchase.id),
+            func.max(Purchase.id),
+            func.max(Purchase.purchase_date),
+            func.max(Book.updated_at)
+        )
+        .join(Book, Book.id == Purchase.book_id)
+        .where(Purchase.user_id == current_user.id, OWNED)
+    )
+    version = [str(value) for value in result.one()]
+    digest = hashlib.sha1(
+        json.dumps(version + [cursor, limit, sort.value]).encode()
+    ).hexdigest()
+    etag = f'W/"{digest}"'
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    query = (
+        select(Book, Purchase.purchase_date, Purchase.id)
+        .join(Purchase, Purchase.book_id == Book.id)
+        .where(Purchase.user_id == current_user.id, OWNED)
+    )
+    try:
+        query = apply_keyset(query, LIBRARY_KEY, sort == LibrarySort.RECENT, cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    result = await db.execute(query.limit(limit))
+    rows = result.all()
+
+    body = "[" + ",".join(
+        BookResponse.model_validate(row.Book, from_attributes=True).model_dump_json()
+        for row in rows
+    ) + "]"
+    headers = {"ETag": etag}
+    next_page = next_cursor(rows, LIBRARY_KEY, limit)
+    if next_page:
+        headers["X-Next-Cursor"] = next_page
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/purchases", response_model=List[PurchaseResponse])
 async def get_purchase_history(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    return db.query(Purchase).filter(Purchase.user_id == current_user.id).all()
+    result = await db.execute(select(Purchase).where(Purchase.user_id == current_user.id))
+    return result.scalars().all()
+
+@router.get("/purchases/export")
+async def export_purchase_history(
+    format: ExportFormat = ExportFormat.CSV,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Download purchase history made in [start_date, end_date) as CSV or Parquet"""
+    statement = purchase_ledger(
+        Purchase.user_id == current_user.id,
+        *date_filters(Purchase.purchase_date, start_date, end_date)
+    )
+    return export_response(statement, PURCHASE_COLUMNS, format, "purchases")
 
 @router.post("/books/{book_id}/purchase", response_model=PurchaseResponse)
 async def purchase_book(
     book_id: int,
     transaction_hash: str,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """
+    Record a purchase paid from the client wallet. Resubmitting the same
+    transaction hash (or Idempotency-Key) returns the original purchase
+    with Idempotent-Replayed: true.
+    """
     # Check if book exists
-    book = db.query(Book).filter(Book.id == book_id).first()
+    book = await db.get(Book, book_id)
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found"
         )
 
-    # Check if already purchased
-    existing_purchase = db.query(Purchase).filter(
-        Purchase.user_id == current_user.id,
-        Purchase.book_id == book_id
-    ).first()
-    if existing_purchase:
+    try:
+        purchase, created = await record_purchase(
+            db,
+            current_user.id,
+            book,
+            TransactionStatus.SUBMITTED,  # sent by the client wallet
+            transaction_hash=transaction_hash,
+            idempotency_key=idempotency_key
+        )
+    except PurchaseConflict as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Book already purchased"
+            detail=str(e)
         )
-
-    # Create purchase record
-    purchase = Purchase(
-        user_id=current_user.id,
-        book_id=book_id,
-        transaction_hash=transaction_hash,
-        price_paid=book.price,
-        purchase_date=datetime.utcnow()
-    )
-    
-    db.add(purchase)
-    db.commit()
-    db.refresh(purchase)
+    if not created:
+        response.headers["Idempotent-Replayed"] = "true"
     return purchase
\ No newline at end of file
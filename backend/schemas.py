@@ -0,0 +1,113 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+
+from models import TransactionStatus, UserRole
+
+class ORMModel(BaseModel):
+    """Response model read from ORM objects or result rows"""
+    model_config = ConfigDict(from_attributes=True)
+
+# Users
+class UserCreate(BaseModel):
+    username: str = Field(..., min_length=3, max_length=50)
+    email: EmailStr
+    password: str = Field(..., min_length=8)
+    eth_address: Optional[str] = None
+    role: UserRole = UserRole.USER
+
+class UserLogin(BaseModel):
+    username: str
+    password: str
+
+class UserResponse(ORMModel):
+    id: int
+    username: str
+    email: str
+    eth_address: Optional[str] = None
+    role: UserRole
+    is_active: bool
+    created_at: Optional[datetime] = None
+
+class UserProfile(UserResponse):
+    updated_at: Optional[datetime] = None
+
+class UserProfileUpdate(BaseModel):
+    username: Optional[str] = Field(None, min_length=3, max_length=50)
+    email: Optional[EmailStr] = None
+    eth_address: Optional[str] = None
+    role: Optional[UserRole] = None
+
+# Books
+class BookCreate(BaseModel):
+    title: str = Field(..., min_length=1, max_length=255)
+    description: Optional[str] = None
+    price: float = Field(..., ge=0)
+    royalty_percentage: float = Field(..., ge=0, le=100)
+    pdf_file: Optional[str] = None  # base64
+    cover_image: Optional[str] = None  # base64
+
+class BookUpdate(BaseModel):
+    title: Optional[str] = Field(None, min_length=1, max_length=255)
+    description: Optional[str] = None
+    price: float = Field(None, ge=0)  # may be left out, but not set to null
+    royalty_percentage: Optional[float] = Field(None, ge=0, le=100)
+    is_active: Optional[bool] = None
+    pdf_file: Optional[str] = None  # base64
+    cover_image: Optional[str] = None  # base64
+
+class BookResponse(ORMModel):
+    # pdf_hash is left out: the file is only served to buyers
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    cover_hash: Optional[str] = None
+    royalty_percentage: Optional[float] = None
+    is_active: Optional[bool] = None
+    total_sales: Optional[int] = None
+    contract_id: Optional[int] = None
+    transaction_hash: Optional[str] = None
+    tx_status: Optional[TransactionStatus] = None
+    author_id: Optional[int] = None
+    seller_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+# Purchases and royalties
+class PurchaseCreate(BaseModel):
+    book_id: Optional[int] = None  # the path's book_id is used
+
+class PurchaseResponse(ORMModel):
+    id: int
+    user_id: int
+    book_id: int
+    price_paid: Optional[float] = None
+    transaction_hash: Optional[str] = None
+    purchase_date: Optional[datetime] = None
+    is_verified: Optional[bool] = None
+    block_number: Optional[int] = None
+    tx_status: Optional[TransactionStatus] = None
+
+class RoyaltyResponse(ORMModel):
+    id: int
+    author_id: int
+    book_id: int
+    purchase_id: Optional[int] = None
+    amount: float
+    transaction_hash: Optional[str] = None
+    payment_date: Optional[datetime] = None
+    is_paid: Optional[bool] = None
+    block_number: Optional[int] = None
+
+class AuthorStats(BaseModel):
+    total_books: int
+    total_sales: int
+    total_revenue: float
+
+class BookSalesReport(ORMModel):
+    id: int
+    title: Optional[str] = None
+    total_sales: int
+    total_revenue: float
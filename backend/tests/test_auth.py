@@ -0,0 +1,65 @@
+import pytest
+from fastapi import HTTPException
+
+import auth
+from models import User, UserRole
+from utils.cache import MemoryCache, PrincipalCache
+
+@pytest.fixture
+def principal_cache(monkeypatch):
+    cache = PrincipalCache(MemoryCache())
+    monkeypatch.setattr(auth, "get_principal_cache", lambda: cache)
+    return cache
+
+@pytest.fixture
+async def seller(db):
+    user = User(username="seller", email="seller@example.com", role=UserRole.SELLER)
+    db.add(user)
+    await db.commit()
+    return user
+
+async def change_role(db, user, role):
+    """What update_user_profile does for a role change"""
+    user.role = role
+    auth.revoke_user_tokens(user)
+    await db.commit()
+    auth.invalidate_principal(user, revoke_tokens=True)
+
+async def test_claims_are_not_trusted_on_the_memory_cache(db, seller, principal_cache):
+    token = auth.create_user_access_token(seller)
+    await change_role(db, seller, UserRole.USER)
+    # Another process never saw the revocation
+    principal_cache.backend.delete(f"revoked:{seller.username}")
+
+    with pytest.raises(HTTPException) as e:
+        await auth.get_token_principal(token, db)
+    assert e.value.status_code == 401
+
+    principal = await auth.get_token_principal(auth.create_user_access_token(seller), db)
+    assert isinstance(principal, User)
+    assert principal.role == UserRole.USER
+
+async def test_revocation_outlives_the_cache(db, seller, principal_cache):
+    token = auth.create_user_access_token(seller)
+    await change_role(db, seller, UserRole.USER)
+    # The cache was restarted or evicted the cut-off
+    principal_cache.backend.delete(f"principal:{seller.username}", f"revoked:{seller.username}")
+
+    with pytest.raises(HTTPException):
+        await auth.get_current_user(token, db)
+    # Also once the user is cached again, with the cut-off
+    with pytest.raises(HTTPException):
+        await auth.get_current_user(token, db)
+
+async def test_token_issued_right_after_revocation_is_accepted(db, seller, principal_cache, monkeypatch):
+    monkeypatch.setattr(principal_cache.backend, "shared", True, raising=False)
+    old_token = auth.create_user_access_token(seller)
+    await change_role(db, seller, UserRole.USER)
+    new_token = auth.create_user_access_token(seller)
+
+    with pytest.raises(HTTPException):
+        await auth.get_token_principal(old_token, db)
+    principal = await auth.get_token_principal(new_token, db)
+    assert isinstance(principal, auth.TokenPrincipal)
+    assert principal.role == UserRole.USER
+    assert (await auth.get_current_user(new_token, db)).role == UserRole.USER
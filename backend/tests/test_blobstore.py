@@ -0,0 +1,107 @@
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from sqlalchemy import select
+
+import database
+from models import IPFSCache
+from utils.blobstore import BlobCache, RangeFileResponse, parse_range
+
+CONTENT = bytes(range(100))
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=90-500", (90, 99)),  # clamped to the last byte
+    ("bytes=-10", (90, 99)),  # suffix range
+    ("bytes=-500", (0, 99)),  # suffix longer than the file
+    ("bytes=0-0", (0, 0)),
+    ("bytes=0-9,20-29", None),  # multiple ranges: whole file
+    ("items=0-9", None),
+    ("bytes=9-0", None),  # last before first: malformed, ignored
+    ("bytes=-", None),
+    ("bytes=a-b", None),
+    ("bytes=--5", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=100-", 100),
+    ("bytes=150-200", 100),
+    ("bytes=-0", 100),
+    ("bytes=0-", 0),
+    ("bytes=-5", 0),
+])
+def test_unsatisfiable_range(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+@pytest.fixture
+async def served(tmp_path):
+    """A client for an app serving CONTENT with RangeFileResponse"""
+    path = tmp_path / "blob"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get("/blob")
+    async def blob(request: Request):
+        return RangeFileResponse(str(path), request.headers, "application/pdf", etag="QmBlob")
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+
+async def test_whole_file(served):
+    response = await served.get("/blob")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-length"] == "100"
+
+async def test_range_request(served):
+    response = await served.get("/blob", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/100"
+    assert response.headers["content-length"] == "10"
+
+async def test_suffix_range_request(served):
+    response = await served.get("/blob", headers={"Range": "bytes=-5"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-5:]
+    assert response.headers["content-range"] == "bytes 95-99/100"
+
+async def test_unsatisfiable_range_request(served):
+    response = await served.get("/blob", headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.content == b""
+    assert response.headers["content-range"] == "bytes */100"
+
+async def test_malformed_range_gets_the_whole_file(served):
+    response = await served.get("/blob", headers={"Range": "bytes=20-10"})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+async def test_matching_etag_is_not_modified(served):
+    response = await served.get("/blob", headers={"If-None-Match": '"QmBlob"', "Range": "bytes=0-9"})
+    assert response.status_code == 304
+    assert response.content == b""
+
+async def test_least_used_blobs_are_evicted(db_engine, tmp_path):
+    cache = BlobCache(root=str(tmp_path), max_bytes=250)
+    await cache.put("QmCold", b"c" * 100)
+    await cache.put("QmHot", b"h" * 100)
+    for _ in range(3):
+        await cache.open("QmHot")
+
+    await cache.put("QmNew", b"n" * 100)
+
+    assert not os.path.exists(cache.path_for("QmCold"))
+    assert os.path.exists(cache.path_for("QmHot")) and os.path.exists(cache.path_for("QmNew"))
+    assert cache.used_bytes == 200
+    async with database.AsyncSessionLocal() as db:
+        hot = await db.scalar(select(IPFSCache).where(IPFSCache.file_hash == "QmHot"))
+        assert hot.access_count == 3  # counts were flushed to rank the blobs
@@ -0,0 +1,36 @@
+import pytest
+
+import auth
+from models import Book, Purchase, TransactionStatus, User
+
+@pytest.fixture
+async def bought(db):
+    """A buyer's token and a function recording their purchase of a book in a given state"""
+    buyer = User(username="buyer", email="buyer@example.com")
+    db.add(buyer)
+    await db.commit()
+
+    async def buy(tx_status: TransactionStatus, is_verified: bool = False) -> int:
+        book = Book(title="Ledger", price=0.01, pdf_hash="QmPdf", tx_status=TransactionStatus.CONFIRMED)
+        db.add_all([book, Purchase(user_id=buyer.id, book=book, tx_status=tx_status, is_verified=is_verified)])
+        await db.commit()
+        return book.id
+
+    return {"Authorization": f"Bearer {auth.create_user_access_token(buyer)}"}, buy
+
+@pytest.mark.parametrize("tx_status", [TransactionStatus.PENDING, TransactionStatus.SUBMITTED, TransactionStatus.FAILED])
+async def test_unconfirmed_purchases_do_not_unlock_the_book(client, bought, tx_status):
+    headers, buy = bought
+    book_id = await buy(tx_status)
+
+    for path in (f"/books/{book_id}/download", f"/books/{book_id}/content"):
+        response = await client.get(path, headers=headers)
+        assert response.status_code == 403, path
+
+async def test_verified_purchase_unlocks_the_book(client, bought):
+    headers, buy = bought
+    book_id = await buy(TransactionStatus.CONFIRMED, is_verified=True)
+
+    response = await client.get(f"/books/{book_id}/download", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"download_url": f"/books/{book_id}/content"}
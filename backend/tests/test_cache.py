@@ -0,0 +1,47 @@
+from models import Book, TransactionStatus
+from utils.cache import BookCache, MemoryCache, get_book_cache
+
+def test_page_loaded_before_an_invalidation_is_not_served_after_it():
+    book_cache = BookCache(MemoryCache())
+    generation = book_cache.catalog_generation()
+    version = book_cache.book_version(1)
+
+    # A write lands between the database read and the cache store
+    book_cache.invalidate_books([1])
+    book_cache.set_catalog({"sort": "newest"}, generation, "[]", None)
+    book_cache.set_book(1, version, b"{}")
+
+    assert book_cache.get_catalog({"sort": "newest"}, book_cache.catalog_generation()) is None
+    assert book_cache.get_book(1, book_cache.book_version(1)) is None
+
+def test_invalidation_only_moves_the_written_books():
+    book_cache = BookCache(MemoryCache())
+    book_cache.set_book(1, book_cache.book_version(1), b"one")
+    book_cache.set_book(2, book_cache.book_version(2), b"two")
+
+    book_cache.invalidate_books([1])
+
+    assert book_cache.get_book(1, book_cache.book_version(1)) is None
+    assert book_cache.get_book(2, book_cache.book_version(2)) == b"two"
+
+async def test_book_written_while_it_is_loaded_is_reloaded(client, db, monkeypatch):
+    from backend.routes import book_routes
+
+    book = Book(title="Old", price=0.01, tx_status=TransactionStatus.CONFIRMED)
+    db.add(book)
+    await db.commit()
+
+    serialize_book = book_routes.serialize_book
+
+    def serialize_then_write(loaded):
+        payload = serialize_book(loaded)
+        book.title = "New"
+        get_book_cache().invalidate_books([book.id])
+        return payload
+
+    monkeypatch.setattr(book_routes, "serialize_book", serialize_then_write)
+    assert (await client.get(f"/books/{book.id}")).json()["title"] == "Old"
+    await db.commit()
+    monkeypatch.setattr(book_routes, "serialize_book", serialize_book)
+
+    assert (await client.get(f"/books/{book.id}")).json()["title"] == "New"
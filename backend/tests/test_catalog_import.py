@@ -0,0 +1,197 @@
+import io
+import json
+import zipfile
+
+import pytest
+from sqlalchemy import select
+
+import auth
+import database
+from models import Book, PendingTransaction, TransactionStatus, User, UserRole
+from utils import catalog_import
+from utils.catalog_import import CatalogImporter, ImportProgress, ImportRowError, parse_row, read_manifest
+from utils.transactions import TransactionPipeline
+
+def make_archive(*names: str) -> zipfile.ZipFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in names:
+            archive.writestr(name, b"%PDF-1.4 " + name.encode())
+    return zipfile.ZipFile(buffer)
+
+ARCHIVE_FILES = ("ledger.pdf", "harbor.pdf", "harbor.png")
+
+def manifest(text: str) -> io.BytesIO:
+    return io.BytesIO(text.encode())
+
+def test_csv_rows_keep_their_line_numbers():
+    csv = "title,price,pdf\nLedger,0.5,ledger.pdf\n\"Harbor,\nsecond line\",1,harbor.pdf\nAtlas,2,atlas.pdf\n"
+    rows = list(read_manifest(manifest(csv), "catalog.CSV"))
+    assert [line for line, _ in rows] == [2, 4, 5]  # a quoted newline spans two lines
+    assert rows[1][1]["title"] == "Harbor,\nsecond line"
+
+def test_jsonl_rows_skip_blank_lines():
+    jsonl = '{"title": "Ledger"}\n\n   \n{"title": "Harbor"}\n'
+    assert list(read_manifest(manifest(jsonl), "catalog.jsonl")) == [
+        (1, '{"title": "Ledger"}\n'),
+        (4, '{"title": "Harbor"}\n'),
+    ]
+
+def test_valid_row_is_parsed():
+    row = parse_row(3, {"title": " Harbor ", "price": "1.5", "royalty_percentage": "12", "pdf": "harbor.pdf",
+                        "cover": "harbor.png", "description": ""}, make_archive(*ARCHIVE_FILES))
+    assert (row.line, row.title, row.price, row.royalty_percentage) == (3, "Harbor", 1.5, 12.0)
+    assert (row.pdf, row.cover, row.description) == ("harbor.pdf", "harbor.png", None)
+    assert parse_row(1, json.dumps({"title": "Ledger", "price": 2, "pdf": "ledger.pdf"}),
+                     make_archive(*ARCHIVE_FILES)).royalty_percentage == 0
+
+@pytest.mark.parametrize("raw, error", [
+    ("{not json", "invalid JSON"),
+    ("[1, 2]", "expected a JSON object"),
+    ({"title": "  ", "price": "1", "pdf": "ledger.pdf"}, "title is required"),
+    ({"title": "Ledger", "pdf": "ledger.pdf"}, "price and royalty_percentage must be numbers"),
+    ({"title": "Ledger", "price": "cheap", "pdf": "ledger.pdf"}, "price and royalty_percentage must be numbers"),
+    ({"title": "Ledger", "price": "nan", "pdf": "ledger.pdf"}, "price and royalty_percentage must be numbers"),
+    ({"title": "Ledger", "price": "inf", "pdf": "ledger.pdf"}, "price and royalty_percentage must be numbers"),
+    ({"title": "Ledger", "price": "1", "royalty_percentage": "lots", "pdf": "ledger.pdf"},
+     "price and royalty_percentage must be numbers"),
+    ({"title": "Ledger", "price": "0", "pdf": "ledger.pdf"}, "price must be greater than 0"),
+    ({"title": "Ledger", "price": "-1", "pdf": "ledger.pdf"}, "price must be greater than 0"),
+    ({"title": "Ledger", "price": "1", "royalty_percentage": "101", "pdf": "ledger.pdf"},
+     "royalty_percentage must be between 0 and 100"),
+    ({"title": "Ledger", "price": "1", "royalty_percentage": "-1", "pdf": "ledger.pdf"},
+     "royalty_percentage must be between 0 and 100"),
+    ({"title": "Ledger", "price": "1"}, "pdf is required"),
+    ({"title": "Ledger", "price": "1", "pdf": "missing.pdf"}, "'missing.pdf' is not in the archive"),
+    ({"title": "Ledger", "price": "1", "pdf": "ledger.pdf", "cover": "missing.png"},
+     "'missing.png' is not in the archive"),
+], ids=[
+    "bad_json", "not_an_object", "blank_title", "missing_price", "text_price", "nan_price", "infinite_price",
+    "text_royalty", "zero_price", "negative_price", "royalty_over_100", "negative_royalty", "missing_pdf",
+    "pdf_not_archived", "cover_not_archived"
+])
+def test_invalid_row_is_rejected(raw, error):
+    with pytest.raises(ImportRowError, match=f"^{error}"):
+        parse_row(1, raw, make_archive(*ARCHIVE_FILES))
+
+@pytest.fixture
+async def account(db):
+    seller = User(username="seller", email="seller@example.com", eth_address="0x" + "11" * 20, role=UserRole.SELLER)
+    db.add(seller)
+    await db.commit()
+    return seller
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """Stands in for IPFS: pdf and cover names become their hashes; 'unpinnable' files fail"""
+    async def upload_book_files(pdf_file, cover_image):
+        if b"unpinnable" in pdf_file.read():
+            raise RuntimeError("pin failed")
+        return f"Qm-{pdf_file.name}", f"Qm-{cover_image.name}" if cover_image else None
+
+    monkeypatch.setattr(catalog_import, "upload_book_files", upload_book_files)
+
+async def run_import(seller, text: str, filename: str, batch_size: int = 2):
+    archive = make_archive(*ARCHIVE_FILES, "unpinnable.pdf")
+    pipeline = TransactionPipeline(web3=object(), contract=object())
+    importer = CatalogImporter(seller, archive, pipeline, database.AsyncSessionLocal, batch_size=batch_size)
+    progress = await importer.run(manifest(text), filename, ImportProgress(id="import", seller_id=seller.id))
+    return progress, pipeline
+
+async def test_import_stages_valid_rows_and_reports_the_rest(account, uploads):
+    csv = (
+        "title,price,royalty_percentage,pdf,cover\n"
+        "Ledger,0.5,10,ledger.pdf,\n"
+        ",1,0,ledger.pdf,\n"
+        "Harbor,1.25,5.5,harbor.pdf,harbor.png\n"
+        "Atlas,1,0,atlas.pdf,\n"
+        "Unpinnable,1,0,unpinnable.pdf,\n"
+        "Ember,abc,0,ledger.pdf,\n"
+    )
+
+    progress, pipeline = await run_import(account, csv, "catalog.csv")
+
+    assert progress.status == "completed" and progress.finished_at is not None
+    assert (progress.rows, progress.imported, progress.failed) == (6, 2, 4)
+    assert sorted(progress.errors, key=lambda e: e["line"]) == [
+        {"line": 3, "error": "title is required"},
+        {"line": 5, "error": "'atlas.pdf' is not in the archive"},
+        {"line": 6, "error": "upload failed: pin failed"},
+        {"line": 7, "error": "price and royalty_percentage must be numbers"},
+    ]
+    async with database.AsyncSessionLocal() as db:
+        books = (await db.execute(select(Book).order_by(Book.id))).scalars().all()
+        staged = (await db.execute(select(PendingTransaction).order_by(PendingTransaction.id))).scalars().all()
+    assert [(b.title, b.price, b.pdf_hash, b.cover_hash) for b in books] == [
+        ("Ledger", 0.5, "Qm-ledger.pdf", None),
+        ("Harbor", 1.25, "Qm-harbor.pdf", "Qm-harbor.png"),
+    ]
+    assert all(b.seller_id == account.id and b.tx_status == TransactionStatus.PENDING for b in books)
+    assert [(job.kind, job.entity_id) for job in staged] == [("add_book", book.id) for book in books]
+    assert pipeline.queue.qsize() == 2
+    first = pipeline.queue.get_nowait()
+    assert (first.entity_id, first.function, first.args) == (books[0].id, "addBook", ["Ledger", 5 * 10 ** 17, "Qm-ledger.pdf", 10])
+
+async def test_jsonl_import_reports_malformed_lines(account, uploads):
+    jsonl = "\n".join([
+        json.dumps({"title": "Ledger", "price": 1, "pdf": "ledger.pdf"}),
+        "{broken",
+        "",
+        json.dumps(["Harbor", 1]),
+        json.dumps({"title": "Harbor", "price": 2, "pdf": "harbor.pdf"}),
+    ])
+
+    progress, _ = await run_import(account, jsonl, "catalog.ndjson")
+
+    assert (progress.rows, progress.imported, progress.failed) == (4, 2, 2)
+    assert [e["line"] for e in progress.errors] == [2, 4]
+    assert progress.errors[0]["error"].startswith("invalid JSON")
+    assert progress.errors[1]["error"] == "expected a JSON object"
+
+async def test_unreadable_manifest_fails_the_import(account, uploads):
+    progress = ImportProgress(id="import", seller_id=account.id)
+    pipeline = TransactionPipeline(web3=object(), contract=object())
+    importer = CatalogImporter(account, make_archive(*ARCHIVE_FILES), pipeline, database.AsyncSessionLocal)
+    await importer.run(io.BytesIO(b"title,price,pdf\n\xff\xfe,1,ledger.pdf\n"), "catalog.csv", progress)
+
+    assert progress.status == "failed"
+    assert "utf-8" in progress.message
+    assert progress.imported == 0
+
+@pytest.fixture
+def seller_headers(account):
+    return {"Authorization": f"Bearer {auth.create_user_access_token(account)}"}
+
+async def test_manifest_must_be_csv_or_jsonl(client, seller_headers):
+    response = await client.post("/seller/imports", headers=seller_headers, files={
+        "manifest": ("catalog.xlsx", b"title,price,pdf\n"),
+        "archive": ("files.zip", b"PK"),
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Manifest must be a .csv or .jsonl file"
+
+async def test_archive_must_be_a_zip(client, seller_headers):
+    response = await client.post("/seller/imports", headers=seller_headers, files={
+        "manifest": ("catalog.csv", b"title,price,pdf\n"),
+        "archive": ("files.zip", b"not a zip"),
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Archive must be a zip file"
+    assert catalog_import._tasks == set()
+
+async def test_import_progress_is_only_shown_to_its_seller(client, db, account, seller_headers, monkeypatch):
+    other = User(username="other", email="other@example.com", role=UserRole.SELLER)
+    db.add(other)
+    await db.commit()
+    progress = ImportProgress(id="abc", seller_id=account.id, rows=3, imported=2)
+    progress.error(2, "title is required")
+    monkeypatch.setitem(catalog_import._imports, "abc", progress)
+
+    response = await client.get("/seller/imports/abc", headers=seller_headers)
+    assert response.status_code == 200
+    assert response.json()["errors"] == [{"line": 2, "error": "title is required"}]
+    assert (response.json()["imported"], response.json()["failed"]) == (2, 1)
+
+    other_headers = {"Authorization": f"Bearer {auth.create_user_access_token(other)}"}
+    assert (await client.get("/seller/imports/abc", headers=other_headers)).status_code == 404
+    assert (await client.get("/seller/imports/missing", headers=seller_headers)).status_code == 404
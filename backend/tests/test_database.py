@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, delete, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+import database
+from models import Book
+
+@pytest.fixture
+def replica(monkeypatch):
+    """One replica, an empty database: anything routed to it finds no tables"""
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(database, "replica_engines", [SimpleNamespace(sync_engine=engine)])
+    return engine
+
+def primary():
+    return database.async_engine.sync_engine
+
+def test_reads_use_the_primary_without_replicas(monkeypatch):
+    monkeypatch.setattr(database, "replica_engines", [])
+    session = database.ReplicaSession()
+    assert session.get_bind(clause=select(Book)) is primary()
+
+def test_plain_reads_use_a_replica(replica):
+    session = database.ReplicaSession()
+    assert session.get_bind(clause=select(Book)) is replica
+    assert session.get_bind(mapper=Book.__mapper__) is replica
+
+def test_writes_use_the_primary(replica):
+    session = database.ReplicaSession()
+    for statement in (insert(Book), update(Book).values(title="x"), delete(Book)):
+        assert session.get_bind(clause=statement) is primary()
+
+async def test_flushes_use_the_primary(db_engine, replica):
+    async with database.ReadSessionLocal() as session:
+        session.add(Book(title="Ledger", price=1.0))
+        await session.flush()  # the replica has no books table
+        with pytest.raises(OperationalError, match="no such table"):
+            await session.execute(select(Book))
+
+def test_replica_is_kept_for_the_session(monkeypatch):
+    engines = [create_engine("sqlite://") for _ in range(8)]
+    monkeypatch.setattr(database, "replica_engines", [SimpleNamespace(sync_engine=engine) for engine in engines])
+    session = database.ReplicaSession()
+    picked = {session.get_bind(clause=select(Book)) for _ in range(20)}
+    assert len(picked) == 1 and picked <= set(engines)
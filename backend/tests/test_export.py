@@ -0,0 +1,132 @@
+import csv
+import io
+import sys
+from datetime import date, datetime
+
+import pytest
+
+import auth
+from models import Book, Purchase, Royalty, TransactionStatus, User, UserRole
+from utils import export
+from utils.export import PURCHASE_COLUMNS, date_filters, purchase_ledger
+
+def read_csv(content: bytes) -> list:
+    return list(csv.reader(io.StringIO(content.decode())))
+
+def token(user: User) -> dict:
+    return {"Authorization": f"Bearer {auth.create_user_access_token(user)}"}
+
+@pytest.fixture
+async def ledger(db):
+    """A seller with two books, one titled like a formula, bought on three days; and another seller's sale"""
+    seller = User(username="seller", email="seller@example.com", role=UserRole.SELLER)
+    other = User(username="other", email="other@example.com", role=UserRole.SELLER)
+    author = User(username="author", email="author@example.com", role=UserRole.AUTHOR)
+    buyer = User(username="buyer", email="buyer@example.com")
+    ledger_book = Book(title="Ledger", price=1.0, seller=seller, author=author)
+    formula = Book(title="=HYPERLINK(\"http://evil\")", price=2.0, seller=seller, author=author)
+    elsewhere = Book(title="Elsewhere", price=3.0, seller=other)
+    db.add_all([seller, other, author, buyer, ledger_book, formula, elsewhere])
+    purchases = [
+        Purchase(user=buyer, book=ledger_book, price_paid=1.0, purchase_date=datetime(2024, 3, 1, 9),
+                 transaction_hash="0xaa", tx_status=TransactionStatus.CONFIRMED, is_verified=True, block_number=7),
+        Purchase(user=buyer, book=formula, price_paid=2.0, purchase_date=datetime(2024, 3, 2, 23, 59),
+                 tx_status=TransactionStatus.SUBMITTED),
+        Purchase(user=author, book=ledger_book, price_paid=1.5, purchase_date=datetime(2024, 3, 3)),
+        Purchase(user=buyer, book=elsewhere, price_paid=3.0, purchase_date=datetime(2024, 3, 2)),
+    ]
+    db.add_all(purchases)
+    await db.flush()
+    db.add(Royalty(author=author, book=ledger_book, purchase_id=purchases[0].id, amount=0.1,
+                   payment_date=datetime(2024, 3, 1, 9), transaction_hash="0xbb", is_paid=True))
+    await db.commit()
+    return {"seller": seller, "author": author, "buyer": buyer, "purchases": purchases}
+
+async def test_seller_export_streams_their_sales_as_csv(client, ledger):
+    response = await client.get("/seller/sales/export", headers=token(ledger["seller"]))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    assert response.headers["content-disposition"] == 'attachment; filename="sales.csv"'
+    header, *rows = read_csv(response.content)
+    assert header == [column.name for column in PURCHASE_COLUMNS]
+    assert [row[0] for row in rows] == [str(p.id) for p in ledger["purchases"][:3]]
+    first = dict(zip(header, rows[0]))
+    assert first == {
+        "id": str(ledger["purchases"][0].id),
+        "book_id": str(ledger["purchases"][0].book_id),
+        "book_title": "Ledger",
+        "user_id": str(ledger["buyer"].id),
+        "price_paid": "1.0",
+        "purchase_date": "2024-03-01T09:00:00",
+        "transaction_hash": "0xaa",
+        "block_number": "7",
+        "is_verified": "True",
+        "tx_status": "confirmed",
+    }
+
+async def test_formula_titles_are_quoted_in_csv(client, ledger):
+    response = await client.get("/seller/sales/export", headers=token(ledger["seller"]))
+    _, _, row, _ = read_csv(response.content)
+    assert row[2] == "'=HYPERLINK(\"http://evil\")"
+
+async def test_export_is_limited_to_the_date_range(client, ledger):
+    response = await client.get(
+        "/user/purchases/export",
+        params={"start_date": "2024-03-02", "end_date": "2024-03-03"},
+        headers=token(ledger["buyer"])
+    )
+    _, *rows = read_csv(response.content)
+    # end_date is exclusive; the other seller's sale is the buyer's own purchase
+    assert sorted(row[0] for row in rows) == sorted(str(p.id) for p in ledger["purchases"] if p.purchase_date.day == 2)
+    assert response.headers["content-disposition"] == 'attachment; filename="purchases.csv"'
+
+def test_date_filters_cover_whole_days():
+    conditions = date_filters(Purchase.purchase_date, date(2024, 3, 2), None)
+    assert [c.right.value for c in conditions] == [datetime(2024, 3, 2)]
+    assert date_filters(Purchase.purchase_date, None, None) == []
+
+async def test_author_export_lists_royalties(client, ledger):
+    response = await client.get("/author/royalties/export", headers=token(ledger["author"]))
+    header, *rows = read_csv(response.content)
+    assert header[:3] == ["id", "book_id", "book_title"]
+    assert [(row[2], row[4], row[-1]) for row in rows] == [("Ledger", "0.1", "True")]
+
+    response = await client.get("/author/royalties/export", headers=token(ledger["buyer"]))
+    assert response.status_code == 403
+
+async def test_seller_export_is_for_sellers_only(client, ledger):
+    response = await client.get("/seller/sales/export", headers=token(ledger["buyer"]))
+    assert response.status_code == 403
+
+async def test_rows_are_sent_a_batch_at_a_time(ledger):
+    chunks = [chunk async for chunk in export._csv(purchase_ledger(), PURCHASE_COLUMNS, batch_size=2)]
+    assert len(chunks) == 3  # the header, then batches of two and two
+    assert [len(read_csv(chunk)) for chunk in chunks] == [1, 2, 2]
+
+async def test_parquet_export_has_one_row_group_per_batch(ledger):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    body = b"".join([chunk async for chunk in export._parquet(purchase_ledger(), PURCHASE_COLUMNS, batch_size=3)])
+
+    parquet = pq.ParquetFile(io.BytesIO(body))
+    assert parquet.metadata.num_row_groups == 2
+    table = parquet.read()
+    assert table.column_names == [column.name for column in PURCHASE_COLUMNS]
+    assert table.column("book_title").to_pylist()[1] == "=HYPERLINK(\"http://evil\")"  # typed, nothing to quote
+    assert table.column("tx_status").to_pylist()[0] == "confirmed"
+    assert table.column("purchase_date").to_pylist()[0] == datetime(2024, 3, 1, 9)
+
+async def test_parquet_export_through_the_api(client, ledger):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = await client.get("/seller/sales/export", params={"format": "parquet"}, headers=token(ledger["seller"]))
+
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    assert response.headers["content-disposition"] == 'attachment; filename="sales.parquet"'
+    assert pq.read_table(io.BytesIO(response.content)).num_rows == 3
+
+async def test_parquet_without_pyarrow_is_not_implemented(client, ledger, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    response = await client.get("/seller/sales/export", params={"format": "parquet"}, headers=token(ledger["seller"]))
+    assert response.status_code == 501
+    assert response.json()["detail"] == "Parquet export requires the 'pyarrow' package"
@@ -0,0 +1,131 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+from web3 import Web3
+
+import database
+from indexer import EventIndexer
+from models import Book, BookSalesDaily, IndexedBlock, Purchase, TransactionStatus, User, UserRole
+from utils.sales import remove_sales
+from verifier import PurchaseVerifier
+
+PRICE = Web3.to_wei(Decimal("0.07"), "ether")
+
+@pytest.fixture
+def store(db_engine, chain):
+    """A seller and a buyer with accounts on chain, and a book the seller listed; returns its contract id"""
+    web3, contract = chain
+    seller, buyer = web3.eth.accounts[1:3]
+    with database.SessionLocal() as db:
+        db.add_all([
+            User(username="seller", email="seller@example.com", eth_address=seller, role=UserRole.SELLER),
+            User(username="buyer", email="buyer@example.com", eth_address=buyer)
+        ])
+        db.commit()
+    tx_hash = contract.functions.addBook("Ledger", PRICE, "QmPdf", 10).transact({"from": seller})
+    receipt = web3.eth.get_transaction_receipt(tx_hash)
+    return contract.events.BookAdded().process_receipt(receipt)[0]["args"]["bookId"]
+
+def buy(chain, contract_id: int) -> str:
+    web3, contract = chain
+    tx_hash = contract.functions.purchaseBook(contract_id).transact({"from": web3.eth.accounts[2], "value": PRICE})
+    return Web3.to_hex(tx_hash)
+
+def mine(chain, blocks: int):
+    web3, _ = chain
+    for i in range(blocks):
+        web3.eth.send_transaction({"from": web3.eth.accounts[0], "to": web3.eth.accounts[3], "value": i + 1})
+
+def index(chain, **kwargs) -> EventIndexer:
+    web3, contract = chain
+    indexer = EventIndexer(web3=web3, contract=contract, confirmations=0, chunk_size=1, **kwargs)
+    indexer.run_once()
+    return indexer
+
+def sales() -> tuple:
+    with database.SessionLocal() as db:
+        return (
+            db.scalar(select(Book.total_sales)),
+            db.scalar(select(func.coalesce(func.sum(BookSalesDaily.sales_count), 0)))
+        )
+
+def test_purchase_is_indexed_and_counted(chain, store):
+    buy(chain, store)
+    index(chain)
+
+    with database.SessionLocal() as db:
+        purchase = db.scalar(select(Purchase))
+        assert purchase.tx_status == TransactionStatus.CONFIRMED
+        assert purchase.is_verified
+        book = db.scalar(select(Book))
+        # BookAdded has no price; it is read from the contract
+        assert (book.price, book.pdf_hash, book.royalty_percentage) == (0.07, "QmPdf", 10)
+    assert sales() == (1, 1)
+
+def test_reorg_deeper_than_the_last_block_returns_orphaned_purchases_to_the_verifier(chain, store):
+    web3, contract = chain
+    snapshot = web3.testing.snapshot()
+    buy(chain, store)
+    mine(chain, 3)
+    index(chain)
+    indexed_head = web3.eth.block_number
+
+    # The purchase and the blocks after it are replaced by a longer fork without it
+    web3.testing.revert(snapshot)
+    mine(chain, 5)
+    with database.SessionLocal() as db:
+        indexed_hash = db.scalar(select(IndexedBlock.block_hash).where(IndexedBlock.block_number == indexed_head))
+    assert Web3.to_hex(web3.eth.get_block(indexed_head)["hash"]) != indexed_hash
+    index(chain)
+
+    with database.SessionLocal() as db:
+        purchase = db.scalar(select(Purchase))
+        assert purchase.tx_status == TransactionStatus.SUBMITTED
+        assert not purchase.is_verified
+        assert purchase.block_number is None
+        hashes = dict(db.execute(select(IndexedBlock.block_number, IndexedBlock.block_hash)).all())
+    assert hashes[web3.eth.block_number] == Web3.to_hex(web3.eth.get_block("latest")["hash"])
+    assert sales() == (1, 1)  # still counted while the transaction may be mined again
+
+    # eth-tester block timestamps run ahead of the clock, hence the negative timeout
+    PurchaseVerifier(web3=web3, contract=contract, confirmations=0, timeout=-60).run_once()
+    assert sales() == (0, 0)
+
+def test_reorg_window_keeps_the_latest_checkpoints(chain, store):
+    mine(chain, 5)
+    index(chain, reorg_window=3)
+
+    with database.SessionLocal() as db:
+        numbers = db.scalars(select(IndexedBlock.block_number).order_by(IndexedBlock.block_number)).all()
+    head = chain[0].eth.block_number
+    assert numbers == [head - 2, head - 1, head]
+
+@pytest.mark.parametrize("hash_known", [True, False], ids=["by_hash", "by_pair"])
+def test_failed_purchase_confirmed_late_is_counted_again(chain, store, hash_known):
+    index(chain)
+    tx_hash = buy(chain, store)
+    with database.SessionLocal() as db:
+        purchase = Purchase(
+            user_id=db.scalar(select(User.id).where(User.username == "buyer")),
+            book_id=db.scalar(select(Book.id)),
+            price_paid=0.07,
+            transaction_hash=tx_hash if hash_known else None,
+            tx_status=TransactionStatus.FAILED
+        )
+        db.add(purchase)
+        db.flush()
+        db.execute(Book.__table__.update().values(total_sales=1))  # counted when it was recorded
+        # ...and taken off again when it was marked failed
+        remove_sales(db.connection(), [(purchase.book_id, purchase.purchase_date, purchase.price_paid)])
+        db.commit()
+    assert sales() == (0, 0)
+
+    index(chain)
+
+    with database.SessionLocal() as db:
+        purchase = db.scalar(select(Purchase))
+        assert purchase.tx_status == TransactionStatus.CONFIRMED
+        assert purchase.transaction_hash == tx_hash
+        assert db.scalar(select(func.count(Purchase.id))) == 1
+    assert sales() == (1, 1)
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import io
+
+import httpx
+import pytest
+from sqlalchemy import func, select
+
+import database
+from models import IPFSCache
+from utils import ipfs
+
+@pytest.fixture
+def node(db_engine, monkeypatch):
+    """An IPFS API stand-in answering /add with a CID derived from the uploaded bytes; records the uploads"""
+    uploads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/api/v0/add"
+        body = request.read()
+        uploads.append(body)
+        if b"unpinnable" in body:
+            return httpx.Response(500, json={"Message": "pin failed"})
+        content = body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+        return httpx.Response(200, json={"Hash": "Qm" + hashlib.sha1(content).hexdigest()})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://ipfs/api/v0")
+    monkeypatch.setattr(ipfs, "_client", client)
+    return uploads
+
+async def cache_rows() -> list:
+    async with database.AsyncSessionLocal() as db:
+        return (await db.execute(select(IPFSCache).order_by(IPFSCache.id))).scalars().all()
+
+async def test_upload_is_recorded_with_its_content_hash_size_and_type(node):
+    pdf = b"%PDF-1.4 ledger"
+    file = io.BytesIO(pdf)
+    file.name = "ledger.pdf"
+
+    file_hash = await ipfs.upload_to_ipfs(file, "pdf")
+
+    assert file_hash.startswith("Qm")
+    assert len(node) == 1 and pdf in node[0]
+    [entry] = await cache_rows()
+    assert entry.file_hash == file_hash
+    assert entry.content_hash == hashlib.sha256(pdf).hexdigest()
+    assert (entry.file_size, entry.mime_type, entry.file_type) == (len(pdf), "application/pdf", "pdf")
+    assert entry.original_filename == "ledger.pdf"
+
+async def test_same_content_is_uploaded_once_whatever_its_form(node):
+    cover = b"\x89PNG cover"
+
+    hashes = [
+        await ipfs.upload_to_ipfs(cover, "cover"),
+        await ipfs.upload_to_ipfs(base64.b64encode(cover).decode(), "cover"),
+        await ipfs.upload_to_ipfs(io.BytesIO(cover), "cover"),
+    ]
+
+    assert len(set(hashes)) == 1
+    assert len(node) == 1
+    [entry] = await cache_rows()
+    assert entry.access_count == 2
+
+async def test_empty_uploads_are_skipped(node):
+    assert await ipfs.upload_to_ipfs(None) is None
+    assert await ipfs.upload_to_ipfs(b"") is None
+    assert await ipfs.upload_to_ipfs("") is None
+    assert node == []
+
+async def test_known_cid_without_a_content_hash_gets_one(node):
+    pdf = b"%PDF-1.4 harbor"
+    cid = "Qm" + hashlib.sha1(pdf).hexdigest()
+    async with database.AsyncSessionLocal() as db:
+        db.add(IPFSCache(file_hash=cid, file_type="pdf"))
+        await db.commit()
+
+    assert await ipfs.upload_to_ipfs(pdf, "pdf") == cid
+
+    [entry] = await cache_rows()
+    assert entry.content_hash == hashlib.sha256(pdf).hexdigest()
+    assert await ipfs.upload_to_ipfs(pdf, "pdf") == cid
+    assert len(node) == 1
+
+async def test_failed_upload_is_not_recorded(node):
+    with pytest.raises(httpx.HTTPStatusError):
+        await ipfs.upload_to_ipfs(b"unpinnable", "pdf")
+    async with database.AsyncSessionLocal() as db:
+        assert await db.scalar(select(func.count(IPFSCache.id))) == 0
+
+async def test_book_files_are_uploaded_together(node):
+    pdf_hash, cover_hash = await ipfs.upload_book_files(b"%PDF-1.4 atlas", None)
+    assert pdf_hash.startswith("Qm")
+    assert cover_hash is None
+
+    pdf_hash, cover_hash = await ipfs.upload_book_files(b"%PDF-1.4 ember", b"\x89PNG ember")
+    assert pdf_hash != cover_hash
+    assert {entry.file_type for entry in await cache_rows()} == {"pdf", "cover"}
@@ -0,0 +1,115 @@
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from utils import metrics
+from utils.metrics import Counter, Histogram, MetricsMiddleware, external_call, instrument_engine
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "/books")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/books",le="0.1"} 2',
+        'latency_seconds_bucket{route="/books",le="1.0"} 3',
+        'latency_seconds_bucket{route="/books",le="+Inf"} 4',
+        'latency_seconds_sum{route="/books"} 3.65',
+        'latency_seconds_count{route="/books"} 4',
+    ]
+
+def test_counter_escapes_label_values():
+    counter = Counter("errors_total", "Errors", ("operation",))
+    counter.inc('say "hi"\\\n')
+    counter.inc(amount=2.5)
+    assert counter.samples() == [
+        'errors_total{operation="say \\"hi\\"\\\\\\n"} 1',
+        "errors_total 2.5",
+    ]
+
+@pytest.fixture
+def series(monkeypatch):
+    """Empty request metrics, so each test sees only its own series"""
+    for name in ("REQUEST_SECONDS", "REQUEST_QUERIES", "REQUEST_DB_SECONDS", "REQUEST_EXTERNAL_SECONDS",
+                 "EXTERNAL_SECONDS", "EXTERNAL_ERRORS", "DB_QUERIES", "DB_SECONDS"):
+        metric = getattr(metrics, name)
+        fresh = type(metric)(metric.name, metric.documentation, metric.labelnames)
+        if isinstance(metric, Histogram):
+            fresh.buckets = metric.buckets
+        monkeypatch.setattr(metrics, name, fresh)
+    return metrics
+
+@pytest.fixture
+async def client(series):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    instrument_engine(engine)
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/books/{book_id}")
+    async def get_book(book_id: int):
+        if book_id == 0:
+            raise HTTPException(status_code=404)
+        async with engine.connect() as conn:
+            for _ in range(book_id):
+                await conn.execute(text("SELECT 1"))
+        return {"id": book_id}
+
+    @app.post("/ipfs")
+    async def upload():
+        with external_call("ipfs", "add"):
+            pass
+        try:
+            with external_call("ipfs", "add"):
+                raise ConnectionError("node down")
+        except ConnectionError:
+            pass
+        return {}
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        yield client
+    await engine.dispose()
+
+def labels(histogram: Histogram) -> set:
+    return set(histogram._series)
+
+async def test_requests_are_filed_under_their_route_template(client, series):
+    for book_id in (1, 2, 3, 0):
+        await client.get(f"/books/{book_id}")
+
+    assert labels(series.REQUEST_SECONDS) == {("GET", "/books/{book_id}", "200"), ("GET", "/books/{book_id}", "404")}
+    assert labels(series.REQUEST_QUERIES) == {("/books/{book_id}",)}
+
+async def test_unknown_paths_and_methods_share_one_series(client, series):
+    for i in range(5):
+        await client.get(f"/no/such/page/{i}")
+        await client.request(f"PROBE{i}", "/books/1")
+
+    assert labels(series.REQUEST_SECONDS) == {("GET", "unmatched", "404"), ("other", "/books/{book_id}", "405")}
+
+async def test_queries_are_counted_per_request(client, series):
+    await client.get("/books/3")
+    await client.get("/books/1")
+
+    counts = series.REQUEST_QUERIES._series[("/books/{book_id}",)]
+    buckets = dict(zip(series.REQUEST_QUERIES.buckets, counts))
+    assert (buckets[1], buckets[3], counts[-1]) == (1, 1, 4)
+    assert series.DB_QUERIES._values[()] >= 4
+
+async def test_external_time_and_errors_are_recorded(client, series):
+    response = await client.post("/ipfs")
+
+    assert response.status_code == 200
+    assert series.EXTERNAL_ERRORS._values == {("ipfs", "add"): 1}
+    assert sum(series.EXTERNAL_SECONDS._series[("ipfs", "add")][:-1]) == 2
+    assert labels(series.REQUEST_EXTERNAL_SECONDS) == {("/ipfs", "ipfs")}
+
+def test_external_call_outside_a_request_is_not_charged(series):
+    with external_call("web3", "eth_blockNumber"):
+        assert metrics.current_stats() is None
+    assert labels(series.EXTERNAL_SECONDS) == {("web3", "eth_blockNumber")}
+    assert labels(series.REQUEST_EXTERNAL_SECONDS) == set()
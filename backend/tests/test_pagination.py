@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import Book
+from utils.pagination import decode_cursor, encode_cursor
+
+KEY = (Book.created_at, Book.id)
+
+def raw_cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def test_cursor_round_trip():
+    values = [datetime(2024, 5, 1, 12, 30, 15, 250), 42]
+    assert decode_cursor(encode_cursor(values), KEY) == values
+    assert decode_cursor(encode_cursor([9.5, 3]), (Book.price, Book.id)) == [9.5, 3]
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    raw_cursor({"created_at": "2024-05-01T00:00:00", "id": 1}),
+    raw_cursor(["2024-05-01T00:00:00"]),
+    raw_cursor(["2024-05-01T00:00:00", 1, 2]),
+    raw_cursor(["yesterday", 1]),
+    raw_cursor([20240501, 1]),
+    raw_cursor(["2024-05-01T00:00:00", "1 OR 1=1"]),
+    raw_cursor(["2024-05-01T00:00:00", True]),
+    raw_cursor(["2024-05-01T00:00:00", {"id": 1}]),
+    raw_cursor([None, 1]),
+], ids=[
+    "not_base64", "not_utf8", "object", "too_short", "too_long", "bad_date",
+    "number_for_date", "string_for_id", "bool_for_id", "object_for_id", "null_date"
+])
+def test_tampered_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, KEY)
+
+@pytest.fixture
+async def catalog(db):
+    """Seven books, two of them sharing a created_at so id has to break the tie"""
+    start = datetime(2024, 1, 1)
+    books = [
+        Book(title=f"Book {i}", price=float(i % 3), created_at=start + timedelta(minutes=min(i, 5)))
+        for i in range(7)
+    ]
+    db.add_all(books)
+    await db.commit()
+    return [book.id for book in books]
+
+async def walk(client, params: dict) -> list:
+    """Titles of every catalog page, following X-Next-Cursor until it is absent"""
+    titles, cursor = [], None
+    for _ in range(20):
+        response = await client.get("/books/", params=dict(params, **({"cursor": cursor} if cursor else {})))
+        assert response.status_code == 200
+        titles += [book["title"] for book in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return titles
+    raise AssertionError("pagination did not end")
+
+@pytest.mark.parametrize("sort", ["newest", "oldest", "price_asc", "price_desc"])
+async def test_pages_cover_every_book_once(client, catalog, sort):
+    titles = await walk(client, {"sort": sort, "limit": 2})
+    assert sorted(titles) == sorted(f"Book {i}" for i in range(7))
+
+async def test_pages_follow_the_sort_order(client, catalog):
+    newest = await walk(client, {"sort": "newest", "limit": 3})
+    assert newest == [f"Book {i}" for i in (6, 5, 4, 3, 2, 1, 0)]
+    assert await walk(client, {"sort": "oldest", "limit": 3}) == newest[::-1]
+
+async def test_tampered_cursor_is_a_bad_request(client, catalog):
+    response = await client.get("/books/", params={"cursor": raw_cursor(["yesterday", 1])})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+async def test_keyset_columns_are_never_null(app):
+    from backend.routes.book_routes import BOOK_SORT_KEYS
+    from routes.user_routes import LIBRARY_KEY
+
+    keys = [columns for columns, _ in BOOK_SORT_KEYS.values()] + [LIBRARY_KEY]
+    assert all(not column.nullable for columns in keys for column in columns)
+
+async def test_book_without_a_price_is_refused(db):
+    db.add(Book(title="Unpriced"))
+    with pytest.raises(IntegrityError):
+        await db.commit()
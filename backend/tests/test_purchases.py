@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+import auth
+import database
+from models import BookSalesDaily, Book, Purchase, Royalty, TransactionStatus, User
+from utils.purchases import PurchaseConflict, record_purchase
+from utils.sales import remove_sales
+from utils.transactions import get_available_tx_pipeline
+
+class RecordingPipeline:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, job):
+        self.jobs.append(job)
+        return True
+
+@pytest.fixture
+async def listing(db):
+    buyer = User(username="buyer", email="buyer@example.com", eth_address="0x" + "b" * 40)
+    book = Book(title="Ledger", price=0.01, contract_id=1, tx_status=TransactionStatus.CONFIRMED)
+    db.add_all([buyer, book])
+    await db.commit()
+    return buyer, book
+
+async def count(model, *where) -> int:
+    async with database.AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(model).where(*where))
+
+async def purchase(buyer, book, **kwargs):
+    async with database.AsyncSessionLocal() as db:
+        return await record_purchase(db, buyer.id, book, TransactionStatus.PENDING, **kwargs)
+
+async def fail(purchase_id: int):
+    """What the pipeline and the verifier do with a reverted purchase"""
+    async with database.AsyncSessionLocal() as db:
+        purchase = await db.get(Purchase, purchase_id)
+        purchase.tx_status = TransactionStatus.FAILED
+        sold = [(purchase.book_id, purchase.purchase_date, purchase.price_paid)]
+        await db.run_sync(lambda session: remove_sales(session.connection(), sold))
+        await db.commit()
+
+async def test_parallel_identical_purchases_record_one_row(app, client, listing):
+    buyer, book = listing
+    pipeline = RecordingPipeline()
+    app.dependency_overrides[get_available_tx_pipeline] = lambda: pipeline
+    headers = {"Authorization": f"Bearer {auth.create_user_access_token(buyer)}"}
+
+    responses = await asyncio.gather(*[
+        client.post(f"/books/{book.id}/purchase", json={"book_id": book.id}, headers=headers)
+        for _ in range(100)
+    ])
+
+    assert [response.status_code for response in responses] == [200] * 100
+    assert sum("idempotent-replayed" not in response.headers for response in responses) == 1
+    assert await count(Purchase) == 1
+    assert len(pipeline.jobs) == 1
+
+async def test_failed_purchase_can_be_bought_again(listing):
+    buyer, book = listing
+    first, _ = await purchase(buyer, book)
+    async with database.AsyncSessionLocal() as db:
+        db.add(Royalty(book_id=book.id, purchase_id=first.id, amount=0.001))
+        await db.commit()
+    await fail(first.id)
+
+    second, created = await purchase(buyer, book)
+
+    assert created
+    assert second.id == first.id
+    assert second.tx_status == TransactionStatus.PENDING
+    assert await count(Royalty) == 0
+    # Only the new attempt is counted
+    async with database.AsyncSessionLocal() as db:
+        assert await db.scalar(select(func.sum(BookSalesDaily.sales_count))) == 1
+
+async def test_parallel_retries_of_a_failed_purchase_take_it_over_once(listing):
+    buyer, book = listing
+    first, _ = await purchase(buyer, book)
+    await fail(first.id)
+
+    results = await asyncio.gather(*[purchase(buyer, book) for _ in range(50)])
+
+    assert sum(created for _, created in results) == 1
+    assert await count(Purchase) == 1
+    assert await count(Purchase, Purchase.tx_status == TransactionStatus.PENDING) == 1
+
+async def test_replayed_failed_purchase_is_returned_as_failed(listing):
+    buyer, book = listing
+    first, _ = await purchase(buyer, book, idempotency_key="k1")
+    await fail(first.id)
+
+    replayed, created = await purchase(buyer, book, idempotency_key="k1")
+    assert not created
+    assert replayed.tx_status == TransactionStatus.FAILED
+    # A new key is a new attempt
+    retried, created = await purchase(buyer, book, idempotency_key="k2")
+    assert created and retried.id == first.id
+
+async def test_owned_book_still_conflicts(listing):
+    buyer, book = listing
+    await purchase(buyer, book, idempotency_key="k1")
+    with pytest.raises(PurchaseConflict):
+        await purchase(buyer, book, idempotency_key="k2")
@@ -0,0 +1,100 @@
+"""Route query counts must not grow with the rows a request reads (N+1)"""
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+import auth
+import database
+from models import Book, Purchase, Royalty, TransactionStatus, User, UserRole
+from utils.cache import get_book_cache
+from utils.querycount import assert_constant_queries, count_queries
+from utils.search import index_books
+
+_ids = itertools.count(1)
+
+@pytest.fixture
+async def users(db):
+    users = {
+        "buyer": User(username="buyer", email="buyer@example.com", role=UserRole.USER),
+        "author": User(username="author", email="author@example.com", role=UserRole.AUTHOR),
+        "seller": User(username="seller", email="seller@example.com", role=UserRole.SELLER),
+    }
+    db.add_all(users.values())
+    await db.commit()
+    return users
+
+async def add_books(users, count: int):
+    """Books by the author and seller, each bought by the buyer with a royalty"""
+    async with database.AsyncSessionLocal() as db:
+        now = datetime.utcnow()
+        books = []
+        for _ in range(count):
+            n = next(_ids)
+            book = Book(
+                title=f"ledger volume {n}",
+                description="a chain of harbors",
+                price=1.0 + n,
+                royalty_percentage=10,
+                total_sales=1,
+                is_active=True,
+                tx_status=TransactionStatus.CONFIRMED,
+                author_id=users["author"].id,
+                seller_id=users["seller"].id
+            )
+            purchase = Purchase(
+                user_id=users["buyer"].id,
+                book=book,
+                price_paid=book.price,
+                purchase_date=now - timedelta(minutes=n),
+                tx_status=TransactionStatus.CONFIRMED,
+                is_verified=True
+            )
+            royalty = Royalty(author_id=users["author"].id, book=book, purchase=purchase, amount=0.1)
+            db.add_all([book, purchase, royalty])
+            books.append(book)
+        await db.flush()
+        await db.run_sync(index_books, [book.id for book in books])
+        await db.commit()
+
+ROUTES = [
+    ("catalog", "/books/", None),
+    ("catalog_by_seller", "/books/?seller_id={seller}", None),
+    ("search", "/books/search?q=ledger", None),
+    ("bestsellers", "/books/bestsellers", None),
+    ("library", "/user/books", "buyer"),
+    ("purchase_history", "/user/purchases", "buyer"),
+    ("author_books", "/author/books", "author"),
+    ("royalties", "/author/royalties", "author"),
+    ("author_stats", "/author/stats", "author"),
+    ("seller_books", "/seller/books", "seller"),
+    ("seller_sales", "/seller/sales", "seller"),
+]
+
+@pytest.mark.parametrize("label,path,user", ROUTES, ids=[route[0] for route in ROUTES])
+async def test_route_queries_do_not_grow_with_data(client, users, label, path, user):
+    headers = {}
+    if user is not None:
+        headers["Authorization"] = f"Bearer {auth.create_user_access_token(users[user])}"
+    url = path.format(seller=users["seller"].id)
+    await add_books(users, 2)
+
+    async def run():
+        # Catalog pages are cached; make every run read the database
+        get_book_cache().invalidate_books([])
+        response = await client.get(url, headers=headers)
+        assert response.status_code == 200, response.text
+
+    await run()  # warm the principal cache
+    await assert_constant_queries(database.async_engine, run, lambda: add_books(users, 25), label)
+
+async def test_library_page_is_one_join(client, users):
+    await add_books(users, 30)
+    headers = {"Authorization": f"Bearer {auth.create_user_access_token(users['buyer'])}"}
+    await client.get("/user/books", headers=headers)
+
+    with count_queries(database.async_engine) as counter:
+        response = await client.get("/user/books", headers=headers)
+    assert response.status_code == 200
+    # The ETag aggregate and the page join; the user comes from the principal cache
+    counter.assert_at_most(2, "library")
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import database
+from models import Book, BookSalesDaily, Purchase, TransactionStatus
+from utils.rollups import backfill
+
+def test_backfill_leaves_failed_purchases_out(db_engine):
+    with database.SessionLocal() as db:
+        book = Book(title="Ledger", price=1.0)
+        db.add_all([
+            Purchase(book=book, user_id=user_id, price_paid=1.0, purchase_date=datetime(2024, 1, 1),
+                     tx_status=TransactionStatus[status])
+            for user_id, status in enumerate(["CONFIRMED", "SUBMITTED", "FAILED"], 1)
+        ])
+        db.commit()
+
+    with database.engine.begin() as connection:
+        backfill(connection)
+
+    with database.SessionLocal() as db:
+        row = db.query(BookSalesDaily).one()
+        assert (row.sales_count, row.revenue) == (2, 2.0)
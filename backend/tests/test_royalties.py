@@ -0,0 +1,35 @@
+from sqlalchemy import func, select
+
+import database
+from models import AuthorRoyaltiesDaily, Book, Purchase, Royalty, TransactionStatus, User, UserRole
+from utils import royalties
+
+def test_reconcile_voids_royalties_of_failed_and_missing_purchases(db_engine):
+    with database.SessionLocal() as db:
+        author = User(username="author", email="author@example.com", role=UserRole.AUTHOR)
+        book = Book(title="Ledger", price=1.0, royalty_percentage=10, author=author)
+        purchases = {
+            status: Purchase(book=book, price_paid=1.0, tx_status=status, transaction_hash=f"0x{status.value}")
+            for status in TransactionStatus
+        }
+        purchases[TransactionStatus.CONFIRMED].is_verified = True
+        purchases[TransactionStatus.CONFIRMED].block_number = 7
+        db.add_all([author, book, *purchases.values()])
+        db.flush()
+        for status, purchase in purchases.items():
+            db.add(Royalty(author=author, book=book, purchase_id=purchase.id, amount=0.1, transaction_hash=f"0x{status.value}"))
+        # Left behind by a purchase that was deleted
+        db.add(Royalty(author=author, book=book, purchase_id=purchases[TransactionStatus.FAILED].id + 100, amount=0.1))
+        db.commit()
+
+        counts = royalties.reconcile(db.connection())
+        db.commit()
+
+        assert counts == {"paid": 1, "voided": 2}
+        remaining = dict(db.execute(select(Royalty.purchase_id, Royalty.is_paid)).all())
+        assert remaining == {
+            purchases[TransactionStatus.PENDING].id: False,
+            purchases[TransactionStatus.SUBMITTED].id: False,
+            purchases[TransactionStatus.CONFIRMED].id: True,
+        }
+        assert db.scalar(select(func.sum(AuthorRoyaltiesDaily.royalty_count))) == 3
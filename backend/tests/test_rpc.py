@@ -0,0 +1,138 @@
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from utils import rpc
+from utils.rpc import CircuitOpen, RPCProvider
+
+class FakeNode(BaseAdapter):
+    """A JSON-RPC endpoint answering eth_blockNumber, or refusing connections while down"""
+
+    def __init__(self, block: int = 1):
+        super().__init__()
+        self.block = block
+        self.up = True
+        self.requests = 0
+        self.read_timeout = False
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        if not self.up:
+            refused = NewConnectionError(None, "Connection refused")
+            raise requests.ConnectionError(MaxRetryError(None, request.url, refused), request=request)
+        if self.read_timeout:
+            raise requests.ReadTimeout("Read timed out", request=request)
+        body = json.loads(request.body)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"jsonrpc": "2.0", "id": body["id"], "result": hex(self.block)}).encode()
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rpc.time, "monotonic", clock)
+    return clock
+
+def make_provider(*nodes: FakeNode, **kwargs) -> RPCProvider:
+    kwargs.setdefault("retries", len(nodes) - 1)
+    provider = RPCProvider(
+        [f"http://node{i}/" for i in range(len(nodes))],
+        failure_threshold=2,
+        reset_timeout=30.0,
+        **kwargs
+    )
+    for i, node in enumerate(nodes):
+        provider.session.mount(f"http://node{i}/", node)
+    return provider
+
+def block_number(provider: RPCProvider) -> int:
+    return int(provider.make_request("eth_blockNumber", [])["result"], 16)
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    node = FakeNode()
+    node.up = False
+    provider = make_provider(node)
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            block_number(provider)
+    with pytest.raises(CircuitOpen):
+        block_number(provider)
+
+    assert node.requests == 2  # the open breaker fails fast without touching the node
+    assert provider.stats()[0]["state"] == "open"
+
+def test_half_open_breaker_lets_one_trial_through_and_closes_on_success(clock):
+    node = FakeNode()
+    node.up = False
+    provider = make_provider(node)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            block_number(provider)
+
+    node.up = True
+    clock.now += 29
+    with pytest.raises(CircuitOpen):
+        block_number(provider)
+    clock.now += 1
+
+    endpoint = provider.endpoints[0]
+    assert provider._select() is endpoint
+    assert endpoint.trial_in_flight
+    assert provider._select() is None  # a second request waits for the trial
+    provider._record(endpoint, 0.01, failed=False)
+
+    assert block_number(provider) == 1
+    assert provider.stats()[0]["state"] == "closed"
+
+def test_failed_trial_opens_the_breaker_again(clock):
+    node = FakeNode()
+    node.up = False
+    provider = make_provider(node)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            block_number(provider)
+
+    clock.now += 30
+    with pytest.raises(requests.ConnectionError):
+        block_number(provider)
+    with pytest.raises(CircuitOpen):
+        block_number(provider)
+    assert node.requests == 3
+
+def test_requests_fail_over_to_a_healthy_endpoint(clock):
+    down, healthy = FakeNode(block=1), FakeNode(block=2)
+    down.up = False
+    provider = make_provider(down, healthy)
+
+    assert [block_number(provider) for _ in range(4)] == [2, 2, 2, 2]
+    # Skipped once measured slow, and for good once its breaker opened
+    assert down.requests <= 2
+    assert healthy.requests == 4
+
+def test_sent_transactions_are_not_resent_after_a_read_timeout(clock):
+    node = FakeNode()
+    node.read_timeout = True
+    provider = make_provider(node, retries=2)
+
+    with pytest.raises(requests.ReadTimeout):
+        provider.make_request("eth_sendTransaction", [{}])
+    assert node.requests == 1
+    with pytest.raises(requests.ReadTimeout):
+        block_number(provider)
+    assert node.requests == 2  # reads stop at the breaker, not the retry count
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import database
+from models import Book, Purchase, TransactionStatus
+from utils.sales import SalesCounter, rebuild
+
+def add_book(statuses=()) -> int:
+    with database.SessionLocal() as db:
+        book = Book(title="Ledger", price=1.0, updated_at=datetime(2020, 1, 1))
+        db.add(book)
+        db.add_all([
+            Purchase(book=book, user_id=user_id, tx_status=TransactionStatus[status])
+            for user_id, status in enumerate(statuses, 1)
+        ])
+        db.commit()
+        return book.id
+
+def load(book_id: int) -> Book:
+    with database.SessionLocal() as db:
+        return db.get(Book, book_id)
+
+async def test_flush_adds_counts_without_touching_updated_at(db_engine):
+    book_id = add_book()
+    counter = SalesCounter()
+    for _ in range(3):
+        counter.record(book_id)
+    counter.record(book_id, -1)
+    await counter.flush()
+
+    book = load(book_id)
+    assert book.total_sales == 2
+    assert book.updated_at == datetime(2020, 1, 1)
+
+def test_rebuild_counts_confirmed_purchases(db_engine):
+    book_id = add_book(statuses=["CONFIRMED", "CONFIRMED", "PENDING", "SUBMITTED", "FAILED"])
+    with database.engine.begin() as connection:
+        rebuild(connection)
+
+    book = load(book_id)
+    assert book.total_sales == 2
+    assert book.updated_at == datetime(2020, 1, 1)
@@ -0,0 +1,63 @@
+import pytest
+
+from config import Config
+from models import Book
+from utils.search import index_books
+
+@pytest.fixture
+async def shelf(db):
+    """Index books by title and description; returns a helper adding more"""
+    async def add(*books):
+        db.add_all(books)
+        await db.flush()
+        await db.run_sync(index_books, [book.id for book in books])
+        await db.commit()
+        return books
+    return add
+
+async def titles(client, q: str, **params) -> list:
+    response = await client.get("/books/search", params={"q": q, **params})
+    assert response.status_code == 200
+    return [book["title"] for book in response.json()]
+
+async def test_title_hits_rank_above_description_hits(client, shelf):
+    await shelf(
+        Book(title="Winter", description="a harbor town", price=1.0),
+        Book(title="Harbor lights", description="winter", price=1.0),
+        Book(title="Signal", description="nothing here", price=1.0),
+    )
+    assert await titles(client, "harbor") == ["Harbor lights", "Winter"]
+    assert await titles(client, "harbor winter") == ["Harbor lights", "Winter"]
+
+async def test_only_the_last_word_is_a_prefix(client, shelf):
+    await shelf(
+        Book(title="Harbormaster", price=1.0),
+        Book(title="Harbor garden", price=1.0),
+        Book(title="Harbormaster garden", price=1.0),
+    )
+    assert await titles(client, "harb") == ["Harbormaster garden", "Harbor garden", "Harbormaster"]
+    assert await titles(client, "harb garden") == []
+    assert await titles(client, "garden harb") == ["Harbormaster garden", "Harbor garden"]
+
+async def test_short_last_word_is_matched_whole(client, shelf):
+    await shelf(Book(title="Harbor", price=1.0), Book(title="Ha ha", price=1.0))
+    assert await titles(client, "ha") == ["Ha ha"]
+
+async def test_inactive_books_are_not_found(client, shelf):
+    await shelf(Book(title="Ledger", price=1.0), Book(title="Ledger two", price=1.0, is_active=False))
+    assert await titles(client, "ledger") == ["Ledger"]
+
+async def test_broad_words_rank_only_the_newest_candidates(client, shelf, monkeypatch):
+    monkeypatch.setattr(Config, "SEARCH_CANDIDATES", 3)
+    await shelf(
+        Book(title="Ledger", price=1.0),  # the best match, but older than the candidates
+        *[Book(title=f"Volume {i}", description="ledger", price=1.0) for i in range(3)],
+        Book(title="Ledgers", price=1.0)  # porter stems it to ledger
+    )
+    assert await titles(client, "ledger") == ["Ledgers", "Volume 2", "Volume 1"]
+    # The exact word fills the candidates, so "ledger" is not expanded as a prefix
+    assert await titles(client, "ledger", offset=2) == ["Volume 1"]
+
+async def test_words_without_letters_or_digits_find_nothing(client, shelf):
+    await shelf(Book(title="Ledger", price=1.0))
+    assert await titles(client, "!?") == []
@@ -0,0 +1,117 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+import auth
+import database
+from models import Book, PendingTransaction, Purchase, TransactionStatus, User, UserRole
+from utils.transactions import TransactionJob, get_available_tx_pipeline, stage_job
+
+@pytest.fixture
+async def seller(db, app):
+    """A seller's token and account; contract writes go to a queue nobody works off"""
+    from utils.transactions import TransactionPipeline
+
+    seller = User(username="seller", email="seller@example.com", eth_address="0x" + "11" * 20, role=UserRole.SELLER)
+    db.add(seller)
+    await db.commit()
+    pipeline = TransactionPipeline(web3=object(), contract=object())
+    app.dependency_overrides[get_available_tx_pipeline] = lambda: pipeline
+    return {"Authorization": f"Bearer {auth.create_user_access_token(seller)}"}, seller
+
+async def test_book_being_registered_on_chain_is_not_deleted(client, db, seller):
+    headers, account = seller
+    book = Book(title="Ledger", price=0.01, seller=account, author=account)
+    db.add(book)
+    await db.flush()
+    await stage_job(db, TransactionJob("add_book", book.id, account.eth_address, "addBook", ["Ledger", 1, "", 10]))
+    await db.commit()
+
+    response = await client.delete(f"/seller/books/{book.id}", headers=headers)
+
+    assert response.status_code == 409
+    async with database.AsyncSessionLocal() as session:
+        assert await session.get(Book, book.id) is not None
+        assert await session.scalar(select(func.count(PendingTransaction.id))) == 1
+
+async def test_book_never_sent_to_the_chain_is_deleted(client, db, seller):
+    headers, account = seller
+    book = Book(title="Ledger", price=0.01, seller=account, author=account)
+    db.add(book)
+    await db.commit()
+
+    response = await client.delete(f"/seller/books/{book.id}", headers=headers)
+
+    assert response.status_code == 200
+    async with database.AsyncSessionLocal() as session:
+        assert await session.get(Book, book.id) is None
+
+async def test_price_cannot_be_cleared(client, db, seller):
+    headers, account = seller
+    book = Book(title="Ledger", price=0.01, seller=account, author=account)
+    db.add(book)
+    await db.commit()
+
+    response = await client.put(f"/seller/books/{book.id}", json={"price": None}, headers=headers)
+
+    assert response.status_code == 422
+    async with database.AsyncSessionLocal() as session:
+        assert (await session.get(Book, book.id)).price == 0.01
+
+@pytest.fixture
+async def sales(db, seller):
+    """Sales of the seller's three books (one unsold) and of another seller's book"""
+    _, account = seller
+    other = User(username="other", email="other@example.com", role=UserRole.SELLER)
+    buyers = [User(username=f"buyer{i}", email=f"buyer{i}@example.com") for i in range(3)]
+    ledger, harbor, unsold = (Book(title=title, price=1.0, seller=account) for title in ("Ledger", "Harbor", "Unsold"))
+    elsewhere = Book(title="Elsewhere", price=5.0, seller=other)
+    day = lambda d: datetime(2024, 3, d, 12)
+    db.add_all([other, *buyers, ledger, harbor, unsold, elsewhere])
+    db.add_all([
+        Purchase(user=buyers[0], book=ledger, price_paid=1.0, purchase_date=day(1), tx_status=TransactionStatus.CONFIRMED),
+        Purchase(user=buyers[1], book=ledger, price_paid=1.5, purchase_date=day(2), tx_status=TransactionStatus.CONFIRMED),
+        Purchase(user=buyers[0], book=harbor, price_paid=2.0, purchase_date=day(2), tx_status=TransactionStatus.SUBMITTED),
+        Purchase(user=buyers[2], book=elsewhere, price_paid=5.0, purchase_date=day(2), tx_status=TransactionStatus.CONFIRMED),
+    ])
+    await db.commit()
+
+async def test_sales_totals_cover_only_the_sellers_books(client, seller, sales):
+    headers, _ = seller
+    response = await client.get("/seller/sales", headers=headers)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["total_sales"], body["total_revenue"]) == (3, pytest.approx(4.5))
+    assert {row["title"]: (row["sales_count"], row["revenue"]) for row in body["sales_by_book"]} == {
+        "Ledger": (2, pytest.approx(2.5)),
+        "Harbor": (1, pytest.approx(2.0)),
+        "Unsold": (0, 0)
+    }
+
+async def test_sales_are_limited_to_the_date_range(client, seller, sales):
+    headers, _ = seller
+    response = await client.get("/seller/sales", params={"start_date": "2024-03-02", "end_date": "2024-03-03"}, headers=headers)
+
+    body = response.json()
+    assert (body["total_sales"], body["total_revenue"]) == (2, pytest.approx(3.5))
+    assert [row["sales_count"] for row in body["sales_by_book"]] == [1, 1, 0]
+
+async def test_sales_by_book_are_paged(client, seller, sales):
+    headers, _ = seller
+    titles, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/seller/sales", params=params, headers=headers)
+        assert response.json()["total_sales"] == 3  # totals are not paged
+        titles += [row["title"] for row in response.json()["sales_by_book"]]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert titles == ["Ledger", "Harbor", "Unsold"]
+
+async def test_sales_are_for_sellers_only(client, db, sales):
+    buyer = await db.scalar(select(User).where(User.username == "buyer0"))
+    response = await client.get("/seller/sales", headers={"Authorization": f"Bearer {auth.create_user_access_token(buyer)}"})
+    assert response.status_code == 403
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from utils import thumbnails
+
+class FakeBlobCache:
+    async def open(self, file_hash):
+        return f"/blobs/{file_hash}"
+
+@pytest.fixture
+def covers(monkeypatch):
+    """Stubs out storage: a cover's variants exist once it has been rendered"""
+    state = {"rendered": set(), "renders": 0, "active": 0, "max_active": 0, "lose_first": True}
+
+    async def find_variant(source_hash, width, image_format):
+        return f"{source_hash}-{width}" if source_hash in state["rendered"] else None
+
+    async def render(source_hash):
+        state["renders"] += 1
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        try:
+            await asyncio.sleep(0.02)
+            if state["lose_first"]:
+                # e.g. the uploads of the first render were lost
+                state["lose_first"] = False
+                return
+            state["rendered"].add(source_hash)
+        finally:
+            state["active"] -= 1
+
+    monkeypatch.setattr(thumbnails, "_find_variant", find_variant)
+    monkeypatch.setattr(thumbnails, "_render", render)
+    monkeypatch.setattr(thumbnails, "get_blob_cache", lambda: FakeBlobCache())
+    return state
+
+async def test_lock_is_kept_while_requests_wait(covers):
+    async def late():
+        await asyncio.sleep(0.03)  # after the first render, while the second runs
+        return await thumbnails.get_variant("QmCover", 200, "webp")
+
+    results = await asyncio.gather(
+        thumbnails.get_variant("QmCover", 200, "webp"),
+        thumbnails.get_variant("QmCover", 200, "webp"),
+        late()
+    )
+
+    assert results[1] == results[2] == f"/blobs/QmCover-{thumbnails.pick_width(200)}"
+    assert covers["renders"] == 2
+    assert covers["max_active"] == 1
+    assert thumbnails._render_locks == {}
+
+def test_undecodable_cover_is_rejected():
+    with pytest.raises(thumbnails.InvalidImage):
+        thumbnails.render_variants(b"not an image", [200])
+
+async def test_undecodable_cover_is_a_415(monkeypatch, tmp_path):
+    source = tmp_path / "cover"
+    source.write_bytes(b"<html>not an image</html>")
+
+    class SourceCache:
+        async def open(self, file_hash):
+            return str(source)
+
+    async def run(fn, *args):
+        return fn(*args)
+
+    monkeypatch.setattr(thumbnails, "get_blob_cache", lambda: SourceCache())
+    monkeypatch.setattr(thumbnails.thumbnail_pool, "run", run)
+    with pytest.raises(HTTPException) as e:
+        await thumbnails._render("QmCover")
+    assert e.value.status_code == 415
@@ -0,0 +1,281 @@
+import pytest
+import requests
+from sqlalchemy import func, select
+from web3 import Web3
+
+import database
+from models import Book, BookSalesDaily, PendingTransaction, Purchase, TransactionStatus, User, UserRole
+from utils.purchases import record_purchase
+from utils.rpc import CircuitOpen
+from utils.sales import get_sales_counter
+from utils.transactions import RECEIPT_HANDLERS, TransactionJob, TransactionPipeline, stage_job
+
+PRICE = 0.01
+
+@pytest.fixture
+async def seeded(db, chain):
+    web3, _ = chain
+    seller = User(username="seller", email="seller@example.com", eth_address=web3.eth.accounts[1], role=UserRole.SELLER)
+    buyer = User(username="buyer", email="buyer@example.com", eth_address=web3.eth.accounts[2])
+    book = Book(title="Ledger", price=PRICE, pdf_hash="QmPdf", royalty_percentage=10, seller=seller, author=seller)
+    db.add_all([seller, buyer, book])
+    await db.commit()
+    return seller, buyer, book
+
+def make_pipeline(chain, **kwargs):
+    web3, contract = chain
+    kwargs.setdefault("poll_interval", 0.01)
+    return TransactionPipeline(web3=web3, contract=contract, workers=1, **kwargs)
+
+def add_book_job(seller, book):
+    return TransactionJob(
+        kind="add_book",
+        entity_id=book.id,
+        from_address=seller.eth_address,
+        function="addBook",
+        args=[book.title, Web3.to_wei(PRICE, "ether"), book.pdf_hash, 10]
+    )
+
+def purchase_job(buyer, contract_id):
+    return TransactionJob(
+        kind="purchase",
+        entity_id=None,
+        from_address=buyer.eth_address,
+        function="purchaseBook",
+        args=[contract_id],
+        value=Web3.to_wei(PRICE, "ether")
+    )
+
+async def run(pipeline):
+    await pipeline.start()
+    try:
+        await pipeline.drain(timeout=10)
+    finally:
+        await pipeline.stop()
+
+async def stored_jobs():
+    async with database.AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count(PendingTransaction.id)))
+
+async def load(model, entity_id):
+    async with database.AsyncSessionLocal() as db:
+        return await db.get(model, entity_id)
+
+async def list_book(chain, db, seller, book):
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    pipeline = make_pipeline(chain)
+    pipeline.enqueue(job)
+    await run(pipeline)
+    return await load(Book, book.id)
+
+async def test_add_book_is_submitted_and_confirmed(chain, db, seeded):
+    seller, _, book = seeded
+    listed = await list_book(chain, db, seller, book)
+
+    assert listed.tx_status == TransactionStatus.CONFIRMED
+    assert listed.contract_id == 1
+    receipt = chain[0].eth.get_transaction_receipt(listed.transaction_hash)
+    assert receipt["status"] == 1
+    assert await stored_jobs() == 0
+
+async def test_purchase_is_confirmed_from_its_receipt(chain, db, seeded):
+    seller, buyer, book = seeded
+    listed = await list_book(chain, db, seller, book)
+
+    job = purchase_job(buyer, listed.contract_id)
+    purchase, created = await record_purchase(db, buyer.id, listed, TransactionStatus.PENDING, tx_job=job)
+    assert created and job.entity_id == purchase.id
+    pipeline = make_pipeline(chain)
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    purchase = await load(Purchase, purchase.id)
+    receipt = chain[0].eth.get_transaction_receipt(purchase.transaction_hash)
+    assert purchase.tx_status == TransactionStatus.CONFIRMED
+    assert purchase.is_verified
+    assert purchase.block_number == receipt["blockNumber"]
+    assert await stored_jobs() == 0
+
+async def test_reverted_purchase_is_kept_as_failed(chain, db, seeded):
+    seller, buyer, book = seeded
+    listed = await list_book(chain, db, seller, book)
+    # The buyer already owns the book on chain, so purchaseBook reverts
+    web3, contract = chain
+    contract.functions.purchaseBook(listed.contract_id).transact(
+        {"from": buyer.eth_address, "value": Web3.to_wei(PRICE, "ether")}
+    )
+
+    job = purchase_job(buyer, listed.contract_id)
+    purchase, _ = await record_purchase(db, buyer.id, listed, TransactionStatus.PENDING, tx_job=job)
+    pipeline = make_pipeline(chain)
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    purchase = await load(Purchase, purchase.id)
+    assert purchase is not None
+    assert purchase.tx_status == TransactionStatus.FAILED
+    assert not purchase.is_verified
+    assert await stored_jobs() == 0
+
+async def test_stored_jobs_are_recovered_after_a_restart(chain, db, seeded):
+    seller, _, book = seeded
+    job = add_book_job(seller, book)
+    # Staged by a process that died before its queue was worked off
+    await stage_job(db, job, owner="crashed")
+    await db.commit()
+
+    pipeline = make_pipeline(chain, claim_timeout=0)
+    await run(pipeline)
+
+    listed = await load(Book, book.id)
+    assert listed.tx_status == TransactionStatus.CONFIRMED
+    assert listed.contract_id == 1
+    assert await stored_jobs() == 0
+
+async def test_sent_jobs_are_polled_again_after_a_restart(chain, db, seeded):
+    seller, _, book = seeded
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    crashed = make_pipeline(chain)
+    # Sent and recorded, but the process died before the receipt was handled
+    job.tx_hash = await crashed.submit(job)
+    await crashed._write_submission(job)
+    assert (await load(Book, book.id)).tx_status == TransactionStatus.SUBMITTED
+
+    pipeline = make_pipeline(chain)
+    assert await pipeline.recover() == 1
+    assert job.tx_hash in pipeline.pending
+    await pipeline.drain(timeout=10)
+
+    listed = await load(Book, book.id)
+    assert listed.tx_status == TransactionStatus.CONFIRMED
+    assert listed.transaction_hash == job.tx_hash
+    assert await stored_jobs() == 0
+
+async def test_full_queue_leaves_the_job_for_recovery(chain, db, seeded):
+    seller, _, book = seeded
+    pipeline = make_pipeline(chain, queue_size=1)
+    pipeline.queue.put_nowait(TransactionJob("add_book", 0, seller.eth_address, "addBook", []))
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+
+    assert pipeline.enqueue(job) is False
+    pipeline.queue.get_nowait()
+    pipeline.queue.task_done()
+    assert await pipeline.recover() == 1
+    await run(pipeline)
+
+    assert (await load(Book, book.id)).tx_status == TransactionStatus.CONFIRMED
+
+async def test_failed_submission_record_does_not_fail_the_job(chain, db, seeded, monkeypatch):
+    seller, _, book = seeded
+    pipeline = make_pipeline(chain, db_retries=2)
+
+    async def broken_write(job):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(pipeline, "_write_submission", broken_write)
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    listed = await load(Book, book.id)
+    assert listed.tx_status == TransactionStatus.CONFIRMED
+    assert listed.is_active
+
+async def test_receipt_handler_errors_keep_the_job_pending(chain, db, seeded, monkeypatch):
+    seller, _, book = seeded
+    calls = []
+    handler = RECEIPT_HANDLERS["add_book"]
+
+    async def flaky(pipeline, db, job, receipt):
+        calls.append(job.id)
+        if len(calls) == 1:
+            raise RuntimeError("deadlock")
+        await handler(pipeline, db, job, receipt)
+
+    monkeypatch.setitem(RECEIPT_HANDLERS, "add_book", flaky)
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    pipeline = make_pipeline(chain)
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    assert len(calls) == 2
+    assert (await load(Book, book.id)).tx_status == TransactionStatus.CONFIRMED
+    assert await stored_jobs() == 0
+
+async def test_reverted_purchase_takes_its_sale_back(chain, db, seeded):
+    seller, buyer, book = seeded
+    listed = await list_book(chain, db, seller, book)
+    web3, contract = chain
+    contract.functions.purchaseBook(listed.contract_id).transact(
+        {"from": buyer.eth_address, "value": Web3.to_wei(PRICE, "ether")}
+    )
+
+    job = purchase_job(buyer, listed.contract_id)
+    await record_purchase(db, buyer.id, listed, TransactionStatus.PENDING, tx_job=job)
+    pipeline = make_pipeline(chain)
+    pipeline.enqueue(job)
+    await run(pipeline)
+    await get_sales_counter().flush()
+
+    assert (await load(Book, book.id)).total_sales == 0
+    async with database.AsyncSessionLocal() as db:
+        assert await db.scalar(select(func.sum(BookSalesDaily.sales_count))) == 0
+
+async def test_unreachable_node_is_retried_before_the_job_fails(chain, db, seeded, monkeypatch):
+    seller, _, book = seeded
+    pipeline = make_pipeline(chain, submit_retries=3)
+    submit = pipeline.submit
+    attempts = []
+
+    async def flaky_submit(job):
+        attempts.append(job.id)
+        if len(attempts) < 3:
+            raise CircuitOpen("All RPC endpoints are unavailable")
+        return await submit(job)
+
+    monkeypatch.setattr(pipeline, "submit", flaky_submit)
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    listed = await load(Book, book.id)
+    assert len(attempts) == 3
+    assert listed.tx_status == TransactionStatus.CONFIRMED
+    assert listed.is_active
+
+async def test_job_still_unsent_after_retries_is_left_for_recovery(chain, db, seeded, monkeypatch):
+    seller, _, book = seeded
+    pipeline = make_pipeline(chain, submit_retries=2)
+    submit = pipeline.submit
+
+    async def unreachable(job):
+        raise requests.ConnectionError("connection refused")
+
+    monkeypatch.setattr(pipeline, "submit", unreachable)
+    job = add_book_job(seller, book)
+    await stage_job(db, job)
+    await db.commit()
+    pipeline.enqueue(job)
+    await run(pipeline)
+
+    listed = await load(Book, book.id)
+    assert listed.tx_status != TransactionStatus.FAILED
+    assert listed.is_active
+    assert await stored_jobs() == 1
+
+    monkeypatch.setattr(pipeline, "submit", submit)
+    assert await pipeline.recover() == 1
+    await run(pipeline)
+    assert (await load(Book, book.id)).tx_status == TransactionStatus.CONFIRMED
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import auth
+import database
+from models import Book, Purchase, TransactionStatus, User
+from utils.purchases import record_purchase
+
+@pytest.fixture
+async def library(db):
+    """A buyer with a confirmed purchase and a failed one"""
+    buyer = User(username="buyer", email="buyer@example.com")
+    owned = Book(title="Owned", price=0.01)
+    failed = Book(title="Failed", price=0.01)
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    db.add_all([
+        buyer, owned, failed,
+        Purchase(user=buyer, book=owned, purchase_date=yesterday, tx_status=TransactionStatus.CONFIRMED),
+        Purchase(user=buyer, book=failed, purchase_date=yesterday, tx_status=TransactionStatus.FAILED),
+    ])
+    await db.commit()
+    return buyer, owned, failed
+
+async def get_library(client, buyer, etag=None):
+    headers = {"Authorization": f"Bearer {auth.create_user_access_token(buyer)}"}
+    if etag:
+        headers["If-None-Match"] = etag
+    return await client.get("/user/books", headers=headers)
+
+async def test_failed_purchases_are_not_in_the_library(client, library):
+    buyer, owned, _ = library
+    response = await get_library(client, buyer)
+    assert [book["title"] for book in response.json()] == ["Owned"]
+
+async def test_retried_purchase_changes_the_etag(client, library):
+    buyer, _, failed = library
+    etag = (await get_library(client, buyer)).headers["ETag"]
+    assert (await get_library(client, buyer, etag)).status_code == 304
+
+    async with database.AsyncSessionLocal() as db:
+        _, created = await record_purchase(db, buyer.id, failed, TransactionStatus.PENDING)
+    assert created
+
+    response = await get_library(client, buyer, etag)
+    assert response.status_code == 200
+    assert [book["title"] for book in response.json()] == ["Failed", "Owned"]
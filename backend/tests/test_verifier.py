@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+from web3 import Web3
+
+import database
+from models import Book, BookSalesDaily, Purchase, TransactionStatus, User, UserRole
+from verifier import PurchaseVerifier
+
+@pytest.fixture
+def listing(db_engine, chain):
+    """A seller, a buyer and a book listed on chain at wei_price; returns a function buying it"""
+    web3, contract = chain
+
+    def buy(wei_price: int, recorded_price: float) -> int:
+        with database.SessionLocal() as db:
+            seller = User(username="seller", email="seller@example.com", eth_address=web3.eth.accounts[1], role=UserRole.SELLER)
+            buyer = User(username="buyer", email="buyer@example.com", eth_address=web3.eth.accounts[2])
+            tx_hash = contract.functions.addBook("Ledger", wei_price, "QmPdf", 10).transact({"from": seller.eth_address})
+            receipt = web3.eth.get_transaction_receipt(tx_hash)
+            contract_id = contract.events.BookAdded().process_receipt(receipt)[0]["args"]["bookId"]
+            book = Book(
+                title="Ledger", price=recorded_price, royalty_percentage=10, contract_id=contract_id,
+                tx_status=TransactionStatus.CONFIRMED, seller=seller, author=seller,
+                total_sales=1  # counted when the purchase was recorded
+            )
+            tx_hash = contract.functions.purchaseBook(contract_id).transact({"from": buyer.eth_address, "value": wei_price})
+            purchase = Purchase(
+                user=buyer,
+                book=book,
+                price_paid=recorded_price,
+                transaction_hash=Web3.to_hex(tx_hash),
+                tx_status=TransactionStatus.SUBMITTED
+            )
+            db.add_all([seller, buyer, book, purchase])
+            db.commit()
+            return purchase.id
+
+    return buy
+
+def run_verifier(chain, purchase_id: int) -> Purchase:
+    web3, contract = chain
+    PurchaseVerifier(web3=web3, contract=contract, confirmations=0).run_once()
+    with database.SessionLocal() as db:
+        return db.get(Purchase, purchase_id)
+
+def test_exact_price_is_verified(chain, listing):
+    purchase = run_verifier(chain, listing(Web3.to_wei(Decimal("0.07"), "ether"), 0.07))
+    assert purchase.tx_status == TransactionStatus.CONFIRMED
+    assert purchase.is_verified
+
+def test_price_beyond_float_precision_is_verified(chain, listing):
+    # 18 significant digits; the recorded float rounds it up
+    wei_price = 123456789012345678
+    purchase = run_verifier(chain, listing(wei_price, float(Web3.from_wei(wei_price, "ether"))))
+    assert purchase.tx_status == TransactionStatus.CONFIRMED
+
+def test_paying_more_than_recorded_is_verified(chain, listing):
+    purchase = run_verifier(chain, listing(Web3.to_wei(Decimal("0.08"), "ether"), 0.07))
+    assert purchase.tx_status == TransactionStatus.CONFIRMED
+
+def test_paying_less_than_recorded_fails(chain, listing):
+    purchase = run_verifier(chain, listing(Web3.to_wei(Decimal("0.06"), "ether"), 0.07))
+    assert purchase.tx_status == TransactionStatus.FAILED
+    assert not purchase.is_verified
+
+def test_failed_purchase_is_taken_off_total_sales_and_rollups(chain, listing):
+    purchase = run_verifier(chain, listing(Web3.to_wei(Decimal("0.06"), "ether"), 0.07))
+    with database.SessionLocal() as db:
+        assert db.get(Book, purchase.book_id).total_sales == 0
+        assert db.scalar(select(func.sum(BookSalesDaily.sales_count))) == 0
+        assert db.scalar(select(func.sum(BookSalesDaily.revenue))) == pytest.approx(0)
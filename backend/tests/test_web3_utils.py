@@ -0,0 +1,68 @@
+import pytest
+from web3 import Web3
+
+from utils.web3_utils import ContractReader, get_receipts_batch
+
+@pytest.fixture
+def store(chain):
+    """Two books on chain, both bought by one buyer; returns (reader, author, buyer)"""
+    web3, contract = chain
+    author, buyer = web3.eth.accounts[1:3]
+    for title, price in (("Ledger", 10), ("Harbor", 20)):
+        contract.functions.addBook(title, price, f"Qm{title}", 10).transact({"from": author})
+    for book_id, price in ((1, 10), (2, 20)):
+        contract.functions.purchaseBook(book_id).transact({"from": buyer, "value": price})
+    return ContractReader(contract=contract), author, buyer
+
+def plain(value):
+    """A reader or .call() result with structs and arrays as lists, to compare the two"""
+    if isinstance(value, dict):
+        return [plain(field) for field in value.values()]
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+def test_batched_reads_match_single_calls(chain, store):
+    _, contract = chain
+    reader, author, buyer = store
+    calls = [
+        ("getBookDetails", (1,)),
+        ("getBookDetails", (2,)),
+        ("userPurchases", (buyer, 1)),
+        ("userPurchases", (author, 1)),
+        ("getUserPurchases", (buyer,)),
+        ("getAuthorRoyalties", (author,)),
+        ("getBookPurchases", (2,)),
+        ("owner", ()),
+    ]
+
+    batched = reader.call_many(calls)
+
+    assert reader.round_trips == 2  # the head block and one batch
+    for (name, args), result in zip(calls, batched):
+        assert plain(result) == plain(contract.get_function_by_name(name)(*args).call()), name
+
+def test_reader_results_are_named_and_checksummed(store):
+    reader, author, buyer = store
+
+    details = reader.book_details([1])[1]
+    purchases = reader.book_purchases([1])[1]
+
+    assert details["title"] == "Ledger"
+    assert details["author"] == Web3.to_checksum_address(author)
+    assert purchases[0]["buyer"] == Web3.to_checksum_address(buyer)
+    assert reader.has_purchased(buyer, [1, 2, 3]) == {1: True, 2: True, 3: False}
+
+def test_batched_receipts_match_single_receipts(chain, store):
+    web3, contract = chain
+    _, _, buyer = store
+    tx_hash = Web3.to_hex(contract.functions.addBook("Atlas", 30, "QmAtlas", 10).transact({"from": buyer}))
+
+    receipt = get_receipts_batch(web3, [tx_hash])[tx_hash]
+    single = web3.eth.get_transaction_receipt(tx_hash)
+
+    assert receipt["status"] == single["status"] == 1
+    assert receipt["blockNumber"] == single["blockNumber"]
+    assert receipt["logs"][0]["address"] == contract.address
+    assert receipt["logs"][0]["topics"] == single["logs"][0]["topics"]
+    assert contract.events.BookAdded().process_receipt(receipt)[0]["args"]["bookId"] == 3
@@ -0,0 +1,321 @@
+"""
+Local disk cache for IPFS content (book PDFs and covers).
+
+Blobs are fetched from the IPFS API once (/api/v0/cat, streamed to a
+temporary file and renamed into place) and served from BLOB_CACHE_DIR
+afterwards. The ipfs_cache table is the index: cached_at marks rows whose
+content is on disk, and once their file_size total passes
+BLOB_CACHE_MAX_BYTES the least used blobs are evicted, fewest accesses
+first and least recently used among equals. Reads are counted in memory
+and written to access_count/last_accessed in one batched UPDATE every
+BLOB_STATS_FLUSH_INTERVAL seconds, so serving a file never writes a row.
+
+RangeFileResponse serves a cached blob with single-range support and uses
+the ASGI zero-copy send extension when the server offers it.
+"""
+import asyncio
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import anyio
+from sqlalchemy import bindparam, func, select, update
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from config import Config
+from database import AsyncSessionLocal
+from models import IPFSCache
+from utils.ipfs import get_ipfs_client
+from utils.metrics import external_call
+
+logger = logging.getLogger(__name__)
+
+FILE_HASH_PATTERN = re.compile(r"^[A-Za-z0-9]+$")
+
+# Blobs examined per eviction query
+EVICTION_BATCH_SIZE = 100
+
+class BlobCache:
+    def __init__(
+        self,
+        root: str = Config.BLOB_CACHE_DIR,
+        max_bytes: int = Config.BLOB_CACHE_MAX_BYTES,
+        flush_interval: float = Config.BLOB_STATS_FLUSH_INTERVAL,
+        session_factory=AsyncSessionLocal
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self.used_bytes: Optional[int] = None
+        self._fetch_locks: Dict[str, asyncio.Lock] = {}
+        self._evict_lock = asyncio.Lock()
+        self._access_counts: Counter = Counter()
+        self._last_access: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self._load_usage()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically(), name="blob-stats-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_stats()
+
+    def path_for(self, file_hash: str) -> str:
+        if not FILE_HASH_PATTERN.match(file_hash):
+            raise ValueError(f"Invalid IPFS hash '{file_hash}'")
+        return os.path.join(self.root, file_hash[-2:], file_hash)
+
+    async def open(self, file_hash: str) -> str:
+        """Local path of a blob, fetching it from IPFS on a miss"""
+        path = self.path_for(file_hash)
+        if not os.path.exists(path):
+            # One fetch per blob; concurrent readers wait for it
+            lock = self._fetch_locks.setdefault(file_hash, asyncio.Lock())
+            async with lock:
+                if not os.path.exists(path):
+                    size = await self._fetch(file_hash, path)
+                    await self._mark_cached(file_hash, size)
+                    await self._evict(keep=file_hash)
+            self._fetch_locks.pop(file_hash, None)
+        self.record_access(file_hash)
+        return path
+
+    async def put(self, file_hash: str, data: bytes) -> str:
+        """Store content produced locally (e.g. a thumbnail) under its IPFS hash"""
+        path = self.path_for(file_hash)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".put-")
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+            await self._mark_cached(file_hash, len(data))
+            await self._evict(keep=file_hash)
+        return path
+
+    def record_access(self, file_hash: str):
+        self._access_counts[file_hash] += 1
+        self._last_access[file_hash] = datetime.utcnow()
+
+    async def flush_stats(self):
+        """Write the reads counted since the last flush in one executemany UPDATE"""
+        if not self._access_counts:
+            return
+        counts, self._access_counts = self._access_counts, Counter()
+        last_access, self._last_access = self._last_access, {}
+        table = IPFSCache.__table__
+        statement = (
+            update(table)
+            .where(table.c.file_hash == bindparam("b_hash"))
+            .values(
+                access_count=func.coalesce(table.c.access_count, 0) + bindparam("b_count"),
+                last_accessed=bindparam("b_time")
+            )
+        )
+        async with self.session_factory() as db:
+            await db.execute(statement, [
+                {"b_hash": file_hash, "b_count": count, "b_time": last_access[file_hash]}
+                for file_hash, count in counts.items()
+            ])
+            await db.commit()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_stats()
+            except Exception:
+                logger.exception("Failed to flush blob access stats")
+
+    async def _load_usage(self):
+        async with self.session_factory() as db:
+            self.used_bytes = await db.scalar(
+                select(func.coalesce(func.sum(IPFSCache.file_size), 0))
+                .where(IPFSCache.cached_at.isnot(None))
+            )
+
+    async def _fetch(self, file_hash: str, path: str) -> int:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".fetch-")
+        size = 0
+        try:
+            async with await anyio.open_file(fd, "wb") as out:
+                with external_call("ipfs", "cat"):
+                    async with get_ipfs_client().stream("POST", "/cat", params={"arg": file_hash}) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes():
+                            await out.write(chunk)
+                            size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return size
+
+    async def _mark_cached(self, file_hash: str, size: int):
+        if self.used_bytes is None:
+            await self._load_usage()
+        async with self.session_factory() as db:
+            result = await db.execute(select(IPFSCache).where(IPFSCache.file_hash == file_hash))
+            entry = result.scalars().first()
+            if entry is None:
+                # Content added to IPFS outside this API, e.g. found by the event indexer
+                entry = IPFSCache(file_hash=file_hash, access_count=0)
+                db.add(entry)
+            if entry.cached_at is not None:
+                self.used_bytes -= entry.file_size or 0
+            entry.file_size = size
+            entry.cached_at = datetime.utcnow()
+            await db.commit()
+        self.used_bytes += size
+
+    async def _evict(self, keep: str):
+        """Remove the least used blobs until the cache fits in max_bytes again"""
+        async with self._evict_lock:
+            if self.used_bytes <= self.max_bytes:
+                return
+            # Rank by up-to-date counts
+            await self.flush_stats()
+            async with self.session_factory() as db:
+                while self.used_bytes > self.max_bytes:
+                    result = await db.execute(
+                        select(IPFSCache)
+                        .where(IPFSCache.cached_at.isnot(None), IPFSCache.file_hash != keep)
+                        .order_by(
+                            func.coalesce(IPFSCache.access_count, 0),
+                            IPFSCache.last_accessed,
+                            IPFSCache.id
+                        )
+                        .limit(EVICTION_BATCH_SIZE)
+                    )
+                    entries = result.scalars().all()
+                    if not entries:
+                        break
+                    for entry in entries:
+                        if self.used_bytes <= self.max_bytes:
+                            break
+                        try:
+                            os.remove(self.path_for(entry.file_hash))
+                        except FileNotFoundError:
+                            pass
+                        entry.cached_at = None
+                        self.used_bytes -= entry.file_size or 0
+                    await db.commit()
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) of a single "bytes=" range, or None to serve the
+    whole file (no header, several ranges or a malformed one, which RFC 7233
+    says to ignore). Raises ValueError if the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    if not (start or end) or any(part and not (part.isascii() and part.isdigit()) for part in (start, end)):
+        return None
+    if start:
+        first = int(start)
+        if end and int(end) < first:
+            return None
+        last = min(int(end), size - 1) if end else size - 1
+    else:
+        # Suffix range: the last N bytes
+        first = max(size - int(end), 0)
+        last = size - 1
+    if first > last or first >= size:
+        raise ValueError("Range not satisfiable")
+    return first, last
+
+class RangeFileResponse(Response):
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        request_headers: Headers,
+        media_type: str,
+        etag: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.path = path
+        self.size = os.stat(path).st_size
+        headers = dict(headers or {})
+        headers["accept-ranges"] = "bytes"
+        if etag:
+            headers["etag"] = f'"{etag}"'
+
+        self.offset, self.length = 0, self.size
+        status_code = 200
+        if etag and request_headers.get("if-none-match") == headers["etag"]:
+            status_code, self.length = 304, 0
+        else:
+            try:
+                byte_range = parse_range(request_headers.get("range"), self.size)
+            except ValueError:
+                byte_range = None
+                status_code, self.length = 416, 0
+                headers["content-range"] = f"bytes */{self.size}"
+            if byte_range is not None:
+                first, last = byte_range
+                status_code = 206
+                self.offset, self.length = first, last - first + 1
+                headers["content-range"] = f"bytes {first}-{last}/{self.size}"
+        if status_code != 304:
+            headers["content-length"] = str(self.length)
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+_blob_cache: Optional[BlobCache] = None
+
+def get_blob_cache() -> BlobCache:
+    """Get the process-wide blob cache"""
+    global _blob_cache
+    if _blob_cache is None:
+        _blob_cache = BlobCache()
+    return _blob_cache
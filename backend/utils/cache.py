@@ -0,0 +1,244 @@
+"""
+Read-through cache for serialized API payloads.
+
+Two interchangeable backends share one small interface (get/set/delete/
+incr/get_counter/stats): an in-process LRU with per-entry TTL, and a
+Redis backend that works with any redis-py compatible client (including
+fakeredis). Only the Redis backend sees invalidations made by other
+processes such as the event indexer; with the in-process cache their
+writes show up once CACHE_TTL expires.
+BookCache builds on it: book detail payloads are keyed under a version
+per book that writes to the book bump, and catalog pages under a
+generation number that any book write bumps, so stale payloads are never
+read again and simply age out. Callers read the version before loading
+from the database, so a load that races a write is stored under the old
+version rather than outliving the invalidation. PrincipalCache keeps authenticated users for AUTH_CACHE_TTL,
+along with the cut-off before which a user's token claims are not trusted;
+the cut-off only reaches every process on Redis (configured without
+eviction), so claims are not trusted at all on the in-process cache.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from config import Config
+
+class MemoryCache:
+    """Thread-safe LRU cache with a TTL per entry"""
+
+    shared = False  # other processes see neither its entries nor its deletes
+
+    def __init__(self, max_entries: int = Config.CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters: Dict[str, int] = {}  # never evicted
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+            }
+
+class RedisCache:
+    """Cache backed by a redis-py compatible client"""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = "bookstore:"):
+        self.client = client
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(self.prefix + key)
+
+    def get_counter(self, key: str) -> int:
+        # Counters have no TTL, so volatile-* eviction policies never drop them
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def stats(self) -> dict:
+        # Evictions are server-wide; Redis does not report them per key prefix
+        info = self.client.info("stats")
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": info.get("evicted_keys", 0),
+            "expirations": info.get("expired_keys", 0),
+        }
+
+def _params_key(params: Dict) -> str:
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+class BookCache:
+    CATALOG_GENERATION = "catalog:generation"
+
+    def __init__(self, backend, ttl: float = Config.CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def book_version(self, book_id: int) -> int:
+        """Version a book's detail payload is cached under; read it before loading the book"""
+        return self.backend.get_counter(f"book:{book_id}:version")
+
+    def get_book(self, book_id: int, version: int) -> Optional[bytes]:
+        return self.backend.get(f"book:{book_id}:{version}")
+
+    def set_book(self, book_id: int, version: int, payload: bytes):
+        self.backend.set(f"book:{book_id}:{version}", payload, self.ttl)
+
+    def catalog_generation(self) -> int:
+        """Generation catalog pages are cached under; read it before loading the page"""
+        return self.backend.get_counter(self.CATALOG_GENERATION)
+
+    def get_catalog(self, params: Dict, generation: int) -> Optional[dict]:
+        """Cached catalog page as {"body": json, "cursor": next cursor or None}"""
+        value = self.backend.get(f"catalog:{generation}:{_params_key(params)}")
+        return json.loads(value) if value is not None else None
+
+    def set_catalog(self, params: Dict, generation: int, body: str, cursor: Optional[str]):
+        payload = json.dumps({"body": body, "cursor": cursor}).encode()
+        self.backend.set(f"catalog:{generation}:{_params_key(params)}", payload, self.ttl)
+
+    def invalidate_books(self, book_ids: Iterable[int]):
+        """Move the books' detail payloads and every catalog page to a new version"""
+        for book_id in book_ids:
+            self.backend.incr(f"book:{book_id}:version")
+        self.backend.incr(self.CATALOG_GENERATION)
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+class PrincipalCache:
+    """Authenticated users keyed by token subject"""
+
+    def __init__(self, backend, ttl: float = Config.AUTH_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, username: str) -> Optional[dict]:
+        value = self.backend.get(f"principal:{username}")
+        return json.loads(value) if value is not None else None
+
+    def set(self, username: str, fields: Dict):
+        payload = json.dumps(fields, default=str).encode()
+        self.backend.set(f"principal:{username}", payload, self.ttl)
+
+    def invalidate(self, *usernames: str):
+        self.backend.delete(*[f"principal:{username}" for username in usernames])
+
+    @property
+    def shared(self) -> bool:
+        """Whether revocations reach every process (token claims are only trusted then)"""
+        return self.backend.shared
+
+    def revoke(self, username: str, issued_before: float):
+        """Reject token claims issued up to the given unix time until those tokens expire"""
+        self.backend.set(f"revoked:{username}", repr(issued_before).encode(), Config.JWT_ACCESS_TOKEN_EXPIRES)
+        self.invalidate(username)
+
+    def revoked_at(self, username: str) -> Optional[float]:
+        value = self.backend.get(f"revoked:{username}")
+        return float(value) if value is not None else None
+
+def create_cache_backend(backend: str = Config.CACHE_BACKEND):
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from e
+        return RedisCache(redis.Redis.from_url(
+            Config.CACHE_REDIS_URL,
+            socket_timeout=Config.CACHE_REDIS_TIMEOUT
+        ))
+    raise ValueError(f"Unknown cache backend '{backend}'")
+
+_book_cache: Optional[BookCache] = None
+
+def get_book_cache() -> BookCache:
+    """Get the process-wide book cache"""
+    global _book_cache
+    if _book_cache is None:
+        _book_cache = BookCache(create_cache_backend())
+    return _book_cache
+
+_principal_cache: Optional[PrincipalCache] = None
+
+def get_principal_cache() -> PrincipalCache:
+    """Get the process-wide principal cache"""
+    global _principal_cache
+    if _principal_cache is None:
+        _principal_cache = PrincipalCache(create_cache_backend())
+    return _principal_cache
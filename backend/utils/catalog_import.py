@@ -0,0 +1,309 @@
+"""
+Bulk catalog imports for sellers.
+
+A manifest (CSV with a header row, or JSON Lines) lists one book per row:
+title, price, royalty_percentage, an optional description, and pdf and
+optional cover paths inside a zip archive shipped with it. The manifest is
+streamed IMPORT_BATCH_SIZE rows at a time. For each batch the files are
+uploaded to IPFS straight out of the archive, at most
+IMPORT_UPLOAD_CONCURRENCY books at once. The Book rows are then inserted
+with one executemany and indexed for search, and an addBook registration
+is stored with them and queued for each book, waiting for room in the
+transaction pipeline instead of failing when it is full. Rows that fail
+validation or upload are reported with their manifest line and skipped,
+so memory stays flat however large the catalog is.
+
+    python -m utils.catalog_import SELLER_USERNAME manifest.csv books.zip
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import math
+import uuid
+import zipfile
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import insert, select
+from web3 import Web3
+
+from config import Config
+from database import AsyncSessionLocal
+from models import Book, TransactionStatus
+from utils.cache import get_book_cache
+from utils.ipfs import upload_book_files
+from utils.search import index_books
+from utils.transactions import TransactionJob, TransactionPipeline, get_tx_pipeline, stage_jobs
+
+logger = logging.getLogger(__name__)
+
+# Finished imports kept for progress lookups
+MAX_TRACKED_IMPORTS = 100
+
+class ImportRowError(ValueError):
+    """A manifest row that cannot be imported"""
+
+@dataclass
+class ImportProgress:
+    id: str
+    seller_id: int
+    status: str = "running"  # running, completed or failed
+    rows: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+    message: Optional[str] = None
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        self.errors.append({"line": line, "error": message})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+@dataclass
+class ManifestRow:
+    line: int
+    title: str
+    price: float
+    royalty_percentage: float
+    pdf: str
+    cover: Optional[str] = None
+    description: Optional[str] = None
+
+def read_manifest(fileobj: BinaryIO, filename: str) -> Iterator[Tuple[int, Union[dict, str]]]:
+    """Yield (line number, row) pairs: dicts for CSV, raw JSON text for JSON Lines"""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if filename.lower().endswith(".csv"):
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, raw in enumerate(text, 1):
+            if raw.strip():
+                yield line, raw
+
+def parse_row(line: int, raw: Union[dict, str], archive: zipfile.ZipFile) -> ManifestRow:
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as e:
+            raise ImportRowError(f"invalid JSON: {e}")
+        if not isinstance(raw, dict):
+            raise ImportRowError("expected a JSON object")
+
+    def value(name: str) -> Optional[str]:
+        item = raw.get(name)
+        return str(item).strip() or None if item is not None else None
+
+    title = value("title")
+    if not title:
+        raise ImportRowError("title is required")
+    try:
+        price = float(value("price") or "")
+        royalty_percentage = float(value("royalty_percentage") or 0)
+    except ValueError:
+        raise ImportRowError("price and royalty_percentage must be numbers")
+    if not math.isfinite(price) or not math.isfinite(royalty_percentage):
+        raise ImportRowError("price and royalty_percentage must be numbers")
+    if price <= 0:
+        raise ImportRowError("price must be greater than 0")
+    if not 0 <= royalty_percentage <= 100:
+        raise ImportRowError("royalty_percentage must be between 0 and 100")
+
+    pdf, cover = value("pdf"), value("cover")
+    if not pdf:
+        raise ImportRowError("pdf is required")
+    for path in filter(None, (pdf, cover)):
+        try:
+            archive.getinfo(path)
+        except KeyError:
+            raise ImportRowError(f"'{path}' is not in the archive")
+    return ManifestRow(line, title, price, royalty_percentage, pdf, cover, value("description"))
+
+class CatalogImporter:
+    def __init__(
+        self,
+        seller,
+        archive: zipfile.ZipFile,
+        pipeline: Optional[TransactionPipeline] = None,
+        session_factory=AsyncSessionLocal,
+        batch_size: int = Config.IMPORT_BATCH_SIZE,
+        concurrency: int = Config.IMPORT_UPLOAD_CONCURRENCY
+    ):
+        self.seller = seller
+        self.archive = archive
+        self.pipeline = pipeline or get_tx_pipeline()
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._uploads = asyncio.Semaphore(concurrency)
+
+    async def run(self, manifest: BinaryIO, filename: str, progress: ImportProgress) -> ImportProgress:
+        batch: List[ManifestRow] = []
+        try:
+            for line, raw in read_manifest(manifest, filename):
+                progress.rows += 1
+                try:
+                    batch.append(parse_row(line, raw, self.archive))
+                except ImportRowError as e:
+                    progress.error(line, str(e))
+                if len(batch) >= self.batch_size:
+                    await self.import_batch(batch, progress)
+                    batch = []
+            if batch:
+                await self.import_batch(batch, progress)
+            progress.status = "completed"
+        except Exception as e:
+            logger.exception("Catalog import %s failed", progress.id)
+            progress.status = "failed"
+            progress.message = str(e)
+        progress.finished_at = datetime.utcnow()
+        return progress
+
+    async def _upload(self, row: ManifestRow) -> Tuple[Optional[str], Optional[str]]:
+        async with self._uploads:
+            pdf_file = self.archive.open(row.pdf)
+            cover_image = self.archive.open(row.cover) if row.cover else None
+            try:
+                return await upload_book_files(pdf_file, cover_image)
+            finally:
+                pdf_file.close()
+                if cover_image is not None:
+                    cover_image.close()
+
+    async def import_batch(self, rows: List[ManifestRow], progress: ImportProgress):
+        uploads = await asyncio.gather(*[self._upload(row) for row in rows], return_exceptions=True)
+        ready = []
+        for row, result in zip(rows, uploads):
+            if isinstance(result, Exception):
+                progress.error(row.line, f"upload failed: {result}")
+            else:
+                ready.append((row, result))
+        if not ready:
+            return
+
+        # executemany cannot return generated ids, so the batch shares a
+        # created_at stamp and its ids are read back in insertion order
+        created_at = datetime.utcnow()
+        async with self.session_factory() as db:
+            await db.execute(insert(Book), [
+                {
+                    "title": row.title,
+                    "description": row.description,
+                    "price": row.price,
+                    "pdf_hash": pdf_hash,
+                    "cover_hash": cover_hash,
+                    "royalty_percentage": row.royalty_percentage,
+                    "seller_id": self.seller.id,
+                    "tx_status": TransactionStatus.PENDING,
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                }
+                for row, (pdf_hash, cover_hash) in ready
+            ])
+            book_ids = (await db.execute(
+                select(Book.id)
+                .where(Book.seller_id == self.seller.id, Book.created_at == created_at)
+                .order_by(Book.id)
+            )).scalars().all()
+            if len(book_ids) != len(ready):
+                raise RuntimeError("Could not match imported rows to their book ids")
+            await db.run_sync(index_books, book_ids)
+            # Stored with the books so a restart cannot lose the registrations
+            jobs = [
+                TransactionJob(
+                    kind="add_book",
+                    entity_id=book_id,
+                    from_address=self.seller.eth_address,
+                    function="addBook",
+                    args=[row.title, Web3.to_wei(row.price, 'ether'), pdf_hash, int(row.royalty_percentage)]
+                )
+                for book_id, (row, (pdf_hash, _)) in zip(book_ids, ready)
+            ]
+            await stage_jobs(db, jobs, self.pipeline.owner)
+            await db.commit()
+        get_book_cache().invalidate_books(book_ids)
+        progress.imported += len(ready)
+
+        for job in jobs:
+            await self.pipeline.put(job)
+        logger.info(
+            "Import %s: %s rows read, %s imported, %s failed",
+            progress.id, progress.rows, progress.imported, progress.failed
+        )
+
+_imports: "OrderedDict[str, ImportProgress]" = OrderedDict()
+_tasks = set()
+_seller_locks: Dict[int, asyncio.Lock] = {}
+
+def get_import(import_id: str) -> Optional[ImportProgress]:
+    return _imports.get(import_id)
+
+def start_import(seller, manifest_path: str, manifest_name: str, archive_path: str, cleanup=None) -> ImportProgress:
+    """Run an import in the background; cleanup() is called once it has finished"""
+    progress = ImportProgress(id=uuid.uuid4().hex, seller_id=seller.id)
+    _imports[progress.id] = progress
+    while len(_imports) > MAX_TRACKED_IMPORTS:
+        oldest = next(iter(_imports.values()))
+        if oldest.status == "running":
+            break
+        _imports.popitem(last=False)
+
+    async def _run():
+        try:
+            # Imports by one seller run one at a time, so batch stamps never collide
+            async with _seller_locks.setdefault(seller.id, asyncio.Lock()):
+                with zipfile.ZipFile(archive_path) as archive, open(manifest_path, "rb") as manifest:
+                    await CatalogImporter(seller, archive).run(manifest, manifest_name, progress)
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+    task = asyncio.create_task(_run(), name=f"catalog-import-{progress.id}")
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return progress
+
+async def _import_from_cli(username: str, manifest_path: str, archive_path: str) -> ImportProgress:
+    from models import User, UserRole
+
+    async with AsyncSessionLocal() as db:
+        seller = (await db.execute(select(User).where(User.username == username))).scalars().first()
+    if seller is None or seller.role != UserRole.SELLER:
+        raise SystemExit(f"❌ '{username}' is not a seller")
+
+    pipeline = get_tx_pipeline()
+    await pipeline.start()
+    try:
+        progress = ImportProgress(id=uuid.uuid4().hex, seller_id=seller.id)
+        with zipfile.ZipFile(archive_path) as archive, open(manifest_path, "rb") as manifest:
+            await CatalogImporter(seller, archive, pipeline).run(manifest, manifest_path, progress)
+        # Wait for the addBook registrations to be mined
+        await pipeline.drain(timeout=None)
+    finally:
+        await pipeline.stop()
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a catalog of books for a seller")
+    parser.add_argument("seller", help="username of the seller")
+    parser.add_argument("manifest", help="CSV or JSON Lines manifest")
+    parser.add_argument("archive", help="zip archive holding the files the manifest refers to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    progress = asyncio.run(_import_from_cli(args.seller, args.manifest, args.archive))
+    for error in progress.errors:
+        print(f"line {error['line']}: {error['error']}")
+    icon = "✅" if progress.status == "completed" else "❌"
+    print(f"{icon} {progress.imported} imported, {progress.failed} failed of {progress.rows} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Bounded worker pools for CPU-heavy work called from async handlers.
+
+Work handed to run_in_executor normally queues without limit, so a burst
+of slow calls (bcrypt, image resizing) only moves the backlog from the
+event loop into the pool. BoundedExecutor counts calls that are running or
+waiting and refuses new ones once max_pending is reached; callers turn that
+into a 429 so clients back off instead of piling up. Work that holds the
+GIL (image decoding) uses processes=True; its function and arguments must
+be picklable.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+class ExecutorSaturated(Exception):
+    """Raised when a BoundedExecutor already has max_pending calls in flight"""
+
+class BoundedExecutor:
+    def __init__(self, workers: int, max_pending: int, name: str = "worker", processes: bool = False):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self.processes = processes
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run fn in the pool; raises ExecutorSaturated instead of queueing past max_pending"""
+        # Only the event loop thread touches the counter, so no lock is needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorSaturated(f"{self.name} pool has {self.pending} calls pending")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,207 @@
+"""
+Streaming CSV and Parquet exports of sales and royalty ledgers.
+
+Rows are read from a read replica when one is configured, through a
+server-side cursor (AsyncSession.stream with yield_per) EXPORT_BATCH_SIZE
+at a time, and each batch is encoded and sent before the next is fetched:
+as one block of CSV lines, or as one Parquet row group. Memory is bounded by the batch size whatever the size of the
+ledger, and the first bytes go out as soon as the first batch is read.
+Parquet output needs the optional pyarrow package.
+"""
+import csv
+import io
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from config import Config
+from database import ReadSessionLocal
+from models import Book, Purchase, Royalty
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",  # Starlette adds "; charset=utf-8" to text types
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
+
+@dataclass(frozen=True)
+class ExportColumn:
+    name: str
+    expression: object
+    type: str  # int, float, str, bool or datetime
+
+PURCHASE_COLUMNS = (
+    ExportColumn("id", Purchase.id, "int"),
+    ExportColumn("book_id", Purchase.book_id, "int"),
+    ExportColumn("book_title", Book.title, "str"),
+    ExportColumn("user_id", Purchase.user_id, "int"),
+    ExportColumn("price_paid", Purchase.price_paid, "float"),
+    ExportColumn("purchase_date", Purchase.purchase_date, "datetime"),
+    ExportColumn("transaction_hash", Purchase.transaction_hash, "str"),
+    ExportColumn("block_number", Purchase.block_number, "int"),
+    ExportColumn("is_verified", Purchase.is_verified, "bool"),
+    ExportColumn("tx_status", Purchase.tx_status, "str"),
+)
+
+ROYALTY_COLUMNS = (
+    ExportColumn("id", Royalty.id, "int"),
+    ExportColumn("book_id", Royalty.book_id, "int"),
+    ExportColumn("book_title", Book.title, "str"),
+    ExportColumn("purchase_id", Royalty.purchase_id, "int"),
+    ExportColumn("amount", Royalty.amount, "float"),
+    ExportColumn("payment_date", Royalty.payment_date, "datetime"),
+    ExportColumn("transaction_hash", Royalty.transaction_hash, "str"),
+    ExportColumn("block_number", Royalty.block_number, "int"),
+    ExportColumn("is_paid", Royalty.is_paid, "bool"),
+)
+
+def date_filters(column, start_date: Optional[date], end_date: Optional[date]) -> list:
+    """Conditions limiting a datetime column to the UTC days in [start_date, end_date)"""
+    conditions = []
+    if start_date is not None:
+        conditions.append(column >= datetime.combine(start_date, time.min))
+    if end_date is not None:
+        conditions.append(column < datetime.combine(end_date, time.min))
+    return conditions
+
+def purchase_ledger(*conditions) -> Select:
+    return (
+        select(*[column.expression for column in PURCHASE_COLUMNS])
+        .join(Book, Book.id == Purchase.book_id)
+        .where(*conditions)
+        .order_by(Purchase.id)
+    )
+
+def royalty_ledger(*conditions) -> Select:
+    return (
+        select(*[column.expression for column in ROYALTY_COLUMNS])
+        .outerjoin(Book, Book.id == Royalty.book_id)
+        .where(*conditions)
+        .order_by(Royalty.id)
+    )
+
+# Spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _text(value) -> object:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Titles are chosen by sellers; quote them so opening a download cannot run them
+        return "'" + value
+    return value
+
+async def _batches(statement: Select, batch_size: int) -> AsyncIterator[Sequence]:
+    async with ReadSessionLocal() as db:
+        result = await db.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            yield rows
+
+async def _csv(statement: Select, columns: Sequence[ExportColumn], batch_size: int) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in columns])
+    yield buffer.getvalue().encode()
+    async for rows in _batches(statement, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_text(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+
+class _Sink:
+    """Write-only file object that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def _arrow_schema(pa, columns: Sequence[ExportColumn]):
+    types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "bool": pa.bool_(),
+        "datetime": pa.timestamp("us"),
+    }
+    return pa.schema([(column.name, types[column.type]) for column in columns])
+
+async def _parquet(statement: Select, columns: Sequence[ExportColumn], batch_size: int) -> AsyncIterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(pa, columns)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for rows in _batches(statement, batch_size):
+            # One row group per batch
+            writer.write_table(pa.Table.from_pydict(
+                {
+                    column.name: [
+                        row[i].value if isinstance(row[i], Enum) else row[i]
+                        for row in rows
+                    ]
+                    for i, column in enumerate(columns)
+                },
+                schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def export_response(
+    statement: Select,
+    columns: Sequence[ExportColumn],
+    export_format: ExportFormat,
+    filename: str,
+    batch_size: int = Config.EXPORT_BATCH_SIZE
+) -> StreamingResponse:
+    """Stream the rows of statement as a CSV or Parquet download"""
+    if export_format == ExportFormat.PARQUET:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(
+                status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                detail="Parquet export requires the 'pyarrow' package"
+            )
+        body = _parquet(statement, columns, batch_size)
+    else:
+        body = _csv(statement, columns, batch_size)
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'}
+    )
@@ -0,0 +1,143 @@
+"""
+Content-addressed uploads of book files to IPFS.
+
+Files are hashed (sha256) in a worker thread before anything is sent, and
+the hash is looked up in the ipfs_cache table, so re-uploading a file IPFS
+already has costs one query. New files are streamed to the IPFS HTTP API
+(/api/v0/add) as chunked multipart from their spooled temporary file, so
+memory per upload stays constant whatever the file size. Multipart uploads
+(UploadFile) are already spooled to disk by Starlette; bytes and base64
+strings from JSON bodies are uploaded from memory.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import mimetypes
+from datetime import datetime
+from typing import BinaryIO, Optional, Tuple
+
+import httpx
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from database import AsyncSessionLocal
+from models import IPFSCache
+from utils.metrics import external_call
+
+CHUNK_SIZE = 1024 * 1024
+
+_client: Optional[httpx.AsyncClient] = None
+
+def get_ipfs_client() -> httpx.AsyncClient:
+    """Get the shared client for the IPFS HTTP API"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=f"http://{Config.IPFS_HOST}:{Config.IPFS_PORT}/api/v0",
+            timeout=Config.IPFS_TIMEOUT
+        )
+    return _client
+
+async def close_ipfs_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _open(file) -> Tuple[BinaryIO, Optional[str], Optional[str]]:
+    """Binary file object, filename and content type of an upload"""
+    if hasattr(file, "filename") and hasattr(file, "file"):  # UploadFile
+        return file.file, file.filename, file.content_type
+    if isinstance(file, (bytes, bytearray)):
+        return io.BytesIO(file), None, None
+    if isinstance(file, str):
+        return io.BytesIO(base64.b64decode(file)), None, None
+    return file, getattr(file, "name", None), None
+
+def _hash_file(fileobj: BinaryIO) -> Tuple[str, int]:
+    """sha256 and size of a file, read in chunks from the start"""
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+async def _find_cached(content_hash: str) -> Optional[str]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(IPFSCache).where(IPFSCache.content_hash == content_hash))
+        entry = result.scalars().first()
+        if entry is None:
+            return None
+        entry.access_count = (entry.access_count or 0) + 1
+        entry.last_accessed = datetime.utcnow()
+        await db.commit()
+        return entry.file_hash
+
+async def _record_upload(**fields):
+    async with AsyncSessionLocal() as db:
+        db.add(IPFSCache(**fields))
+        try:
+            await db.commit()
+            return
+        except IntegrityError:
+            # A concurrent upload recorded it first, or the CID predates content hashing
+            await db.rollback()
+        await db.execute(
+            update(IPFSCache)
+            .where(IPFSCache.file_hash == fields["file_hash"], IPFSCache.content_hash.is_(None))
+            .values(content_hash=fields["content_hash"])
+        )
+        await db.commit()
+
+async def upload_to_ipfs(file, file_type: Optional[str] = None, mime_type: Optional[str] = None) -> Optional[str]:
+    """
+    Upload a file (UploadFile, file object, bytes or base64 string) to IPFS
+    unless identical content is already there, and return its IPFS hash.
+    mime_type overrides the type sent with or guessed from the upload.
+    """
+    if file is None or isinstance(file, (bytes, bytearray, str)) and not file:
+        return None
+    fileobj, filename, sent_type = _open(file)
+    mime_type = mime_type or sent_type
+    content_hash, size = await asyncio.to_thread(_hash_file, fileobj)
+
+    file_hash = await _find_cached(content_hash)
+    if file_hash is not None:
+        return file_hash
+
+    if mime_type is None and filename:
+        mime_type = mimetypes.guess_type(filename)[0]
+    mime_type = mime_type or "application/octet-stream"
+
+    # httpx reads file objects in chunks while sending the multipart body
+    with external_call("ipfs", "add"):
+        response = await get_ipfs_client().post(
+            "/add",
+            params={"pin": "true"},
+            files={"file": (filename or content_hash, fileobj, mime_type)}
+        )
+        response.raise_for_status()
+    file_hash = response.json()["Hash"]
+
+    await _record_upload(
+        file_hash=file_hash,
+        content_hash=content_hash,
+        file_type=file_type,
+        original_filename=filename,
+        file_size=size,
+        mime_type=mime_type
+    )
+    return file_hash
+
+async def upload_book_files(pdf_file, cover_image) -> Tuple[Optional[str], Optional[str]]:
+    """Upload a book's PDF and cover concurrently; returns (pdf_hash, cover_hash)"""
+    pdf_hash, cover_hash = await asyncio.gather(
+        upload_to_ipfs(pdf_file, "pdf"),
+        upload_to_ipfs(cover_image, "cover")
+    )
+    return pdf_hash, cover_hash
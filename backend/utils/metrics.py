@@ -0,0 +1,257 @@
+"""
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request and files it under its route
+template (/books/{book_id}, not the raw path, so series stay bounded),
+method (uncommon ones as "other") and status. While a request runs, its RequestStats sits in a
+context variable: SQLAlchemy cursor hooks (instrument_engine) add each
+statement and its duration to it, and external_call() adds time spent
+waiting on the Web3 node or IPFS. When the response has been sent these
+become per-route histograms of queries, DB time and external time.
+
+Everything is kept in process, in plain dicts under one lock per metric;
+recording a request costs a few microseconds. GET /metrics renders it.
+With several workers, each reports its own series.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Any token is a valid method to the server; others share one series
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, values: tuple, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples()
+        ]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{self._labels(labels)} {_format(value)}" for labels, value in values]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per series: a count per bucket (the last one is +Inf), then the sum
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(labels, (('le', _format(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_format(values[-1])}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time to serve a request, including streaming the body",
+    ("method", "route", "status")
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per request",
+    ("route",), QUERY_BUCKETS
+))
+REQUEST_DB_SECONDS = REGISTRY.register(Histogram(
+    "http_request_db_seconds", "Time per request spent executing SQL", ("route",)
+))
+REQUEST_EXTERNAL_SECONDS = REGISTRY.register(Histogram(
+    "http_request_external_seconds", "Time per request spent waiting on an external service",
+    ("route", "service")
+))
+DB_QUERIES = REGISTRY.register(Counter(
+    "db_queries_total", "SQL statements executed, inside requests or not"
+))
+DB_SECONDS = REGISTRY.register(Counter(
+    "db_query_seconds_total", "Time spent executing SQL statements"
+))
+EXTERNAL_SECONDS = REGISTRY.register(Histogram(
+    "external_call_duration_seconds", "Latency of calls to the Web3 node and IPFS",
+    ("service", "operation")
+))
+EXTERNAL_ERRORS = REGISTRY.register(Counter(
+    "external_call_errors_total", "Calls to the Web3 node and IPFS that raised",
+    ("service", "operation")
+))
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    external_seconds: Dict[str, float] = field(default_factory=dict)
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def current_stats() -> Optional[RequestStats]:
+    """Stats of the request being served, if any"""
+    return _current.get()
+
+@contextmanager
+def external_call(service: str, operation: str):
+    """Time a call to an external service; the time is also charged to the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        EXTERNAL_ERRORS.inc(service, operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_SECONDS.observe(elapsed, service, operation)
+        stats = _current.get()
+        if stats is not None:
+            stats.external_seconds[service] = stats.external_seconds.get(service, 0.0) + elapsed
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish(conn)
+
+def _handle_error(context):
+    if context.connection is not None:
+        _finish(context.connection)
+
+def _finish(conn):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    DB_QUERIES.inc()
+    DB_SECONDS.inc(amount=elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+def instrument_engine(engine):
+    """Count and time the statements run on engine (sync or async)"""
+    engine = getattr(engine, "sync_engine", engine)
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, query counts, DB and external time"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # The router stores the matched route in the scope; unmatched paths share one series
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"] if scope["method"] in METHODS else "other"
+            REQUEST_SECONDS.observe(elapsed, method, path, str(status_code))
+            REQUEST_QUERIES.observe(stats.queries, path)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, path)
+            for service, seconds in stats.external_seconds.items():
+                REQUEST_EXTERNAL_SECONDS.observe(seconds, path, service)
@@ -0,0 +1,61 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Sequence
+
+from sqlalchemy import DateTime, Float, Integer, Numeric, String, literal, tuple_
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    """Decode a cursor produced by encode_cursor; raises ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    return [_cursor_value(column, v) for column, v in zip(columns, values)]
+
+def _cursor_value(column, value):
+    """A decoded cursor value checked against its column's type"""
+    column_type = column.type
+    if isinstance(column_type, DateTime) and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    elif isinstance(column_type, Integer) and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    elif isinstance(column_type, (Float, Numeric)) and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    elif isinstance(column_type, String) and isinstance(value, str):
+        return value
+    raise ValueError("Invalid cursor")
+
+def apply_keyset(query, columns: Sequence, descending: bool = False, cursor: str = None):
+    """
+    Order a select by columns (the last one must be unique, e.g. the primary
+    key) and, given a cursor, only return rows after that position. Unlike
+    OFFSET, the cost of a page does not grow with its depth. The columns
+    must be NOT NULL: a row value comparison with a NULL is never true, so
+    such rows would fall out of every page after the first.
+    """
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        after = tuple_(*[literal(v, type_=c.type) for c, v in zip(columns, values)])
+        query = query.where(key < after if descending else key > after)
+    return query
+
+def next_cursor(rows: Sequence, columns: Sequence, limit: int):
+    """Cursor for the page after rows, or None when rows was the last page"""
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    return encode_cursor([getattr(last, column.key) for column in columns])
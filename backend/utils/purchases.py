@@ -0,0 +1,135 @@
+"""
+Idempotent purchase records.
+
+A user owns a book at most once: purchases are unique on (user_id,
+book_id), and record_purchase() writes them with one INSERT ... ON
+CONFLICT DO NOTHING instead of looking for an existing row first, so
+concurrent duplicates (double clicks, client retries) cannot both insert
+and the loser simply gets the original purchase back. Only the request
+that inserted the row should go on to submit the transaction.
+
+Clients may send an Idempotency-Key header. It is stored with the
+purchase, unique per user: a retry carrying the same key is a replay of
+the original purchase, while a key already used for another book, or a
+new key (or wallet transaction hash) for a book already owned, is a
+conflict. A failed purchase does not count as owning the book: a new
+attempt takes over its row and is counted in the rollups at its own date
+and price (the failed attempt was taken out when it failed), and the
+failed attempt's unpaid royalty is voided.
+
+Pipeline purchases pass their TransactionJob, which is staged in the same
+transaction so the purchase is never recorded without it.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Book, Purchase, TransactionStatus
+from utils.rollups import record_purchases
+from utils.royalties import void_unpaid
+from utils.sales import get_sales_counter
+from utils.transactions import TransactionJob, stage_job
+
+class PurchaseConflict(Exception):
+    """The request conflicts with a purchase recorded before"""
+
+def _insert(dialect: str):
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise ValueError(f"Purchases are not supported on '{dialect}'")
+    return insert
+
+def _is_replay(purchase, transaction_hash: Optional[str], idempotency_key: Optional[str]) -> bool:
+    if idempotency_key is not None:
+        return purchase.idempotency_key == idempotency_key
+    if purchase.tx_status == TransactionStatus.FAILED:
+        # Without a key only the same wallet transaction repeats a failed attempt
+        return transaction_hash is not None and purchase.transaction_hash == transaction_hash
+    return transaction_hash is None or purchase.transaction_hash == transaction_hash
+
+async def record_purchase(
+    db: AsyncSession,
+    user_id: int,
+    book: Book,
+    tx_status: TransactionStatus,
+    transaction_hash: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    tx_job: Optional[TransactionJob] = None
+) -> Tuple[Purchase, bool]:
+    """
+    Record and commit a purchase of book unless the user already has one
+    that has not failed; returns (purchase, created). Raises
+    PurchaseConflict when the request is not a replay of the existing
+    purchase. tx_job, if given, gets the purchase id and is staged.
+    """
+    table = Purchase.__table__
+    purchase_date = datetime.utcnow()
+    values = dict(
+        price_paid=book.price,
+        transaction_hash=transaction_hash,
+        purchase_date=purchase_date,
+        tx_status=tx_status,
+        idempotency_key=idempotency_key
+    )
+    statement = _insert(db.bind.dialect.name)(table).values(
+        user_id=user_id,
+        book_id=book.id,
+        **values
+    ).on_conflict_do_nothing(index_elements=["user_id", "book_id"])
+
+    try:
+        result = await db.execute(statement)
+        created = result.rowcount == 1
+        taken_over = False
+        if created:
+            purchase_id = result.inserted_primary_key[0]
+        else:
+            previous = (await db.execute(
+                select(table.c.id, table.c.tx_status, table.c.transaction_hash, table.c.idempotency_key).where(table.c.user_id == user_id, table.c.book_id == book.id)
+            )).one()
+            purchase_id = previous.id
+            if previous.tx_status == TransactionStatus.FAILED and not _is_replay(
+                previous, transaction_hash, idempotency_key
+            ):
+                # Take over the failed attempt; only one concurrent request can
+                created = (await db.execute(
+                    update(table)
+                    .where(table.c.id == previous.id, table.c.tx_status == TransactionStatus.FAILED)
+                    .values(is_verified=False, block_number=None, **values)
+                )).rowcount == 1
+                taken_over = True
+        if created:
+            # Core statements skip the flush hook that maintains the rollups
+            def update_rollups(session):
+                connection = session.connection()
+                if taken_over:
+                    void_unpaid(connection, [purchase_id])
+                record_purchases(connection, [(book.id, purchase_date, book.price)])
+
+            await db.run_sync(update_rollups)
+            if tx_job is not None:
+                tx_job.entity_id = purchase_id
+                await stage_job(db, tx_job)
+        await db.commit()
+        if created:
+            get_sales_counter().record(book.id)
+    except IntegrityError:
+        # Another unique column clashed: the idempotency key or the transaction hash
+        await db.rollback()
+        if idempotency_key is not None and await db.scalar(select(Purchase.id).where(
+            Purchase.user_id == user_id, Purchase.idempotency_key == idempotency_key
+        )):
+            raise PurchaseConflict("Idempotency-Key was already used for another purchase")
+        raise PurchaseConflict("Transaction hash is already recorded for another purchase")
+
+    result = await db.execute(select(Purchase).where(Purchase.user_id == user_id, Purchase.book_id == book.id))
+    purchase = result.scalars().one()
+    if not created and not _is_replay(purchase, transaction_hash, idempotency_key):
+        raise PurchaseConflict("You have already purchased this book")
+    return purchase, created
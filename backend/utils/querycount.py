@@ -0,0 +1,65 @@
+"""
+Count the SQL statements an engine executes.
+
+Used by the benchmarks to report queries per request, and by route tests
+to catch N+1 regressions: assert_constant_queries runs a call, grows the
+data it reads, runs it again and fails if the second run issued more
+statements than the first.
+
+    with count_queries(async_engine) as counter:
+        await get_purchased_books(...)
+    counter.assert_at_most(2)
+"""
+import inspect
+from contextlib import contextmanager
+from typing import Callable, List
+
+from sqlalchemy import event
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def assert_at_most(self, limit: int, label: str = "block"):
+        if self.count > limit:
+            listing = "\n".join(f"  {statement}" for statement in self.statements)
+            raise AssertionError(f"{label} ran {self.count} queries, expected at most {limit}:\n{listing}")
+
+@contextmanager
+def count_queries(engine):
+    """Count statements run on engine (sync or async) inside the block"""
+    engine = getattr(engine, "sync_engine", engine)
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._record)
+
+async def _call(fn: Callable):
+    result = fn()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+async def assert_constant_queries(engine, run: Callable, grow: Callable, label: str = "route"):
+    """
+    Fail if run() issues more queries after grow() adds rows it reads,
+    i.e. if its query count scales with the data. Both may be sync or async.
+    """
+    with count_queries(engine) as before:
+        await _call(run)
+    await _call(grow)
+    with count_queries(engine) as after:
+        await _call(run)
+    if after.count > before.count:
+        raise AssertionError(
+            f"{label} went from {before.count} to {after.count} queries after growing its data (N+1?)"
+        )
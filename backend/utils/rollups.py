@@ -0,0 +1,196 @@
+"""
+Daily sales and royalty rollups.
+
+book_sales_daily and author_royalties_daily keep per-day totals, so stats
+and reports read a few rows per book instead of every purchase. An
+after_flush hook folds ORM inserts and deletes of Purchase and Royalty
+rows into them inside the same transaction. Writers that bypass the unit
+of work (bulk mappings in the event indexer, set-based royalty settlement
+in utils.royalties) record their rows themselves, and purchases that fail
+are taken back out (utils.sales.remove_sales). backfill() rebuilds the
+tables from history, leaving failed purchases out:
+
+    python -m utils.rollups [--since 2024-01-01]
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event, func, or_, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from models import AuthorRoyaltiesDaily, BookSalesDaily, Purchase, Royalty, TransactionStatus
+
+# Rows per INSERT ... ON CONFLICT statement
+UPSERT_BATCH_SIZE = 200
+
+def _day(value: Optional[datetime]) -> date:
+    return (value or datetime.utcnow()).date()
+
+def _insert(connection: Connection):
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise ValueError(f"Rollups are not supported on '{dialect}'")
+    return insert
+
+def _add_on_conflict(statement, table, keys: Sequence[str], measures: Sequence[str]):
+    return statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + statement.excluded[name] for name in measures}
+    )
+
+def _upsert(connection: Connection, model, keys: Sequence[str], deltas: Dict[Tuple, list], measures: Sequence[str]):
+    """Add deltas to existing rollup rows, creating the missing ones"""
+    insert = _insert(connection)
+    table = model.__table__
+    rows = [
+        dict(zip(keys, key), **dict(zip(measures, values)))
+        for key, values in deltas.items()
+    ]
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        statement = insert(table).values(rows[start:start + UPSERT_BATCH_SIZE])
+        connection.execute(_add_on_conflict(statement, table, keys, measures))
+
+def record_purchases(connection: Connection, purchases: Iterable[Tuple], sign: int = 1):
+    """Add (book_id, purchase_date, price_paid) rows to book_sales_daily; sign=-1 removes them"""
+    deltas = defaultdict(lambda: [0, 0.0])
+    for book_id, purchase_date, price_paid in purchases:
+        if book_id is None:
+            continue
+        entry = deltas[(book_id, _day(purchase_date))]
+        entry[0] += sign
+        entry[1] += sign * (price_paid or 0)
+    if deltas:
+        _upsert(connection, BookSalesDaily, ("book_id", "day"), deltas, ("sales_count", "revenue"))
+
+def record_royalties(connection: Connection, royalties: Iterable[Tuple], sign: int = 1):
+    """
+    Add (author_id, book_id, payment_date, amount) rows to
+    author_royalties_daily; sign=-1 removes them. Royalties without an
+    author or book cannot be attributed and are skipped.
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for author_id, book_id, payment_date, amount in royalties:
+        if author_id is None or book_id is None:
+            continue
+        entry = deltas[(author_id, book_id, _day(payment_date))]
+        entry[0] += sign
+        entry[1] += sign * (amount or 0)
+    if deltas:
+        _upsert(
+            connection,
+            AuthorRoyaltiesDaily,
+            ("author_id", "book_id", "day"),
+            deltas,
+            ("royalty_count", "amount")
+        )
+
+def record_royalties_from(connection: Connection, royalties: Select, sign: int = 1):
+    """
+    Set-based record_royalties: fold the rows of a select with author_id,
+    book_id, payment_date and amount columns into author_royalties_daily
+    with a single INSERT ... SELECT ... ON CONFLICT.
+    """
+    rows = royalties.subquery()
+    day = func.date(func.coalesce(rows.c.payment_date, func.current_timestamp()))
+    grouped = (
+        select(
+            rows.c.author_id,
+            rows.c.book_id,
+            day,
+            sign * func.count(),
+            sign * func.coalesce(func.sum(rows.c.amount), 0)
+        )
+        .where(rows.c.author_id.isnot(None), rows.c.book_id.isnot(None))
+        .group_by(rows.c.author_id, rows.c.book_id, day)
+    )
+    keys = ("author_id", "book_id", "day")
+    measures = ("royalty_count", "amount")
+    table = AuthorRoyaltiesDaily.__table__
+    statement = _insert(connection)(table).from_select(keys + measures, grouped)
+    connection.execute(_add_on_conflict(statement, table, keys, measures))
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed(session: Session, flush_context):
+    purchases = {1: [], -1: []}
+    royalties = {1: [], -1: []}
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Purchase):
+                purchases[sign].append((obj.book_id, obj.purchase_date, obj.price_paid))
+            elif isinstance(obj, Royalty):
+                royalties[sign].append((obj.author_id, obj.book_id, obj.payment_date, obj.amount))
+
+    if any(purchases.values()) or any(royalties.values()):
+        connection = session.connection()
+        for sign in (1, -1):
+            record_purchases(connection, purchases[sign], sign)
+            record_royalties(connection, royalties[sign], sign)
+
+def backfill(connection: Connection, since: Optional[date] = None) -> dict:
+    """Rebuild the rollups from purchases and royalties, from the since day onwards if given"""
+    purchase_day = func.date(Purchase.purchase_date)
+    royalty_day = func.date(Royalty.payment_date)
+    purchases = (
+        select(
+            Purchase.book_id,
+            purchase_day,
+            func.count(Purchase.id),
+            func.coalesce(func.sum(Purchase.price_paid), 0)
+        )
+        .where(
+            Purchase.book_id.isnot(None),
+            # Failed purchases are taken out of the rollups when they fail
+            or_(Purchase.tx_status.is_(None), Purchase.tx_status != TransactionStatus.FAILED)
+        )
+        .group_by(Purchase.book_id, purchase_day)
+    )
+    royalties = (
+        select(
+            Royalty.author_id,
+            Royalty.book_id,
+            royalty_day,
+            func.count(Royalty.id),
+            func.coalesce(func.sum(Royalty.amount), 0)
+        )
+        .where(Royalty.author_id.isnot(None), Royalty.book_id.isnot(None))
+        .group_by(Royalty.author_id, Royalty.book_id, royalty_day)
+    )
+
+    clear_sales = BookSalesDaily.__table__.delete()
+    clear_royalties = AuthorRoyaltiesDaily.__table__.delete()
+    if since is not None:
+        start = datetime.combine(since, time.min)
+        purchases = purchases.where(Purchase.purchase_date >= start)
+        royalties = royalties.where(Royalty.payment_date >= start)
+        clear_sales = clear_sales.where(BookSalesDaily.day >= since)
+        clear_royalties = clear_royalties.where(AuthorRoyaltiesDaily.day >= since)
+
+    connection.execute(clear_sales)
+    connection.execute(clear_royalties)
+    sales_rows = connection.execute(BookSalesDaily.__table__.insert().from_select(
+        ["book_id", "day", "sales_count", "revenue"], purchases
+    )).rowcount
+    royalty_rows = connection.execute(AuthorRoyaltiesDaily.__table__.insert().from_select(
+        ["author_id", "book_id", "day", "royalty_count", "amount"], royalties
+    )).rowcount
+    return {"book_sales_daily": sales_rows, "author_royalties_daily": royalty_rows}
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily sales and royalty rollups")
+    parser.add_argument("--since", type=date.fromisoformat, help="only rebuild days from this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+    with engine.begin() as connection:
+        print(backfill(connection, args.since))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Set-based royalty settlement.
+
+Replaces the SQLite-only trigger that inserted one royalty per purchase.
+settle() creates the royalties owed for every purchase that has none yet
+(amount = price_paid * royalty_percentage / 100) with one INSERT ... SELECT
+per ROYALTY_SETTLE_BATCH_SIZE purchase ids, folding them into
+author_royalties_daily with one grouped upsert per batch. Only purchases
+with a transaction hash are settled, so the royalty carries the hash that
+the indexer matches RoyaltyPaid events on.
+
+Payment is confirmed in bulk: mark_paid() applies RoyaltyPaid events
+(amount and block, keyed by transaction hash), correcting the rollups where
+the paid amount differs from the estimate, and reconcile() marks the
+royalties of verified purchases as paid (purchaseBook pays the author in
+the same transaction) and voids unpaid royalties of failed purchases and
+of purchases that no longer exist.
+Every statement works on SQLite and PostgreSQL.
+
+    python -m utils.royalties
+"""
+from typing import Sequence, Tuple
+
+from sqlalchemy import and_, bindparam, exists, func, or_, select, update
+from sqlalchemy.engine import Connection
+
+from config import Config
+from models import Book, Purchase, Royalty, TransactionStatus
+from utils.rollups import record_royalties_from
+
+# Transaction hashes per mark_paid statement
+MARK_PAID_BATCH_SIZE = 500
+
+def _unsettled():
+    """Purchases owing a royalty that has not been recorded"""
+    return and_(
+        Book.author_id.isnot(None),
+        Book.royalty_percentage > 0,
+        Purchase.transaction_hash.isnot(None),
+        or_(Purchase.tx_status.is_(None), Purchase.tx_status != TransactionStatus.FAILED),
+        ~exists().where(Royalty.purchase_id == Purchase.id),
+        ~exists().where(Royalty.transaction_hash == Purchase.transaction_hash)
+    )
+
+def settle(connection: Connection, batch_size: int = Config.ROYALTY_SETTLE_BATCH_SIZE) -> int:
+    """Create the missing royalties for purchases, batch_size purchase ids per statement; returns how many"""
+    owed = select(Purchase.id).join(Book, Book.id == Purchase.book_id).where(_unsettled())
+    first = connection.scalar(select(func.min(owed.subquery().c.id)))
+    if first is None:
+        return 0
+    last = connection.scalar(select(func.max(Purchase.id)))
+
+    settled = 0
+    for start in range(first, last + 1, batch_size):
+        royalties = (
+            select(
+                Book.author_id,
+                Purchase.book_id,
+                Purchase.id.label("purchase_id"),
+                (Purchase.price_paid * Book.royalty_percentage / 100.0).label("amount"),
+                Purchase.transaction_hash,
+                Purchase.purchase_date.label("payment_date")
+            )
+            .join(Book, Book.id == Purchase.book_id)
+            .where(Purchase.id.between(start, start + batch_size - 1), _unsettled())
+        )
+        # Rollups first: once the royalties exist the select no longer matches them
+        record_royalties_from(connection, royalties)
+        settled += connection.execute(Royalty.__table__.insert().from_select(
+            ["author_id", "book_id", "purchase_id", "amount", "transaction_hash", "payment_date"],
+            royalties
+        )).rowcount
+    return settled
+
+def mark_paid(connection: Connection, payments: Sequence[Tuple[str, float, int]]) -> int:
+    """Apply RoyaltyPaid events given as (transaction_hash, amount, block_number); returns rows updated"""
+    table = Royalty.__table__
+    updated = 0
+    for start in range(0, len(payments), MARK_PAID_BATCH_SIZE):
+        batch = payments[start:start + MARK_PAID_BATCH_SIZE]
+        affected = (
+            select(table.c.author_id, table.c.book_id, table.c.payment_date, table.c.amount)
+            .where(table.c.transaction_hash.in_([tx_hash for tx_hash, _, _ in batch]))
+        )
+        # Swap the estimated amounts in the rollups for the paid ones
+        record_royalties_from(connection, affected, sign=-1)
+        updated += connection.execute(
+            update(table)
+            .where(table.c.transaction_hash == bindparam("b_hash"))
+            .values(amount=bindparam("b_amount"), block_number=bindparam("b_block"), is_paid=True),
+            [
+                {"b_hash": tx_hash, "b_amount": amount, "b_block": block_number}
+                for tx_hash, amount, block_number in batch
+            ]
+        ).rowcount
+        record_royalties_from(connection, affected)
+    return updated
+
+def _unpaid():
+    table = Royalty.__table__
+    return or_(table.c.is_paid.is_(False), table.c.is_paid.is_(None))
+
+def _void(connection: Connection, condition) -> int:
+    """Delete the royalties matching condition, taking them out of the rollups"""
+    table = Royalty.__table__
+    record_royalties_from(
+        connection,
+        select(table.c.author_id, table.c.book_id, table.c.payment_date, table.c.amount).where(condition),
+        sign=-1
+    )
+    return connection.execute(table.delete().where(condition)).rowcount
+
+def void_unpaid(connection: Connection, purchase_ids: Sequence[int]) -> int:
+    """Void the unpaid royalties of purchases whose payment is being retried"""
+    return _void(connection, and_(_unpaid(), Royalty.__table__.c.purchase_id.in_(purchase_ids)))
+
+def reconcile(connection: Connection) -> dict:
+    """Mark royalties of verified purchases paid and void the unpaid ones of failed or missing purchases"""
+    table = Royalty.__table__
+    purchase = Purchase.__table__
+    unpaid = _unpaid()
+
+    paid = connection.execute(
+        update(table)
+        .where(unpaid, exists().where(purchase.c.id == table.c.purchase_id, purchase.c.is_verified.is_(True)))
+        .values(
+            is_paid=True,
+            block_number=select(purchase.c.block_number)
+            .where(purchase.c.id == table.c.purchase_id)
+            .scalar_subquery()
+        )
+    ).rowcount
+
+    failed = and_(unpaid, or_(
+        exists().where(purchase.c.id == table.c.purchase_id, purchase.c.tx_status == TransactionStatus.FAILED),
+        # Failed purchases used to be deleted, leaving their royalties behind
+        ~exists().where(purchase.c.id == table.c.purchase_id)
+    ))
+    return {"paid": paid, "voided": _void(connection, failed)}
+
+def main():
+    from database import engine
+
+    with engine.begin() as connection:
+        settled = settle(connection)
+        print({"settled": settled, **reconcile(connection)})
+
+if __name__ == "__main__":
+    main()
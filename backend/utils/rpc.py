@@ -0,0 +1,206 @@
+"""
+Pooled JSON-RPC provider with endpoint selection and circuit breaking.
+
+RPCProvider keeps one requests.Session whose keep-alive connection pool
+(WEB3_POOL_SIZE per endpoint) is shared by every thread talking to the
+node. It may be given several endpoints (WEB3_PROVIDER_URIS): each request
+goes to the available endpoint with the lowest moving-average latency and
+moves on to the next one if that fails. Every endpoint has a circuit
+breaker that opens after WEB3_BREAKER_FAILURES consecutive errors or
+responses slower than WEB3_SLOW_THRESHOLD, skips the endpoint for
+WEB3_BREAKER_RESET seconds, then lets a single trial request through. When
+no endpoint is available, calls fail at once with CircuitOpen instead of
+waiting out the timeout against a dead node.
+
+Transactions are only resent if no connection to the node could be made,
+so a timed-out eth_sendTransaction is never submitted twice.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from typing import Any, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from web3.providers.base import JSONBaseProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from config import Config
+from utils.metrics import external_call
+
+logger = logging.getLogger(__name__)
+
+# Methods that change chain state; resending them after a read timeout could duplicate them
+WRITE_METHODS = frozenset({"eth_sendTransaction", "eth_sendRawTransaction"})
+
+# Weight of the newest sample in an endpoint's latency average
+LATENCY_SMOOTHING = 0.2
+
+def _never_sent(error: requests.RequestException) -> bool:
+    """Whether a request failed before a connection to the node was established"""
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectTimeout) or isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+class CircuitOpen(Exception):
+    """Raised when every RPC endpoint's circuit breaker is open"""
+
+class Endpoint:
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.opened_until: Optional[float] = None
+        self.trial_in_flight = False
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        if self.opened_until is None:
+            return True
+        # Half-open: one request at a time probes whether the node recovered
+        return self.opened_until <= now and not self.trial_in_flight
+
+    def stats(self) -> dict:
+        return {
+            "uri": self.uri,
+            "state": "closed" if self.opened_until is None else "open",
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+class RPCProvider(JSONBaseProvider):
+    def __init__(
+        self,
+        endpoint_uris: Sequence[str] = Config.WEB3_PROVIDER_URIS,
+        pool_size: int = Config.WEB3_POOL_SIZE,
+        timeout: float = Config.WEB3_TIMEOUT,
+        retries: int = Config.WEB3_RETRIES,
+        slow_threshold: float = Config.WEB3_SLOW_THRESHOLD,
+        failure_threshold: int = Config.WEB3_BREAKER_FAILURES,
+        reset_timeout: float = Config.WEB3_BREAKER_RESET
+    ):
+        super().__init__()
+        if not endpoint_uris:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = [Endpoint(uri) for uri in endpoint_uris]
+        self.timeout = timeout
+        self.retries = retries
+        self.slow_threshold = slow_threshold
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.endpoints[0].uri
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        body = self.encode_rpc_request(method, params)
+        with external_call("web3", method):
+            return self.decode_rpc_response(self._post(body, write=method in WRITE_METHODS))
+
+    def make_batch_request(self, calls: Sequence[tuple]) -> List[RPCResponse]:
+        """Send (method, params) pairs as one JSON-RPC batch; responses come back in call order"""
+        ids = [next(self._ids) for _ in calls]
+        payload = [
+            {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+            for request_id, (method, params) in zip(ids, calls)
+        ]
+        body = json.dumps(payload).encode()
+        with external_call("web3", "batch"):
+            responses = {item["id"]: item for item in json.loads(self._post(
+                body, write=any(method in WRITE_METHODS for method, _ in calls)
+            ))}
+        return [responses.get(request_id) for request_id in ids]
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        try:
+            response = self.make_request(RPCEndpoint("web3_clientVersion"), [])
+        except (CircuitOpen, requests.RequestException):
+            if show_traceback:
+                raise
+            return False
+        return "error" not in response
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, body: bytes, write: bool) -> bytes:
+        last_error: Optional[Exception] = None
+        for _ in range(self.retries + 1):
+            endpoint = self._select()
+            if endpoint is None:
+                break
+            started = time.monotonic()
+            try:
+                response = self.session.post(
+                    endpoint.uri,
+                    data=body,
+                    headers={"Content-Type": "application/json"},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self._record(endpoint, time.monotonic() - started, failed=True)
+                logger.warning("RPC request to %s failed: %s", endpoint.uri, e)
+                last_error = e
+                if write and not _never_sent(e):
+                    raise
+                continue
+            self._record(endpoint, time.monotonic() - started, failed=False)
+            return response.content
+        if last_error is not None:
+            raise last_error
+        raise CircuitOpen("All RPC endpoints are unavailable")
+
+    def _select(self) -> Optional[Endpoint]:
+        """Lowest-latency available endpoint; unmeasured endpoints are tried first"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda e: e.latency if e.latency is not None else -1.0)
+            if endpoint.opened_until is not None:
+                endpoint.trial_in_flight = True
+            endpoint.requests += 1
+            return endpoint
+
+    def _record(self, endpoint: Endpoint, elapsed: float, failed: bool):
+        with self._lock:
+            endpoint.trial_in_flight = False
+            # A refused connection is quick; rank a failed endpoint as if it timed out
+            sample = max(elapsed, self.timeout) if failed else elapsed
+            if endpoint.latency is None:
+                endpoint.latency = sample
+            else:
+                endpoint.latency += LATENCY_SMOOTHING * (sample - endpoint.latency)
+
+            if failed:
+                endpoint.errors += 1
+            if failed or elapsed > self.slow_threshold:
+                endpoint.failures += 1
+                if endpoint.opened_until is not None or endpoint.failures >= self.failure_threshold:
+                    if endpoint.opened_until is None:
+                        logger.warning("Opening circuit breaker for %s", endpoint.uri)
+                    endpoint.opened_until = time.monotonic() + self.reset_timeout
+            else:
+                if endpoint.opened_until is not None:
+                    logger.info("Closing circuit breaker for %s", endpoint.uri)
+                endpoint.failures = 0
+                endpoint.opened_until = None
@@ -0,0 +1,137 @@
+"""
+Book.total_sales without a hot row.
+
+Adding to books.total_sales inside every purchase transaction would make
+all buyers of a popular title queue on that one row lock. Instead the API
+counts new purchases in memory (SalesCounter) and adds them every
+SALES_FLUSH_INTERVAL seconds with one executemany UPDATE, one row per book
+sold since the last flush, so a title bought a thousand times a second
+costs a handful of UPDATEs a second. Updates are relative (total_sales =
+total_sales + n): API workers and the event indexer add to the same books
+without coordinating; a purchase that fails takes its sale back, from
+total_sales and from the daily rollups (remove_sales). The
+UPDATE leaves books.updated_at alone, so sales do not touch the ETags and
+caches keyed on it. Counts not yet flushed when a process dies are lost;
+rebuild() recounts every book from its confirmed purchases (live counts
+also include purchases still waiting for their receipt):
+
+    python -m utils.sales
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.engine import Connection
+
+from config import Config
+from database import AsyncSessionLocal
+from models import Book, Purchase, TransactionStatus
+from utils.rollups import record_purchases
+
+logger = logging.getLogger(__name__)
+
+def _add_statement():
+    table = Book.__table__
+    return (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(
+            total_sales=func.coalesce(table.c.total_sales, 0) + bindparam("b_count"),
+            updated_at=table.c.updated_at  # keeps the column's onupdate from firing
+        )
+    )
+
+def _add_params(counts: Dict[int, int]) -> list:
+    return [{"b_id": book_id, "b_count": count} for book_id, count in counts.items()]
+
+def add_sales(connection: Connection, counts: Dict[int, int]):
+    """Add purchase counts per book id to total_sales, negative for failed ones (caller commits)"""
+    if counts:
+        connection.execute(_add_statement(), _add_params(counts))
+
+def remove_sales(connection: Connection, purchases: Iterable[Tuple]):
+    """Take (book_id, purchase_date, price_paid) purchases that failed off total_sales and the rollups"""
+    purchases = list(purchases)
+    unsold = Counter()
+    for book_id, _, _ in purchases:
+        if book_id is not None:
+            unsold[book_id] -= 1
+    add_sales(connection, unsold)
+    record_purchases(connection, purchases, -1)
+
+class SalesCounter:
+    def __init__(
+        self,
+        flush_interval: float = Config.SALES_FLUSH_INTERVAL,
+        session_factory=AsyncSessionLocal
+    ):
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self._counts: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically(), name="sales-counter-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def record(self, book_id: int, count: int = 1):
+        self._counts[book_id] += count
+
+    async def flush(self):
+        """Write the sales counted since the last flush in one executemany UPDATE"""
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, Counter()
+        try:
+            async with self.session_factory() as db:
+                await db.execute(_add_statement(), _add_params(counts))
+                await db.commit()
+        except Exception:
+            # Keep the counts for the next flush rather than dropping them
+            self._counts.update(counts)
+            raise
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush book sales counts")
+
+_sales_counter: Optional[SalesCounter] = None
+
+def get_sales_counter() -> SalesCounter:
+    """Get the process-wide sales counter"""
+    global _sales_counter
+    if _sales_counter is None:
+        _sales_counter = SalesCounter()
+    return _sales_counter
+
+def rebuild(connection: Connection) -> int:
+    """Recount total_sales for every book from its confirmed purchases; returns the books updated"""
+    table = Book.__table__
+    sold = (
+        select(func.count(Purchase.id))
+        .where(Purchase.book_id == table.c.id, Purchase.tx_status == TransactionStatus.CONFIRMED)
+        .scalar_subquery()
+    )
+    return connection.execute(update(table).values(total_sales=sold, updated_at=table.c.updated_at)).rowcount
+
+def main():
+    from database import engine
+
+    with engine.begin() as connection:
+        print(f"{rebuild(connection)} books recounted")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Full-text search over book titles and descriptions.
+
+SQLite keeps an FTS5 table (books_fts, rowid = books.id) that is refreshed
+with index_books() whenever books are written. PostgreSQL uses a GIN index
+on a weighted tsvector expression, which the database maintains itself.
+Matches are ranked with title hits above description hits. The last word
+of the query is matched as a prefix once it has SEARCH_MIN_PREFIX
+characters; the others are matched whole.
+
+Ranking is bounded: only the newest SEARCH_CANDIDATES matches are ranked,
+so a word found in most of the catalog costs no more than a rare one. On
+SQLite, bm25 would read every match of every word to weigh them, so the
+candidates are ranked by how many query words their title contains. When
+the exact words already fill the candidates, the last word is not expanded
+as a prefix either, since merging the entries of every word sharing the
+prefix is the other cost that grows with the catalog.
+"""
+import re
+from typing import Iterable, Optional
+
+from sqlalchemy import Integer, String, case, column, func, literal_column, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from config import Config
+from models import Book
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts "
+    "USING fts5(title, description, tokenize='porter unicode61')"
+)
+
+# Must match the WHERE expression below exactly for the GIN index to be used
+PG_DOCUMENT = (
+    "(setweight(to_tsvector('english'::regconfig, coalesce(books.title, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(books.description, '')), 'B'))"
+)
+PG_DDL = f"CREATE INDEX IF NOT EXISTS idx_books_search ON books USING GIN ({PG_DOCUMENT})"
+
+books_fts = table(
+    "books_fts",
+    column("rowid", Integer),
+    column("title", String),
+    column("description", String)
+)
+
+def _terms(q: str) -> list:
+    return re.findall(r"\w+", q.lower())
+
+def _index_rows(book_filter=None):
+    rows = select(Book.id, func.coalesce(Book.title, ""), func.coalesce(Book.description, ""))
+    if book_filter is not None:
+        rows = rows.where(book_filter)
+    return books_fts.insert().from_select(["rowid", "title", "description"], rows)
+
+def create_search_index(connection, rebuild: bool = False):
+    """Create the search index for the connection's database, filling it from books when new"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+        ).first()
+        connection.execute(text(SQLITE_DDL))
+        if rebuild or not exists:
+            connection.execute(books_fts.delete())
+            connection.execute(_index_rows())
+    elif dialect == "postgresql":
+        connection.execute(text(PG_DDL))
+
+def index_books(session, book_ids: Iterable[int]):
+    """Refresh the search entries of flushed books; ids of deleted books are dropped"""
+    book_ids = list(book_ids)
+    if not book_ids or session.get_bind().dialect.name != "sqlite":
+        return
+    session.execute(books_fts.delete().where(books_fts.c.rowid.in_(book_ids)))
+    session.execute(_index_rows(Book.id.in_(book_ids)))
+
+def _prefix(terms: list, prefix: bool) -> bool:
+    return prefix and len(terms[-1]) >= Config.SEARCH_MIN_PREFIX
+
+def _tsquery(terms: list, prefix: bool):
+    return func.to_tsquery(
+        literal_column("'english'::regconfig"),
+        " & ".join(terms) + (":*" if _prefix(terms, prefix) else "")
+    )
+
+def _candidates(dialect: str, terms: list, prefix: bool) -> Select:
+    """Ids of the newest active books matching every term"""
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"' for term in terms) + ("*" if _prefix(terms, prefix) else "")
+        candidates = (
+            select(books_fts.c.rowid.label("id"))
+            .join(Book, Book.id == books_fts.c.rowid)
+            .where(literal_column("books_fts").op("MATCH")(match))
+            .order_by(books_fts.c.rowid.desc())
+        )
+    elif dialect == "postgresql":
+        candidates = (
+            select(Book.id)
+            .where(literal_column(PG_DOCUMENT).op("@@")(_tsquery(terms, prefix)))
+            .order_by(Book.id.desc())
+        )
+    else:
+        raise ValueError(f"Full-text search is not supported on '{dialect}'")
+    return candidates.where(Book.is_active == True).limit(Config.SEARCH_CANDIDATES)
+
+def search_statement(dialect: str, q: str, prefix: bool = True) -> Optional[Select]:
+    """Build a ranked search over active books, or None if q has no searchable words"""
+    terms = _terms(q)
+    if not terms:
+        return None
+
+    candidates = _candidates(dialect, terms, prefix).subquery()
+    if dialect == "sqlite":
+        title = func.lower(func.coalesce(Book.title, ""))
+        rank = sum(case((func.instr(title, term) > 0, 1), else_=0) for term in terms).desc()
+    else:
+        rank = func.ts_rank(literal_column(PG_DOCUMENT), _tsquery(terms, prefix)).desc()
+    return (
+        select(Book)
+        .join(candidates, candidates.c.id == Book.id)
+        .order_by(rank, Book.id.desc())
+    )
+
+async def search(db: AsyncSession, q: str, limit: int, offset: int = 0) -> list:
+    """A page of search results, best matches first"""
+    dialect = db.bind.dialect.name
+    terms = _terms(q)
+    if not terms:
+        return []
+    prefix = True
+    if dialect == "sqlite":
+        # Broad words: the exact matches fill the candidates, so skip the prefix expansion
+        exact = await db.scalar(
+            select(func.count()).select_from(_candidates(dialect, terms, False).subquery())
+        )
+        prefix = exact < Config.SEARCH_CANDIDATES
+    result = await db.execute(search_statement(dialect, q, prefix).limit(limit).offset(offset))
+    return result.scalars().all()
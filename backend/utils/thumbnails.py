@@ -0,0 +1,155 @@
+"""
+Responsive variants of book covers.
+
+The first request for any variant of a cover decodes the original once in
+a process pool and renders every configured width (THUMBNAIL_WIDTHS) as
+WebP and JPEG. Each variant is uploaded to IPFS through upload_to_ipfs (so
+it gets an ipfs_cache row like any other file), seeded into the local blob
+cache and recorded in image_variants, keyed by the original's IPFS hash.
+Since originals are content-addressed, a variant never changes and can be
+served with immutable caching headers. A cover that does not decode as an
+image is answered with a 415.
+"""
+import asyncio
+import io
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from database import AsyncSessionLocal
+from models import ImageVariant
+from utils.blobstore import get_blob_cache
+from utils.executor import BoundedExecutor, ExecutorSaturated
+from utils.ipfs import upload_to_ipfs
+
+FORMATS = ("webp", "jpeg")
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+thumbnail_pool = BoundedExecutor(
+    workers=Config.THUMBNAIL_WORKERS,
+    max_pending=Config.THUMBNAIL_MAX_PENDING,
+    name="thumbnail",
+    processes=True
+)
+
+# source hash -> [lock, requests holding or waiting for it]
+_render_locks: Dict[str, list] = {}
+
+class InvalidImage(ValueError):
+    """The source could not be decoded as an image"""
+
+def render_variants(data: bytes, widths: Sequence[int]) -> List[Tuple[int, str, bytes]]:
+    """Resize an image to each width (never upscaling) in every format; runs in a worker process"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # Only the message crosses back from the worker process
+        raise InvalidImage(str(e)) from None
+    if image.mode not in ("RGB", "RGBA"):
+        transparent = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if transparent else "RGB")
+
+    variants = []
+    for width in widths:
+        resized = image.copy()
+        if resized.width > width:
+            height = max(1, round(resized.height * width / resized.width))
+            resized = resized.resize((width, height), Image.LANCZOS)
+        for image_format in FORMATS:
+            out = io.BytesIO()
+            if image_format == "webp":
+                resized.save(out, "WEBP", quality=80, method=4)
+            else:
+                resized.convert("RGB").save(out, "JPEG", quality=82, optimize=True, progressive=True)
+            variants.append((width, image_format, out.getvalue()))
+    return variants
+
+def pick_width(requested: int, widths: Sequence[int] = Config.THUMBNAIL_WIDTHS) -> int:
+    """Smallest configured width covering the request, or the largest one"""
+    widths = sorted(widths)
+    return next((width for width in widths if width >= requested), widths[-1])
+
+async def _find_variant(source_hash: str, width: int, image_format: str) -> Optional[str]:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(ImageVariant.file_hash).where(
+            ImageVariant.source_hash == source_hash,
+            ImageVariant.width == width,
+            ImageVariant.format == image_format
+        ))
+
+async def _store_variant(source_hash: str, width: int, image_format: str, data: bytes) -> str:
+    blob_cache = get_blob_cache()
+    file_hash = await upload_to_ipfs(data, "cover_variant", mime_type=MEDIA_TYPES[image_format])
+    await blob_cache.put(file_hash, data)
+    async with AsyncSessionLocal() as db:
+        db.add(ImageVariant(
+            source_hash=source_hash,
+            width=width,
+            format=image_format,
+            file_hash=file_hash,
+            file_size=len(data)
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Rendered concurrently by another worker process
+            await db.rollback()
+    return file_hash
+
+async def _render(source_hash: str):
+    source_path = await get_blob_cache().open(source_hash)
+    data = await asyncio.to_thread(_read, source_path)
+    try:
+        variants = await thumbnail_pool.run(render_variants, data, Config.THUMBNAIL_WIDTHS)
+    except ExecutorSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many thumbnails being rendered, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    except InvalidImage:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Cover is not a supported image"
+        )
+    await asyncio.gather(*[
+        _store_variant(source_hash, width, image_format, variant)
+        for width, image_format, variant in variants
+    ])
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+@asynccontextmanager
+async def _render_lock(source_hash: str):
+    """Per-cover lock, dropped once no request holds or waits for it"""
+    entry = _render_locks.setdefault(source_hash, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _render_locks[source_hash]
+
+async def get_variant(source_hash: str, width: int, image_format: str) -> str:
+    """Local path of a cover variant, rendering all of the cover's variants on first use"""
+    width = pick_width(width)
+    file_hash = await _find_variant(source_hash, width, image_format)
+    if file_hash is None:
+        async with _render_lock(source_hash):
+            file_hash = await _find_variant(source_hash, width, image_format)
+            if file_hash is None:
+                await _render(source_hash)
+                file_hash = await _find_variant(source_hash, width, image_format)
+    return await get_blob_cache().open(file_hash)
@@ -0,0 +1,542 @@
+"""
+Background submission of BookStore contract transactions.
+
+Routes store a TransactionJob with stage_job() in the same transaction as
+the row it concerns, and once that has committed hand it to the pipeline
+with enqueue(), which never fails: a job that finds the queue full waits
+in the pending_transactions table instead. A pool of workers submits the
+calls (one in-flight transaction per sender address, with locally tracked
+nonces), and a receipt poller fetches receipts for every submitted
+transaction in a single batch and hands them to the job's handler to
+update the database; the stored job is deleted in the same transaction.
+A job is only failed when the node rejects its transaction (a revert or an
+invalid transaction). Unreachable nodes, open circuit breakers and nonce
+mix-ups are retried with backoff up to TX_SUBMIT_RETRIES times, after which
+the job is left stored for the recovery sweep.
+
+Stored jobs are claimed by the process that staged them. At startup and
+every TX_RECOVERY_INTERVAL seconds the pipeline renews its claims and
+sweeps the table: jobs it does not hold in memory (left over from a
+restart or turned away by a full queue), and jobs whose claim has not been
+renewed for TX_CLAIM_TIMEOUT seconds, are queued again, or polled again if
+they were already sent.
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import requests
+from fastapi import HTTPException, status
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from web3 import Web3
+
+from config import Config
+from database import AsyncSessionLocal
+from models import Book, PendingTransaction, Purchase, TransactionStatus
+from utils.cache import get_book_cache
+from utils.rpc import CircuitOpen
+from utils.sales import remove_sales
+from utils.search import index_books
+from utils.web3_utils import get_contract, get_receipts_batch, get_web3
+
+logger = logging.getLogger(__name__)
+
+# Owner of the jobs this process stages
+PROCESS_ID = uuid.uuid4().hex
+
+# handler(pipeline, db, job, receipt) - receipt is None when submission failed
+ReceiptHandler = Callable[
+    ["TransactionPipeline", AsyncSession, "TransactionJob", Optional[Any]],
+    Awaitable[None]
+]
+
+@dataclass
+class TransactionJob:
+    kind: str  # key into RECEIPT_HANDLERS
+    entity_id: int
+    from_address: str
+    function: str
+    args: List[Any]
+    value: int = 0
+    meta: Dict[str, Any] = field(default_factory=dict)
+    tx_hash: Optional[str] = None
+    error: Optional[str] = None
+    id: Optional[int] = None  # PendingTransaction row, once staged
+
+async def stage_jobs(db: AsyncSession, jobs: List[TransactionJob], owner: str = PROCESS_ID):
+    """Store jobs in the caller's transaction, before it commits, so they outlive this process"""
+    now = datetime.utcnow()
+    rows = [
+        PendingTransaction(
+            kind=job.kind,
+            entity_id=job.entity_id,
+            from_address=job.from_address,
+            function=job.function,
+            args=job.args,
+            value=str(job.value),
+            meta=job.meta,
+            status=TransactionStatus.PENDING,
+            claimed_by=owner,
+            claimed_at=now
+        )
+        for job in jobs
+    ]
+    db.add_all(rows)
+    await db.flush()
+    for job, row in zip(jobs, rows):
+        job.id = row.id
+
+async def stage_job(db: AsyncSession, job: TransactionJob, owner: str = PROCESS_ID):
+    await stage_jobs(db, [job], owner)
+
+# Submission errors that say nothing about the transaction itself
+TRANSIENT_ERRORS = (CircuitOpen, requests.RequestException, OSError, asyncio.TimeoutError)
+
+def _transient(error: Exception) -> bool:
+    # A nonce the node disagrees with is re-read from the node on the next attempt
+    return isinstance(error, TRANSIENT_ERRORS) or "nonce" in str(error).lower()
+
+def _job_from_row(row: PendingTransaction) -> TransactionJob:
+    return TransactionJob(
+        kind=row.kind,
+        entity_id=row.entity_id,
+        from_address=row.from_address,
+        function=row.function,
+        args=list(row.args or []),
+        value=int(row.value or 0),
+        meta=dict(row.meta or {}),
+        tx_hash=row.tx_hash,
+        id=row.id
+    )
+
+class NonceManager:
+    """Hands out sequential nonces per sender without asking the node each time"""
+
+    def __init__(self, web3: Web3):
+        self.web3 = web3
+        self._nonces: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def lock(self, address: str) -> asyncio.Lock:
+        return self._locks.setdefault(address, asyncio.Lock())
+
+    async def next_nonce(self, address: str) -> int:
+        """Reserve the next nonce; callers must hold lock(address)"""
+        if address not in self._nonces:
+            self._nonces[address] = await asyncio.to_thread(
+                self.web3.eth.get_transaction_count, address, "pending"
+            )
+        nonce = self._nonces[address]
+        self._nonces[address] = nonce + 1
+        return nonce
+
+    def reset(self, address: str):
+        """Forget the cached nonce so the next one is re-read from the node"""
+        self._nonces.pop(address, None)
+
+class TransactionPipeline:
+    def __init__(
+        self,
+        web3: Optional[Web3] = None,
+        contract=None,
+        session_factory=AsyncSessionLocal,
+        workers: int = Config.TX_WORKERS,
+        queue_size: int = Config.TX_QUEUE_SIZE,
+        poll_interval: float = Config.TX_RECEIPT_POLL_INTERVAL,
+        batch_size: int = Config.TX_RECEIPT_BATCH_SIZE,
+        recovery_interval: float = Config.TX_RECOVERY_INTERVAL,
+        claim_timeout: float = Config.TX_CLAIM_TIMEOUT,
+        db_retries: int = Config.TX_DB_RETRIES,
+        submit_retries: int = Config.TX_SUBMIT_RETRIES,
+        owner: str = PROCESS_ID
+    ):
+        self.web3 = web3 or get_web3()
+        self._contract = contract
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.recovery_interval = recovery_interval
+        self.claim_timeout = claim_timeout
+        self.db_retries = db_retries
+        self.submit_retries = submit_retries
+        self.owner = owner
+        self.nonces = NonceManager(self.web3)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.pending: Dict[str, TransactionJob] = {}
+        self._known: Set[int] = set()  # stored jobs queued, in flight or pending here
+        self._settling: Set[str] = set()  # hashes whose receipts are being handled
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def contract(self):
+        if self._contract is None:
+            self._contract = get_contract(self.web3)
+        return self._contract
+
+    async def start(self):
+        if self._tasks:
+            return
+        try:
+            await self.recover()
+        except Exception:
+            logger.exception("Recovering stored transactions failed")
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"tx-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._poll_receipts(), name="tx-receipt-poller"))
+        self._tasks.append(asyncio.create_task(self._recover_periodically(), name="tx-recovery"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, job: TransactionJob) -> bool:
+        """
+        Queue a staged contract call without waiting. When the queue is full
+        the job stays stored for the recovery sweep; returns whether it was queued.
+        """
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning("Transaction queue full, %s for %s %s left for recovery", job.function, job.kind, job.entity_id)
+            return False
+        self._track(job)
+        return True
+
+    async def put(self, job: TransactionJob):
+        """Queue a contract call, waiting for room when saturated (bulk producers)"""
+        await self.queue.put(job)
+        self._track(job)
+
+    def _track(self, job: TransactionJob):
+        if job.id is not None:
+            self._known.add(job.id)
+
+    def _forget(self, job: TransactionJob):
+        if job.id is not None:
+            self._known.discard(job.id)
+
+    async def submit(self, job: TransactionJob) -> str:
+        """Send a single job's transaction and return its hash"""
+        function = getattr(self.contract.functions, job.function)(*job.args)
+        async with self.nonces.lock(job.from_address):
+            nonce = await self.nonces.next_nonce(job.from_address)
+            try:
+                tx_hash = await asyncio.to_thread(function.transact, {
+                    "from": job.from_address,
+                    "value": job.value,
+                    "nonce": nonce
+                })
+            except Exception:
+                self.nonces.reset(job.from_address)
+                raise
+        return Web3.to_hex(tx_hash)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Transaction job %s for %s %s failed", job.function, job.kind, job.entity_id)
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, job: TransactionJob):
+        for attempt in range(1, self.submit_retries + 1):
+            try:
+                job.tx_hash = await self.submit(job)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not _transient(e):
+                    logger.exception("Failed to submit %s for %s %s", job.function, job.kind, job.entity_id)
+                    job.error = str(e)
+                    # A job whose handler failed is still stored, so the recovery sweep submits it again
+                    await self._handle([(job, None)])
+                    self._forget(job)
+                    return
+                logger.warning(
+                    "Submitting %s for %s %s failed (attempt %s of %s): %s",
+                    job.function, job.kind, job.entity_id, attempt, self.submit_retries, e
+                )
+                if attempt < self.submit_retries:
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+        else:
+            logger.error(
+                "Could not submit %s for %s %s; left for the recovery sweep",
+                job.function, job.kind, job.entity_id
+            )
+            self._forget(job)
+            return
+
+        # The transaction is out: only its receipt settles the job from here on
+        self.pending[job.tx_hash] = job
+        await self._record_submission(job)
+
+    async def _record_submission(self, job: TransactionJob):
+        """Store the hash of a sent transaction, retrying the write a few times"""
+        for attempt in range(1, self.db_retries + 1):
+            try:
+                await self._write_submission(job)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning(
+                    "Recording transaction %s failed (attempt %s of %s)",
+                    job.tx_hash, attempt, self.db_retries, exc_info=True
+                )
+                if attempt < self.db_retries:
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+        logger.error(
+            "Could not record transaction %s for %s %s; its receipt is still polled",
+            job.tx_hash, job.kind, job.entity_id
+        )
+
+    async def _write_submission(self, job: TransactionJob):
+        model = Purchase if job.kind == "purchase" else Book
+        async with self.session_factory() as db:
+            if job.id is not None:
+                await db.execute(
+                    update(PendingTransaction)
+                    .where(PendingTransaction.id == job.id)
+                    .values(tx_hash=job.tx_hash, status=TransactionStatus.SUBMITTED)
+                )
+            entity = await db.get(model, job.entity_id)
+            # The receipt may already have been handled
+            if entity is not None and entity.tx_status == TransactionStatus.PENDING:
+                # Book.transaction_hash records the addBook transaction only
+                if job.kind in ("add_book", "purchase"):
+                    entity.transaction_hash = job.tx_hash
+                entity.tx_status = TransactionStatus.SUBMITTED
+            await db.commit()
+
+    async def poll_once(self) -> int:
+        """Fetch receipts for submitted transactions; returns how many were settled"""
+        # Another poll may be handling some hashes already
+        tx_hashes = [tx_hash for tx_hash in self.pending if tx_hash not in self._settling][:self.batch_size]
+        if not tx_hashes:
+            return 0
+
+        self._settling.update(tx_hashes)
+        try:
+            receipts = await asyncio.to_thread(get_receipts_batch, self.web3, tx_hashes)
+            settled = [
+                (self.pending[tx_hash], receipt)
+                for tx_hash, receipt in receipts.items()
+                if receipt is not None and tx_hash in self.pending
+            ]
+            # Jobs whose handler failed stay pending and are tried again on the next poll
+            handled = await self._handle(settled)
+            for job in handled:
+                self.pending.pop(job.tx_hash, None)
+                self._forget(job)
+        finally:
+            self._settling.difference_update(tx_hashes)
+        return len(handled)
+
+    async def _poll_receipts(self):
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Receipt polling failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _handle(self, settled) -> List[TransactionJob]:
+        """Run the receipt handlers and delete the stored jobs; returns the jobs handled"""
+        if not settled:
+            return []
+        try:
+            await self._apply(settled)
+            handled = [job for job, _ in settled]
+        except Exception:
+            logger.exception("Handling %s receipts failed", len(settled))
+            handled = []
+            if len(settled) > 1:
+                # One at a time, so a job that keeps failing does not hold back the rest
+                for job, receipt in settled:
+                    try:
+                        await self._apply([(job, receipt)])
+                        handled.append(job)
+                    except Exception:
+                        logger.exception("Handling %s for %s %s failed", job.function, job.kind, job.entity_id)
+
+        book_ids = [job.entity_id for job in handled if job.kind != "purchase"]
+        if book_ids:
+            get_book_cache().invalidate_books(book_ids)
+        return handled
+
+    async def _apply(self, settled):
+        async with self.session_factory() as db:
+            for job, receipt in settled:
+                await RECEIPT_HANDLERS[job.kind](self, db, job, receipt)
+            job_ids = [job.id for job, _ in settled if job.id is not None]
+            if job_ids:
+                await db.execute(delete(PendingTransaction).where(PendingTransaction.id.in_(job_ids)))
+            await db.commit()
+
+    async def recover(self) -> int:
+        """
+        Renew this pipeline's claims, then queue (or, when already sent, poll)
+        the stored jobs it does not hold: its own turned away by a full queue
+        and any whose owner stopped renewing them. Returns how many were picked up.
+        """
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=self.claim_timeout)
+        table = PendingTransaction.__table__
+        claimable = or_(table.c.claimed_by.is_(None), table.c.claimed_at < expired)
+        picked = 0
+        async with self.session_factory() as db:
+            await db.execute(update(table).where(table.c.claimed_by == self.owner).values(claimed_at=now))
+            await db.commit()
+            rows = (await db.execute(
+                select(PendingTransaction)
+                .where(or_(PendingTransaction.claimed_by == self.owner, claimable))
+                .order_by(PendingTransaction.id)
+            )).scalars().all()
+
+            for row in rows:
+                sent = row.status == TransactionStatus.SUBMITTED and row.tx_hash is not None
+                if row.id in self._known or (not sent and self.queue.full()):
+                    continue
+                if row.claimed_by != self.owner:
+                    # Only one process wins a lapsed claim
+                    claimed = (await db.execute(
+                        update(table).where(table.c.id == row.id, claimable).values(claimed_by=self.owner, claimed_at=now)
+                    )).rowcount == 1
+                    await db.commit()
+                    if not claimed:
+                        continue
+
+                job = _job_from_row(row)
+                self._known.add(job.id)
+                if sent:
+                    self.pending[job.tx_hash] = job
+                else:
+                    self.queue.put_nowait(job)
+                picked += 1
+
+        if picked:
+            logger.info("Recovered %s stored transactions", picked)
+        return picked
+
+    async def _recover_periodically(self):
+        while True:
+            await asyncio.sleep(self.recovery_interval)
+            try:
+                await self.recover()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Recovering stored transactions failed")
+
+    async def drain(self, timeout: float = 30.0):
+        """Wait until every queued job has been submitted and settled (used by tests/scripts)"""
+        async def _wait():
+            await self.queue.join()
+            while self.pending:
+                await self.poll_once()
+                if self.pending:
+                    await asyncio.sleep(self.poll_interval)
+        await asyncio.wait_for(_wait(), timeout)
+
+def _succeeded(receipt) -> bool:
+    return receipt is not None and receipt["status"] == 1
+
+async def _handle_add_book(pipeline, db, job, receipt):
+    book = await db.get(Book, job.entity_id)
+    if book is None:
+        return
+    if _succeeded(receipt):
+        events = pipeline.contract.events.BookAdded().process_receipt(receipt)
+        if events:
+            book.contract_id = events[0]["args"]["bookId"]
+        book.tx_status = TransactionStatus.CONFIRMED
+    else:
+        book.tx_status = TransactionStatus.FAILED
+        book.is_active = False
+
+async def _handle_purchase(pipeline, db, job, receipt):
+    purchase = await db.get(Purchase, job.entity_id)
+    if purchase is None or purchase.tx_status == TransactionStatus.FAILED:
+        return
+    if purchase.transaction_hash is not None and purchase.transaction_hash != job.tx_hash:
+        # A newer attempt has taken over the purchase since this one was given up on
+        return
+    if _succeeded(receipt):
+        purchase.block_number = receipt["blockNumber"]
+        purchase.is_verified = True
+        purchase.tx_status = TransactionStatus.CONFIRMED
+    else:
+        # Kept as failed, like the verifier does: its royalty is voided by
+        # reconcile() and the buyer may purchase the book again
+        purchase.tx_status = TransactionStatus.FAILED
+        sold = [(purchase.book_id, purchase.purchase_date, purchase.price_paid)]
+        await db.run_sync(lambda session: remove_sales(session.connection(), sold))
+
+async def _handle_update_book(pipeline, db, job, receipt):
+    book = await db.get(Book, job.entity_id)
+    if book is None:
+        return
+    if _succeeded(receipt):
+        book.tx_status = TransactionStatus.CONFIRMED
+    else:
+        # Roll the listing back to what is still on chain
+        for key, value in job.meta.get("previous", {}).items():
+            setattr(book, key, value)
+        book.tx_status = TransactionStatus.FAILED
+        await db.flush()
+        await db.run_sync(index_books, [book.id])
+
+async def _handle_remove_book(pipeline, db, job, receipt):
+    book = await db.get(Book, job.entity_id)
+    if book is None:
+        return
+    if _succeeded(receipt):
+        await db.delete(book)
+        await db.flush()
+        await db.run_sync(index_books, [job.entity_id])
+    else:
+        book.is_active = True
+        book.tx_status = TransactionStatus.FAILED
+
+RECEIPT_HANDLERS: Dict[str, ReceiptHandler] = {
+    "add_book": _handle_add_book,
+    "purchase": _handle_purchase,
+    "update_book": _handle_update_book,
+    "remove_book": _handle_remove_book,
+}
+
+_pipeline: Optional[TransactionPipeline] = None
+
+def get_tx_pipeline() -> TransactionPipeline:
+    """Get the process-wide transaction pipeline"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = TransactionPipeline()
+    return _pipeline
+
+async def get_available_tx_pipeline() -> TransactionPipeline:
+    """Dependency that rejects new contract writes while the queue is saturated"""
+    pipeline = get_tx_pipeline()
+    if pipeline.queue.full():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Transaction queue is full, please retry shortly"
+        )
+    return pipeline
@@ -0,0 +1,254 @@
+import functools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+from eth_utils.abi import collapse_if_tuple
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from config import Config
+from utils.cache import MemoryCache
+from utils.rpc import RPCProvider
+
+_web3: Optional[Web3] = None
+_contracts: Dict[Tuple[int, str], Any] = {}
+
+def get_web3() -> Web3:
+    """Get the shared Web3 client, backed by the pooled multi-endpoint provider"""
+    global _web3
+    if _web3 is None:
+        _web3 = Web3(RPCProvider())
+    return _web3
+
+@functools.lru_cache(maxsize=None)
+def load_contract_abi(path: str = Config.CONTRACT_ABI_PATH) -> list:
+    """Load the BookStore ABI from the truffle build artifact (read once per path)"""
+    with open(path) as f:
+        return json.load(f)["abi"]
+
+def get_contract(web3: Optional[Web3] = None, address: Optional[str] = None):
+    """Get the BookStore contract bound to the configured address, built once per client"""
+    web3 = web3 or get_web3()
+    address = address or Config.CONTRACT_ADDRESS
+    if not address:
+        raise ValueError("CONTRACT_ADDRESS is not configured")
+    key = (id(web3), Web3.to_checksum_address(address))
+    contract = _contracts.get(key)
+    if contract is None or contract.w3 is not web3:
+        contract = _contracts[key] = web3.eth.contract(address=key[1], abi=load_contract_abi())
+    return contract
+
+def make_batch_request(
+    web3: Web3,
+    calls: Sequence[Tuple[str, list]],
+    result_formatter: Optional[Callable[[Any], Any]] = None
+) -> List[Any]:
+    """
+    Send several JSON-RPC calls in a single round trip and return their
+    results in call order, with result_formatter applied to non-null
+    results. Providers that cannot batch (such as eth-tester) fall back to
+    one request per call.
+    """
+    if not calls:
+        return []
+
+    provider = web3.provider
+    if isinstance(provider, RPCProvider):
+        responses = provider.make_batch_request(calls)
+    elif isinstance(provider, Web3.HTTPProvider):
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        response = requests.post(
+            provider.endpoint_uri,
+            json=payload,
+            **dict(provider.get_request_kwargs())
+        )
+        response.raise_for_status()
+        by_id = {item["id"]: item for item in response.json()}
+        responses = [by_id.get(i) for i in range(len(calls))]
+    else:
+        results = [web3.manager.request_blocking(method, params) for method, params in calls]
+        if result_formatter is None:
+            return results
+        return [result_formatter(result) if result is not None else None for result in results]
+
+    results = []
+    for i, item in enumerate(responses):
+        if item is None:
+            raise ValueError(f"Missing JSON-RPC response for call {i}")
+        if item.get("error"):
+            raise ValueError(f"JSON-RPC error for {calls[i][0]}: {item['error']}")
+        result = item.get("result")
+        if result is not None and result_formatter is not None:
+            result = result_formatter(result)
+        results.append(result)
+    return results
+
+# Receipt and log fields the JSON-RPC API sends as hex strings
+RECEIPT_INTS = ("blockNumber", "cumulativeGasUsed", "effectiveGasPrice", "gasUsed", "status", "transactionIndex", "type")
+RECEIPT_BYTES = ("blockHash", "transactionHash", "logsBloom")
+RECEIPT_ADDRESSES = ("from", "to", "contractAddress")
+LOG_INTS = ("blockNumber", "logIndex", "transactionIndex")
+LOG_BYTES = ("blockHash", "transactionHash", "data")
+
+def _convert(entry: dict, ints: Sequence[str], hashes: Sequence[str], addresses: Sequence[str]) -> dict:
+    converted = dict(entry)
+    for key in ints:
+        if isinstance(entry.get(key), str):
+            converted[key] = int(entry[key], 16)
+    for key in hashes:
+        if entry.get(key) is not None:
+            converted[key] = HexBytes(entry[key])
+    for key in addresses:
+        if entry.get(key):
+            converted[key] = Web3.to_checksum_address(entry[key])
+    return converted
+
+def format_receipt(receipt: dict) -> AttributeDict:
+    """A raw eth_getTransactionReceipt result as web3's get_transaction_receipt returns it"""
+    formatted = _convert(receipt, RECEIPT_INTS, RECEIPT_BYTES, RECEIPT_ADDRESSES)
+    formatted["logs"] = [
+        dict(_convert(log, LOG_INTS, LOG_BYTES, ("address",)), topics=[HexBytes(topic) for topic in log["topics"]])
+        for log in receipt.get("logs", [])
+    ]
+    return AttributeDict.recursive(formatted)
+
+def get_receipts_batch(web3: Web3, tx_hashes: Sequence[str]) -> Dict[str, Optional[AttributeDict]]:
+    """Fetch receipts for many transactions at once; pending transactions map to None"""
+    results = make_batch_request(
+        web3,
+        [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes],
+        result_formatter=format_receipt
+    )
+    return dict(zip(tx_hashes, results))
+
+def _python_value(output_abi: dict, value):
+    """A decoded ABI value as .call() returns it, with checksummed addresses and structs as dicts keyed by field name"""
+    abi_type = output_abi["type"]
+    if abi_type.endswith("]"):
+        item_abi = dict(output_abi, type=abi_type[:abi_type.rindex("[")])
+        return [_python_value(item_abi, item) for item in value]
+    components = output_abi.get("components")
+    if components:
+        return {
+            component["name"]: _python_value(component, field)
+            for component, field in zip(components, value)
+        }
+    if abi_type == "address":
+        return Web3.to_checksum_address(value)
+    return value
+
+class ContractReader:
+    """
+    Batched, cached reads of BookStore view functions.
+
+    Reads are pinned to a block: the head block number is fetched at most
+    once per ttl, and every requested (function, args) pair not already
+    cached for that block is sent as one eth_call in a JSON-RPC batch of up
+    to batch_size calls. Results are cached under (block, function, args)
+    for ttl seconds, so checking a user's 500 purchases is one round trip
+    and repeating it at the same head is none.
+    """
+
+    def __init__(
+        self,
+        contract=None,
+        ttl: float = Config.CONTRACT_READ_CACHE_TTL,
+        batch_size: int = Config.CONTRACT_READ_BATCH_SIZE,
+        max_entries: int = Config.CACHE_MAX_ENTRIES
+    ):
+        self.contract = contract or get_contract()
+        self.web3 = self.contract.w3
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.cache = MemoryCache(max_entries)
+        self.round_trips = 0
+        self._head: Optional[Tuple[float, int]] = None
+        self._head_lock = threading.Lock()
+
+    def block_number(self, refresh: bool = False) -> int:
+        """Head block number, fetched again once it is ttl seconds old"""
+        with self._head_lock:
+            now = time.monotonic()
+            if refresh or self._head is None or self._head[0] <= now:
+                self._head = (now + self.ttl, self.web3.eth.block_number)
+                self.round_trips += 1
+            return self._head[1]
+
+    def call_many(self, calls: Sequence[Tuple[str, tuple]], block: Optional[int] = None) -> List[Any]:
+        """
+        Results of view calls given as (function name, args) pairs, in call
+        order, all read at the same block (the cached head by default).
+        Single outputs are returned bare, several as a tuple; structs become dicts.
+        """
+        if block is None:
+            block = self.block_number()
+        keys = [self._key(block, name, args) for name, args in calls]
+        results = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            raw_results = make_batch_request(self.web3, [
+                ("eth_call", [
+                    {"to": self.contract.address, "data": self.contract.encodeABI(fn_name=calls[i][0], args=list(calls[i][1]))},
+                    hex(block)
+                ])
+                for i in chunk
+            ])
+            self.round_trips += 1
+            for i, raw in zip(chunk, raw_results):
+                # Wrapped so a cached falsy result is not mistaken for a miss
+                results[i] = (self._decode(calls[i][0], raw),)
+                self.cache.set(keys[i], results[i], ttl=self.ttl)
+        return [result[0] for result in results]
+
+    def book_details(self, book_ids: Iterable[int], block: Optional[int] = None) -> Dict[int, dict]:
+        book_ids = list(book_ids)
+        results = self.call_many([("getBookDetails", (book_id,)) for book_id in book_ids], block)
+        names = [output["name"] for output in self.contract.get_function_by_name("getBookDetails").abi["outputs"]]
+        return {book_id: dict(zip(names, result)) for book_id, result in zip(book_ids, results)}
+
+    def has_purchased(self, user: str, book_ids: Iterable[int], block: Optional[int] = None) -> Dict[int, bool]:
+        """Whether user owns each book, per the contract's userPurchases mapping"""
+        user = Web3.to_checksum_address(user)
+        book_ids = list(book_ids)
+        results = self.call_many([("userPurchases", (user, book_id)) for book_id in book_ids], block)
+        return dict(zip(book_ids, results))
+
+    def user_purchases(self, users: Iterable[str], block: Optional[int] = None) -> Dict[str, List[int]]:
+        return self._per_key("getUserPurchases", [Web3.to_checksum_address(user) for user in users], block)
+
+    def author_royalties(self, authors: Iterable[str], block: Optional[int] = None) -> Dict[str, List[dict]]:
+        return self._per_key("getAuthorRoyalties", [Web3.to_checksum_address(author) for author in authors], block)
+
+    def book_purchases(self, book_ids: Iterable[int], block: Optional[int] = None) -> Dict[int, List[dict]]:
+        return self._per_key("getBookPurchases", list(book_ids), block)
+
+    def _per_key(self, name: str, keys: List[Hashable], block: Optional[int]) -> dict:
+        results = self.call_many([(name, (key,)) for key in keys], block)
+        return dict(zip(keys, results))
+
+    def _key(self, block: int, name: str, args: tuple) -> str:
+        return f"{self.contract.address}:{block}:{name}:{json.dumps(list(args), default=str)}"
+
+    def _decode(self, name: str, raw) -> Any:
+        outputs = self.contract.get_function_by_name(name).abi["outputs"]
+        decoded = self.web3.codec.decode([collapse_if_tuple(output) for output in outputs], HexBytes(raw))
+        values = [_python_value(output, value) for output, value in zip(outputs, decoded)]
+        return values[0] if len(values) == 1 else tuple(values)
+
+_reader: Optional[ContractReader] = None
+
+def get_contract_reader() -> ContractReader:
+    """Get the shared reader for the configured BookStore contract"""
+    global _reader
+    if _reader is None:
+        _reader = ContractReader()
+    return _reader
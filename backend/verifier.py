@@ -0,0 +1,247 @@
+"""
+Bulk verification of submitted purchases against the chain.
+
+Purchases recorded with a transaction hash (including hashes supplied by
+client wallets) stay unverified until a receipt proves them. Each batch of
+up to VERIFIER_BATCH_SIZE submitted purchases costs one JSON-RPC batch of
+eth_getTransactionReceipt calls and two bulk UPDATEs. A purchase is
+verified when its transaction succeeded at least VERIFIER_CONFIRMATIONS
+blocks ago and emitted a BookPurchased event from the BookStore contract
+for the same book and buyer address with at least the recorded price.
+Reverted or mismatching transactions, and transactions still unknown to
+the node after VERIFIER_TIMEOUT seconds, are marked failed and taken off
+their book's total_sales and daily sales rollup.
+
+Royalties are settled along the way (utils.royalties): each run first
+creates the royalties owed for new purchases, then the RoyaltyPaid events
+in verified receipts mark them paid with the amount actually transferred,
+and finally royalties of purchases verified elsewhere are marked paid and
+those of failed purchases voided.
+
+Usage:
+    python verifier.py           # keep verifying as purchases come in
+    python verifier.py --once    # verify everything submitted so far and exit
+"""
+import argparse
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from eth_utils import event_abi_to_log_topic
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from web3 import Web3
+
+from config import Config
+from database import SessionLocal
+from models import Book, Purchase, TransactionStatus, User
+from utils import royalties
+from utils.sales import remove_sales
+from utils.web3_utils import get_contract, get_receipts_batch, get_web3
+
+logger = logging.getLogger(__name__)
+
+# An event price may fall short of the recorded float price by one part in this
+FLOAT_PRICE_SLACK = 10 ** 15
+
+@dataclass
+class VerifierStats:
+    verified: int = 0
+    failed: int = 0
+    pending: int = 0
+    elapsed: float = 0.0
+    lag_total: float = 0.0  # seconds from purchase to verification, summed
+    lag_max: float = 0.0
+    oldest_pending: Optional[float] = None  # age in seconds of the oldest purchase left unverified
+    royalties_settled: int = 0
+    royalties_paid: int = 0
+
+    @property
+    def per_minute(self) -> float:
+        return (self.verified + self.failed) / self.elapsed * 60 if self.elapsed else 0.0
+
+    @property
+    def lag_mean(self) -> float:
+        return self.lag_total / self.verified if self.verified else 0.0
+
+    def __str__(self):
+        oldest = f"{self.oldest_pending:.0f}s" if self.oldest_pending is not None else "none"
+        return (
+            f"{self.verified} verified, {self.failed} failed, {self.pending} pending in {self.elapsed:.2f}s "
+            f"({self.per_minute:.0f}/min, lag mean {self.lag_mean:.1f}s max {self.lag_max:.1f}s, "
+            f"oldest pending {oldest}; {self.royalties_settled} royalties settled, {self.royalties_paid} paid)"
+        )
+
+def _unverified():
+    return and_(
+        Purchase.tx_status == TransactionStatus.SUBMITTED,
+        Purchase.transaction_hash.isnot(None),
+        or_(Purchase.is_verified.is_(False), Purchase.is_verified.is_(None))
+    )
+
+class PurchaseVerifier:
+    def __init__(
+        self,
+        web3: Optional[Web3] = None,
+        contract=None,
+        session_factory=SessionLocal,
+        batch_size: int = Config.VERIFIER_BATCH_SIZE,
+        confirmations: int = Config.VERIFIER_CONFIRMATIONS,
+        timeout: float = Config.VERIFIER_TIMEOUT
+    ):
+        self.web3 = web3 or get_web3()
+        self.contract = contract or get_contract(self.web3)
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.confirmations = confirmations
+        self.timeout = timeout
+        self.event = self.contract.events.BookPurchased()
+        self.topic = event_abi_to_log_topic(self.event.abi)
+        self.royalty_event = self.contract.events.RoyaltyPaid()
+        self.royalty_topic = event_abi_to_log_topic(self.royalty_event.abi)
+
+    def _logs(self, receipt, topic):
+        # Only trust events the BookStore contract itself emitted
+        for log in receipt["logs"]:
+            if log["address"] == self.contract.address and log["topics"] and log["topics"][0] == topic:
+                yield log
+
+    def check(self, receipt, contract_id: int, buyer: str, price_paid: float) -> bool:
+        """Whether a successful receipt holds the BookStore BookPurchased event for this purchase"""
+        if receipt["status"] != 1 or not buyer:
+            return False
+        # Recorded prices are floats, good to about 15 significant digits;
+        # paying more than the recorded price is fine
+        expected = Web3.to_wei(Decimal(str(price_paid or 0)), "ether")
+        price = expected - expected // FLOAT_PRICE_SLACK
+        for log in self._logs(receipt, self.topic):
+            args = self.event.process_log(log)["args"]
+            if args["bookId"] == contract_id and args["buyer"].lower() == buyer.lower() and args["price"] >= price:
+                return True
+        return False
+
+    def royalty_payments(self, receipt, tx_hash: str) -> List[tuple]:
+        """(tx_hash, amount, block_number) of the RoyaltyPaid events in a receipt"""
+        return [
+            (
+                tx_hash,
+                float(Web3.from_wei(self.royalty_event.process_log(log)["args"]["amount"], "ether")),
+                receipt["blockNumber"]
+            )
+            for log in self._logs(receipt, self.royalty_topic)
+        ]
+
+    def verify_batch(self, db, after_id: int, head: int, stats: VerifierStats) -> Optional[int]:
+        """Verify the next batch of submitted purchases after after_id; returns the last id seen"""
+        rows = db.execute(
+            select(
+                Purchase.id, Purchase.book_id, Purchase.transaction_hash, Purchase.price_paid,
+                Purchase.purchase_date, Book.contract_id, User.eth_address
+            )
+            .join(Book, Book.id == Purchase.book_id)
+            .join(User, User.id == Purchase.user_id)
+            .where(_unverified(), Purchase.id > after_id)
+            .order_by(Purchase.id)
+            .limit(self.batch_size)
+        ).all()
+        if not rows:
+            return None
+
+        receipts = get_receipts_batch(self.web3, [row.transaction_hash for row in rows])
+        now = datetime.utcnow()
+        verified: List[Dict] = []
+        failed: List[int] = []
+        unsold: List[tuple] = []  # failed purchases, taken off total_sales and the rollups
+        payments: List[tuple] = []
+        for row in rows:
+            receipt = receipts[row.transaction_hash]
+            age = (now - row.purchase_date).total_seconds() if row.purchase_date else 0.0
+            if receipt is None:
+                if age > self.timeout:
+                    failed.append(row.id)
+                    unsold.append((row.book_id, row.purchase_date, row.price_paid))
+                else:
+                    stats.pending += 1
+            elif receipt["blockNumber"] > head - self.confirmations:
+                stats.pending += 1
+            elif self.check(receipt, row.contract_id, row.eth_address, row.price_paid):
+                verified.append({"b_id": row.id, "b_block": receipt["blockNumber"]})
+                payments.extend(self.royalty_payments(receipt, row.transaction_hash))
+                stats.lag_total += age
+                stats.lag_max = max(stats.lag_max, age)
+            else:
+                failed.append(row.id)
+                unsold.append((row.book_id, row.purchase_date, row.price_paid))
+
+        table = Purchase.__table__
+        if verified:
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(
+                    is_verified=True,
+                    block_number=bindparam("b_block"),
+                    tx_status=TransactionStatus.CONFIRMED
+                ),
+                verified
+            )
+        if failed:
+            db.execute(
+                update(table)
+                .where(table.c.id.in_(failed))
+                .values(tx_status=TransactionStatus.FAILED)
+            )
+            remove_sales(db.connection(), unsold)
+        if payments:
+            stats.royalties_paid += royalties.mark_paid(db.connection(), payments)
+        db.commit()
+        stats.verified += len(verified)
+        stats.failed += len(failed)
+        return rows[-1].id
+
+    def run_once(self) -> VerifierStats:
+        """Check every purchase submitted so far, one batch at a time"""
+        stats = VerifierStats()
+        started = time.monotonic()
+        head = self.web3.eth.block_number
+        with self.session_factory() as db:
+            stats.royalties_settled = royalties.settle(db.connection())
+            db.commit()
+            after_id = 0
+            while after_id is not None:
+                after_id = self.verify_batch(db, after_id, head, stats)
+                stats.elapsed = time.monotonic() - started
+            stats.royalties_paid += royalties.reconcile(db.connection())["paid"]
+            db.commit()
+            oldest = db.scalar(select(func.min(Purchase.purchase_date)).where(_unverified()))
+        if oldest is not None:
+            stats.oldest_pending = (datetime.utcnow() - oldest).total_seconds()
+        stats.elapsed = time.monotonic() - started
+        return stats
+
+    def run_forever(self, poll_interval: float = Config.VERIFIER_POLL_INTERVAL):
+        while True:
+            try:
+                stats = self.run_once()
+                if stats.verified or stats.failed or stats.royalties_settled:
+                    logger.info("Verified purchases: %s", stats)
+            except Exception:
+                logger.exception("Verifier run failed")
+            time.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify submitted purchases against the chain")
+    parser.add_argument("--once", action="store_true", help="verify what is pending and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    verifier = PurchaseVerifier()
+    if args.once:
+        print(f"✅ {verifier.run_once()}")
+    else:
+        verifier.run_forever()
+
+if __name__ == "__main__":
+    main()